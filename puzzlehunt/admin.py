@@ -1,9 +1,10 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.db.models.functions import Lower
 
 from puzzlehunt.models import Hunt, Puzzle, Prepuzzle, Team, PuzzleStatus, Submission, User, Event,\
     Response, Hint, Update, TeamRankingRule, PuzzleFile, SolutionFile, HuntFile,\
-    PrepuzzleFile, DisplayOnlyHunt, NotificationPlatform, NotificationSubscription, CannedHint
+    PrepuzzleFile, DisplayOnlyHunt, NotificationPlatform, NotificationSubscription, CannedHint, NotificationDelivery
 from puzzlehunt.utils import create_media_files
 from admin_interface.models import Theme
 from django.utils.translation import gettext_lazy as _
@@ -286,6 +287,12 @@ class TeamAdmin(admin.ModelAdmin):
             return ' '.join(obj.badges)
         return '-'
 
+    def save_model(self, request, obj, form, change):
+        # A new unlock window changes when the team's config rules next trigger, so check it again right away
+        if {'playtester', 'playtest_start_date', 'playtest_end_date'} & set(form.changed_data):
+            obj.next_unlock_check = None
+        super().save_model(request, obj, form, change)
+
     # TODO: find a way to slim down this inline in order to bring it back.
     # inlines = [PuzzleStatusInline]
 
@@ -418,8 +425,8 @@ class NotificationSubscriptionAdmin(admin.ModelAdmin):
             'fields': ('user', 'platform', 'hunt', 'active')
         }),
         (_('Notification Settings'), {
-            'fields': ('event_types', 'destination'),
-            'description': _('Event types to notify on and platform-specific destination')
+            'fields': ('event_types', 'destination', 'digest_window'),
+            'description': _('Event types to notify on, platform-specific destination and digest window')
         }),
         (_('Timestamps'), {
             'fields': ('created_at', 'updated_at'),
@@ -431,6 +438,49 @@ class NotificationSubscriptionAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'platform', 'hunt')
 
+@admin.register(NotificationDelivery)
+class NotificationDeliveryAdmin(admin.ModelAdmin):
+    change_list_template = "admin/notification_delivery_change_list.html"
+    list_display = ['event', 'subscription', 'status', 'attempts', 'next_attempt_time', 'truncated_error']
+    list_filter = ['status', 'subscription__platform']
+    search_fields = ['subscription__user__email', 'last_error']
+    raw_id_fields = ['event', 'subscription']
+    readonly_fields = ['created_at', 'sent_time']
+    actions = ['retry_deliveries']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('subscription__user', 'subscription__platform')
+
+    @admin.display(description="Last error")
+    def truncated_error(self, obj):
+        return truncatechars(obj.last_error, 80)
+
+    @admin.action(description="Retry selected deliveries")
+    def retry_deliveries(self, request, queryset):
+        from puzzlehunt.notifications import retry_notification_delivery
+        delivery_ids = list(queryset.exclude(status=NotificationDelivery.Status.SENT).values_list('pk', flat=True))
+        NotificationDelivery.objects.filter(pk__in=delivery_ids).update(
+            status=NotificationDelivery.Status.PENDING, attempts=0, next_attempt_time=None)
+        for delivery_id in delivery_ids:
+            retry_notification_delivery(delivery_id)
+        self.message_user(request, f"Retrying {len(delivery_ids)} deliveries")
+
+    def changelist_view(self, request, extra_context=None):
+        # Delivery counts by platform and status, shown above the list
+        counts = (NotificationDelivery.objects.values('subscription__platform__name', 'status')
+                  .annotate(count=Count('pk')).order_by('subscription__platform__name'))
+        statuses = NotificationDelivery.Status.values
+        stats = {}
+        for row in counts:
+            platform_stats = stats.setdefault(row['subscription__platform__name'], dict.fromkeys(statuses, 0))
+            platform_stats[row['status']] = row['count']
+        extra_context = extra_context or {}
+        extra_context['delivery_stats'] = [(platform, [platform_stats[status] for status in statuses])
+                                           for platform, platform_stats in stats.items()]
+        extra_context['delivery_statuses'] = NotificationDelivery.Status.labels
+        return super().changelist_view(request, extra_context=extra_context)
+
+
 @admin.register(CannedHint)
 class CannedHintAdmin(admin.ModelAdmin):
     list_display = ['puzzle', 'order', 'truncated_text']
@@ -0,0 +1,176 @@
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db.models import F, Q, Count, Avg, OuterRef, Subquery, Window, PositiveIntegerField
+from django.db.models.functions import Coalesce, Lower, RowNumber
+from django.utils import timezone
+
+# Snapshots are refreshed every minute for running hunts by refresh_chart_snapshots, this only bounds how
+# stale a snapshot of a hunt that is no longer being refreshed can get
+SNAPSHOT_TIMEOUT = 10 * 60
+# Number of commonly guessed wrong answers shown per puzzle
+NUM_COMMON_GUESSES = 6
+# Submission counts at or above this are grouped together in the submissions to solve table
+SUB_TABLE_CUTOFF = 5
+
+
+def _snapshot_key(hunt_id):
+    return f"chart_snapshot:{hunt_id}"
+
+
+def activity_series(hunt, event_type, width, tz):
+    """
+    Chart a hunt's events of one type over time from the activity rollups.
+
+    Returns:
+        list: {"time", "amount"} points, one per bucket of the given width with any events in it
+    """
+    from .models import ActivityRollup
+    return [{"time": bucket_start.strftime("%m/%d/%Y - %H:%M"), "amount": amount}
+            for bucket_start, amount in ActivityRollup.objects.series(hunt, event_type, width, tz)]
+
+
+def _sub_table(submission_counts):
+    """ Turn the submission counts of the teams that solved a puzzle into (submissions, teams) rows """
+    sub_table_full = sorted(Counter(submission_counts).items())
+    sub_table = sub_table_full[:SUB_TABLE_CUTOFF]
+    if len(sub_table_full) > SUB_TABLE_CUTOFF:
+        sub_table.append((f"{int(sub_table[-1][0]) + 1}+", sum(x[1] for x in sub_table_full[SUB_TABLE_CUTOFF:])))
+    return sub_table
+
+
+def compute_chart_data(hunt):
+    """
+    Compute the per puzzle statistics shown on the staff charts page for a hunt.
+
+    Each statistic is one query grouped by puzzle, so the number of queries doesn't grow with the
+    number of puzzles or teams. Playtesters are left out of the per puzzle counts, as they always have been.
+
+    Returns:
+        dict: The chart and table data, made only of plain values so that it can be cached
+    """
+    from .models import PuzzleStatus, Submission, Hint
+
+    num_teams = hunt.active_teams.count()
+    puzzles = list(hunt.puzzle_set.order_by('order_number').values('id', 'name', 'order_number'))
+
+    statuses = PuzzleStatus.objects.filter(puzzle__hunt=hunt)
+    solved = statuses.filter(solve_time__isnull=False)
+    status_stats = {row['puzzle']: row for row in statuses.filter(team__playtester=False).values('puzzle').annotate(
+        num_unlocks=Count('pk', filter=Q(unlock_time__isnull=False)),
+        num_solves=Count('pk', filter=Q(solve_time__isnull=False)),
+        avg_solve_time=Avg(F('solve_time') - F('unlock_time'), filter=Q(solve_time__isnull=False)),
+    ).order_by()}
+
+    # The earliest solve of each puzzle, along with who solved it
+    earliest_time = (solved.filter(puzzle=OuterRef('puzzle'), team__playtester=False)
+                     .order_by('solve_time').values('solve_time')[:1])
+    first_solves = {}
+    for puzzle_id, team_name, solve_time in (solved.filter(team__playtester=False, solve_time=Subquery(earliest_time))
+                                             .order_by('solve_time', 'pk')
+                                             .values_list('puzzle_id', 'team__name', 'solve_time')):
+        first_solves.setdefault(puzzle_id, (team_name, solve_time))
+
+    num_hints = dict(Hint.objects.filter(puzzle__hunt=hunt, team__playtester=False)
+                     .values('puzzle').annotate(c=Count('*')).order_by().values_list('puzzle', 'c'))
+
+    submissions = Submission.objects.filter(puzzle__hunt=hunt).alias(
+        text_lower=Lower('submission_text'), answer_lower=Lower('puzzle__answer'))
+    not_answer = ~Q(text_lower=F('answer_lower'))
+    submission_stats = {row['puzzle']: row for row in submissions.values('puzzle').annotate(
+        num_submissions=Count('pk', filter=Q(team__playtester=False)),
+        num_custom_response=Count('pk', filter=Q(matched_response__isnull=False) & not_answer),
+    ).order_by()}
+
+    # The most common wrong answers to each puzzle that didn't match a custom response
+    common_guesses = defaultdict(list)
+    guesses = (submissions.filter(not_answer, matched_response__isnull=True)
+               .values('puzzle', 'submission_text').annotate(count=Count('*'))
+               .annotate(guess_rank=Window(RowNumber(), partition_by=F('puzzle'),
+                                           order_by=[F('count').desc(), F('submission_text').asc()]))
+               .filter(guess_rank__lte=NUM_COMMON_GUESSES)
+               .order_by('puzzle', 'guess_rank'))
+    for guess in guesses:
+        common_guesses[guess['puzzle']].append({"submission_text": guess['submission_text'],
+                                                "count": guess['count']})
+
+    # How many submissions each team that solved a puzzle made to it
+    team_submissions = (Submission.objects.filter(team=OuterRef('team'), puzzle=OuterRef('puzzle'))
+                        .values('team', 'puzzle').annotate(c=Count('*')).values('c'))
+    solve_submissions = defaultdict(list)
+    for puzzle_id, num_subs in solved.annotate(
+            num_s=Coalesce(Subquery(team_submissions, output_field=PositiveIntegerField()), 0)
+    ).values_list('puzzle_id', 'num_s'):
+        solve_submissions[puzzle_id].append(num_subs)
+
+    stats_puzzles = []
+    chart_solves_data = []
+    chart_submissions_data = []
+    chart_hints_data = []
+    for puzzle in puzzles:
+        puzzle_id = puzzle['id']
+        stats = status_stats.get(puzzle_id, {})
+        num_unlocks = stats.get('num_unlocks', 0)
+        num_solves = stats.get('num_solves', 0)
+        submission_counts = submission_stats.get(puzzle_id, {})
+        num_custom_response = submission_counts.get('num_custom_response', 0)
+        first_solve_team, first_solve_time = first_solves.get(puzzle_id, (None, None))
+        puzzle.update({
+            "num_unlocks": num_unlocks,
+            "num_solves": num_solves,
+            "num_submissions": submission_counts.get('num_submissions', 0),
+            "num_hints": num_hints.get(puzzle_id, 0),
+            "avg_solve_time": stats.get('avg_solve_time'),
+            "num_custom_response": num_custom_response,
+            "num_incorrect": submission_counts.get('num_submissions', 0) - num_solves - num_custom_response,
+            "first_solve_team": first_solve_team,
+            "first_solve_time": first_solve_time,
+            "commonly_guessed_answers": common_guesses.get(puzzle_id, []),
+            "sub_table": _sub_table(solve_submissions.get(puzzle_id, [])),
+        })
+        stats_puzzles.append(puzzle)
+
+        chart_solves_data.append({
+            "name": puzzle['name'],
+            "locked": num_teams - num_unlocks,
+            "unlocked": num_unlocks - num_solves,
+            "solved": num_solves,
+        })
+        chart_submissions_data.append({
+            "name": puzzle['name'],
+            "incorrect": puzzle['num_incorrect'],
+            "custom_response": num_custom_response,
+            "correct": num_solves,
+        })
+        chart_hints_data.append({
+            "name": puzzle['name'],
+            "hints": puzzle['num_hints'],
+        })
+
+    return {
+        'chart_solves_data': chart_solves_data,
+        'chart_submissions_data': chart_submissions_data,
+        'chart_hints_data': chart_hints_data,
+        'stats_puzzles': stats_puzzles,
+        'num_teams': num_teams,
+    }
+
+
+def refresh_chart_snapshot(hunt):
+    """
+    Recompute a hunt's chart data and store it as the hunt's snapshot.
+
+    Returns:
+        dict: The snapshot, holding the chart data and when it was computed
+    """
+    snapshot = {"computed_at": timezone.now(), "data": compute_chart_data(hunt)}
+    cache.set(_snapshot_key(hunt.pk), snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def get_chart_snapshot(hunt):
+    """ Get a hunt's cached chart snapshot, computing it if there isn't one """
+    snapshot = cache.get(_snapshot_key(hunt.pk))
+    if snapshot is None:
+        snapshot = refresh_chart_snapshot(hunt)
+    return snapshot
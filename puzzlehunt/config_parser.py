@@ -1,5 +1,8 @@
 from pypeg2 import parse, re, attr, List, csl, some, maybe_some, comment_sh
+from collections import deque, namedtuple
+from dataclasses import dataclass, field
 from datetime import timedelta
+import hashlib
 
 # Regexes
 time_delta = re.compile(r"\d?\d:\d\d")
@@ -476,4 +479,619 @@ def process_config_rules(rules, puzzle_statuses, start_time, current_time):
                                 earned_badges.append(badge_text)
                                 changed = True
 
-    return unlocked_puzzles, points, hints, puzzle_hints, earned_badges
\ No newline at end of file
+    return unlocked_puzzles, points, hints, puzzle_hints, earned_badges
+
+
+# Compiled rules
+#
+# The functions above interpret the pypeg2 AST directly, re-splitting time strings and re-filtering
+# subrule lists on every visit. compile_config turns a parsed config into closures with all of that
+# work done up front (integer minutes, resolved puzzle IDs, flattened And/Or/SomeOf children) so that
+# evaluating a rule for a team is just a handful of dict lookups and comparisons.
+#
+# Every compiled rule is called as fn(statuses, start_time, current_time, time_elapsed, points).
+
+@dataclass
+class CompiledRule:
+    """A single unlock rule compiled into a counting function plus its precomputed rewards."""
+    index: int
+    count: object  # fn(...) -> int, the number of times the rule currently applies
+    rewards: tuple  # tuple of (reward type, amount, puzzle ID) tuples
+    references: frozenset = frozenset()  # puzzle IDs whose unlock or solve the rule looks at
+    uses_points: bool = False  # whether the rule looks at the team's point total
+    next_change: object = None  # fn(...) -> datetime or None, only set for rules that depend on time
+
+
+@dataclass
+class CompiledConfig:
+    """A fully compiled hunt config, ready to be evaluated with process_compiled_rules."""
+    rules: list
+    # Reverse indexes used by process_solve_rules to find the rules a change can affect
+    rules_by_puzzle: dict = field(default_factory=dict)  # puzzle ID -> rules referencing it
+    points_rules: tuple = ()  # rules that reference the team's point total
+    puzzle_hint_rules: dict = field(default_factory=dict)  # puzzle ID -> rules granting hints for it
+    time_rules: tuple = ()  # rules whose value can change with time alone, used by next_trigger_time
+    badge_order: dict = field(default_factory=dict)  # badge text -> index of the first rule granting it
+
+    def order_badges(self, badges):
+        """Sort badges into the order the config first grants them, with any it no longer grants last."""
+        return sorted(badges, key=lambda badge: self.badge_order.get(badge, len(self.rules)))
+
+
+def _to_minutes(amount, unit):
+    minutes = int(amount)
+    if unit.unit.upper().startswith("HOUR"):
+        minutes *= 60
+    return minutes
+
+
+def _to_offset(time_str):
+    hours, minutes = time_str.split(":")
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def _unwrap(item):
+    while isinstance(item, Parenthesized):
+        item = item.item
+    return item
+
+
+def _flatten_children(rule, rule_type):
+    """Get the non-string children of an And/Or, inlining nested groups of the same type."""
+    children = []
+    for item in rule:
+        if isinstance(item, str):
+            continue
+        item = _unwrap(item)
+        if isinstance(item, rule_type):
+            children.extend(_flatten_children(item, rule_type))
+        else:
+            children.append(item)
+    return children
+
+
+def _compile_point_in_time(item, resolve):
+    """Compile a PointInTime into fn(statuses, start_time) -> datetime or None"""
+    match item:
+        case TimeSinceStart():
+            offset = _to_offset(item.time)
+            return lambda statuses, start_time: start_time + offset
+        case PuzzleSolve():
+            puzzle_id = resolve(item.puzzle.id)
+
+            def solve_time(statuses, start_time):
+                status = statuses.get(puzzle_id)
+                return status.solve_time if status is not None else None
+            return solve_time
+        case PuzzleUnlock():
+            puzzle_id = resolve(item.puzzle.id)
+
+            def unlock_time(statuses, start_time):
+                status = statuses.get(puzzle_id)
+                return status.unlock_time if status is not None else None
+            return unlock_time
+        case _:
+            raise ValueError(f"Unknown point in time type: {type(item)} - {item}")
+
+
+def _compile_condition(rule, resolve):
+    """Compile a single-use rule into fn(statuses, start_time, current_time, time_elapsed, points) -> bool"""
+    rule = _unwrap(rule)
+    match rule:
+        case And():
+            checks = tuple(_compile_condition(r, resolve) for r in _flatten_children(rule, And))
+
+            def check_and(statuses, start_time, current_time, time_elapsed, points):
+                for check in checks:
+                    if not check(statuses, start_time, current_time, time_elapsed, points):
+                        return False
+                return True
+            return check_and
+
+        case Or():
+            checks = tuple(_compile_condition(r, resolve) for r in _flatten_children(rule, Or))
+
+            def check_or(statuses, start_time, current_time, time_elapsed, points):
+                for check in checks:
+                    if check(statuses, start_time, current_time, time_elapsed, points):
+                        return True
+                return False
+            return check_or
+
+        case SomeOf():
+            num = int(rule.num)
+            checks = tuple(_compile_condition(r, resolve) for r in rule
+                           if not isinstance(r, str) and not isinstance(r, int))
+
+            def check_some_of(statuses, start_time, current_time, time_elapsed, points):
+                met = 0
+                for check in checks:
+                    if check(statuses, start_time, current_time, time_elapsed, points):
+                        met += 1
+                        if met >= num:
+                            return True
+                return met >= num
+            return check_some_of
+
+        case PuzzleID() | PuzzleSolve():
+            puzzle_id = resolve(rule.id if isinstance(rule, PuzzleID) else rule.puzzle.id)
+
+            def check_solved(statuses, start_time, current_time, time_elapsed, points):
+                status = statuses.get(puzzle_id)
+                return status is not None and status.solve_time is not None
+            return check_solved
+
+        case PuzzleUnlock():
+            puzzle_id = resolve(rule.puzzle.id)
+
+            def check_unlocked(statuses, start_time, current_time, time_elapsed, points):
+                status = statuses.get(puzzle_id)
+                return status is not None and status.unlock_time is not None
+            return check_unlocked
+
+        case TimeSinceStart():
+            offset = _to_offset(rule.time)
+            return lambda statuses, start_time, current_time, time_elapsed, points: time_elapsed >= offset
+
+        case NumPoints():
+            needed = int(rule.points)
+            return lambda statuses, start_time, current_time, time_elapsed, points: points >= needed
+
+        case DelayedAction():
+            get_trigger_time = _compile_point_in_time(rule.start_time, resolve)
+            delay = timedelta(minutes=_to_minutes(rule.delay, rule.unit))
+
+            def check_delayed(statuses, start_time, current_time, time_elapsed, points):
+                trigger_time = get_trigger_time(statuses, start_time)
+                return trigger_time is not None and current_time >= trigger_time + delay
+            return check_delayed
+
+        case ConditionalDelayedAction():
+            condition = _compile_condition(rule.condition, resolve)
+            action = _compile_condition(rule.action, resolve)
+
+            def check_conditional_delayed(statuses, start_time, current_time, time_elapsed, points):
+                return (condition(statuses, start_time, current_time, time_elapsed, points) and
+                        action(statuses, start_time, current_time, time_elapsed, points))
+            return check_conditional_delayed
+
+        case _:
+            raise ValueError(f"Unknown rule type: {type(rule)} - {rule}")
+
+
+def _compile_interval(rule):
+    """Compile a TimeInterval into fn(since, current_time) -> int"""
+    interval = _to_minutes(rule.interval, rule.unit)
+
+    def count_intervals(since, current_time):
+        return int((current_time - since).total_seconds() / 60) // interval
+    return count_intervals
+
+
+def _compile_count(rule, resolve):
+    """Compile any rule into fn(statuses, start_time, current_time, time_elapsed, points) -> int"""
+    match rule:
+        case TimeInterval():
+            count_intervals = _compile_interval(rule)
+            return lambda statuses, start_time, current_time, time_elapsed, points: count_intervals(start_time, current_time)
+
+        case TimeIntervalAfter():
+            count_intervals = _compile_interval(rule.interval)
+            get_since = _compile_point_in_time(rule.start_time, resolve)
+
+            def count_after(statuses, start_time, current_time, time_elapsed, points):
+                since = get_since(statuses, start_time)
+                if since is None:
+                    return 0
+                return count_intervals(since, current_time)
+            return count_after
+
+        case ConditionalTimeInterval():
+            condition = _compile_condition(rule.condition, resolve)
+            count_inner = _compile_count(rule.interval, resolve)
+
+            def count_conditional(statuses, start_time, current_time, time_elapsed, points):
+                if not condition(statuses, start_time, current_time, time_elapsed, points):
+                    return 0
+                return count_inner(statuses, start_time, current_time, time_elapsed, points)
+            return count_conditional
+
+        case LimitedTimeInterval():
+            limit = int(rule.limit)
+            count_inner = _compile_count(rule.interval, resolve)
+            return lambda *args: min(count_inner(*args), limit)
+
+        case _:
+            check = _compile_condition(rule, resolve)
+            return lambda *args: 1 if check(*args) else 0
+
+
+def _earliest(*times):
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+
+def _compile_next_interval(rule, get_since):
+    """Compile a TimeInterval into fn(...) -> the next time its interval count increases"""
+    interval = _to_minutes(rule.interval, rule.unit)
+
+    def next_interval(statuses, start_time, current_time, time_elapsed, points):
+        since = get_since(statuses, start_time)
+        if since is None:
+            return None
+        if current_time < since:
+            return since + timedelta(minutes=interval)
+        elapsed = int((current_time - since).total_seconds() / 60)
+        return since + timedelta(minutes=(elapsed // interval + 1) * interval)
+    return next_interval
+
+
+def _compile_next_change(rule, resolve):
+    """
+    Compile a rule into fn(statuses, start_time, current_time, time_elapsed, points) -> datetime or None,
+    the next time after current_time at which the passage of time alone could change the rule's value.
+    Returns None instead of a function if the rule doesn't depend on time at all.
+
+    The times returned may be earlier than strictly necessary, but are never later.
+    """
+    rule = _unwrap(rule)
+    match rule:
+        case TimeSinceStart():
+            offset = _to_offset(rule.time)
+
+            def next_since_start(statuses, start_time, current_time, time_elapsed, points):
+                trigger = start_time + offset
+                return trigger if trigger > current_time else None
+            return next_since_start
+
+        case DelayedAction():
+            get_trigger_time = _compile_point_in_time(rule.start_time, resolve)
+            delay = timedelta(minutes=_to_minutes(rule.delay, rule.unit))
+
+            def next_delayed(statuses, start_time, current_time, time_elapsed, points):
+                trigger_time = get_trigger_time(statuses, start_time)
+                if trigger_time is None:
+                    return None
+                trigger = trigger_time + delay
+                return trigger if trigger > current_time else None
+            return next_delayed
+
+        case TimeInterval():
+            return _compile_next_interval(rule, lambda statuses, start_time: start_time)
+
+        case TimeIntervalAfter():
+            return _compile_next_interval(rule.interval, _compile_point_in_time(rule.start_time, resolve))
+
+        case LimitedTimeInterval():
+            limit = int(rule.limit)
+            count_inner = _compile_count(rule.interval, resolve)
+            next_inner = _compile_next_change(rule.interval, resolve)
+
+            def next_limited(*args):
+                if count_inner(*args) >= limit:
+                    return None
+                return next_inner(*args)
+            return next_limited
+
+        case ConditionalTimeInterval():
+            condition = _compile_condition(rule.condition, resolve)
+            next_condition = _compile_next_change(rule.condition, resolve)
+            next_inner = _compile_next_change(rule.interval, resolve)
+
+            def next_conditional(*args):
+                # The interval only matters once the condition holds
+                next_time = next_condition(*args) if next_condition is not None else None
+                if condition(*args):
+                    next_time = _earliest(next_time, next_inner(*args))
+                return next_time
+            return next_conditional
+
+        case ConditionalDelayedAction():
+            children = [rule.condition, rule.action]
+
+        case And() | Or() | SomeOf():
+            children = [item for item in rule if not isinstance(item, (str, int))]
+
+        case _:
+            return None
+
+    next_changes = tuple(f for f in (_compile_next_change(c, resolve) for c in children) if f is not None)
+    if not next_changes:
+        return None
+    return lambda *args: _earliest(*(next_change(*args) for next_change in next_changes))
+
+
+def _collect_references(rule, resolve, references):
+    """Add the puzzle IDs a rule refers to into references, returning whether it refers to points."""
+    rule = _unwrap(rule)
+    match rule:
+        case PuzzleID():
+            references.add(resolve(rule.id))
+            return False
+        case PuzzleSolve() | PuzzleUnlock():
+            references.add(resolve(rule.puzzle.id))
+            return False
+        case NumPoints():
+            return True
+        case And() | Or() | SomeOf():
+            uses_points = False
+            for item in rule:
+                if not isinstance(item, (str, int)):
+                    uses_points |= _collect_references(item, resolve, references)
+            return uses_points
+        case DelayedAction() | TimeIntervalAfter():
+            return _collect_references(rule.start_time, resolve, references)
+        case ConditionalDelayedAction():
+            return (_collect_references(rule.condition, resolve, references) |
+                    _collect_references(rule.action, resolve, references))
+        case ConditionalTimeInterval():
+            return (_collect_references(rule.condition, resolve, references) |
+                    _collect_references(rule.interval, resolve, references))
+        case LimitedTimeInterval():
+            return _collect_references(rule.interval, resolve, references)
+        case _:
+            return False
+
+
+def _compile_rewards(unlockable, resolve):
+    items = unlockable if isinstance(unlockable, List) else [unlockable]
+    rewards = []
+    for item in items:
+        match item:
+            case PuzzleID():
+                rewards.append(("puzzle", None, resolve(item.id)))
+            case NumPoints():
+                rewards.append(("points", int(item.points), None))
+            case NumHints():
+                rewards.append(("hints", int(item.hints), None))
+            case NumPuzzleHints():
+                rewards.append(("puzzle_hints", int(item.hints), resolve(item.puzzle.id)))
+            case Badge():
+                rewards.append(("badge", item.text, None))
+    return tuple(rewards)
+
+
+def compile_config(config, puzzle_ids=None):
+    """
+    Compile a config returned by parse_config into a CompiledConfig.
+
+    Args:
+        config: The parsed ConfigFile
+        puzzle_ids: Optional set of valid puzzle IDs, used to map the upper-cased IDs in the
+                    config back to the IDs as they are stored in the database
+
+    Returns:
+        A CompiledConfig that can be passed to process_compiled_rules
+    """
+    canonical_ids = {pid.upper(): pid for pid in puzzle_ids} if puzzle_ids else {}
+
+    def resolve(puzzle_id):
+        return canonical_ids.get(puzzle_id.upper(), puzzle_id)
+
+    compiled = CompiledConfig(rules=[])
+    points_rules = []
+    time_rules = []
+    for index, rule in enumerate(config):
+        references = set()
+        uses_points = _collect_references(rule.rule, resolve, references)
+        compiled_rule = CompiledRule(
+            index=index,
+            count=_compile_count(rule.rule, resolve),
+            rewards=_compile_rewards(rule.unlockable, resolve),
+            references=frozenset(references),
+            uses_points=uses_points,
+            next_change=_compile_next_change(rule.rule, resolve),
+        )
+        compiled.rules.append(compiled_rule)
+
+        for puzzle_id in compiled_rule.references:
+            compiled.rules_by_puzzle.setdefault(puzzle_id, []).append(compiled_rule)
+        if uses_points:
+            points_rules.append(compiled_rule)
+        if compiled_rule.next_change is not None:
+            time_rules.append(compiled_rule)
+        for reward_type, amount, puzzle_id in compiled_rule.rewards:
+            if reward_type == "puzzle_hints":
+                rules_for_puzzle = compiled.puzzle_hint_rules.setdefault(puzzle_id, [])
+                if compiled_rule not in rules_for_puzzle:
+                    rules_for_puzzle.append(compiled_rule)
+            elif reward_type == "badge":
+                compiled.badge_order.setdefault(amount, index)
+    compiled.points_rules = tuple(points_rules)
+    compiled.time_rules = tuple(time_rules)
+    return compiled
+
+
+# Maps hunt IDs to (cache key, CompiledConfig). This is intentionally process local: compiled rules are
+# closures and can't be shared through Redis, but recompiling once per worker per config change is cheap.
+_compiled_config_cache = {}
+
+
+def config_cache_key(config_str, puzzle_ids, order_to_id):
+    """Build a cache key from everything that affects the compiled form of a config."""
+    key = hashlib.sha256(config_str.encode("utf-8"))
+    key.update(repr(sorted(puzzle_ids)).encode("utf-8"))
+    key.update(repr(sorted(order_to_id.items())).encode("utf-8"))
+    return key.hexdigest()
+
+
+def get_compiled_config(hunt_id, config_str, puzzle_ids, order_to_id):
+    """
+    Parse and compile a hunt config, reusing the previously compiled copy if neither the config
+    nor the hunt's puzzles have changed since it was built.
+
+    Raises:
+        ValueError: If the config fails to parse (failures are never cached)
+    """
+    key = config_cache_key(config_str, puzzle_ids, order_to_id)
+    cached = _compiled_config_cache.get(hunt_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    compiled = compile_config(parse_config(config_str, puzzle_ids, order_to_id), puzzle_ids)
+    _compiled_config_cache[hunt_id] = (key, compiled)
+    return compiled
+
+
+def process_compiled_rules(compiled_config, puzzle_statuses, start_time, current_time):
+    """The compiled equivalent of process_config_rules, returning the same tuple."""
+    points = 0
+    hints = 0
+    unlocked_puzzles = set()
+    processed_rewards = set()
+    puzzle_hints = {}
+    earned_badges = []
+
+    puzzle_status_dict = {status.puzzle_id: status for status in puzzle_statuses}
+    time_elapsed = current_time - start_time
+
+    # Keep processing rules until no new changes occur
+    changed = True
+    while changed:
+        changed = False
+        for rule in compiled_config.rules:
+            rule_value = rule.count(puzzle_status_dict, start_time, current_time, time_elapsed, points)
+            if rule_value <= 0:
+                continue
+
+            for reward_type, amount, puzzle_id in rule.rewards:
+                if reward_type == "puzzle":
+                    if puzzle_id not in unlocked_puzzles:
+                        unlocked_puzzles.add(puzzle_id)
+                        changed = True
+                elif reward_type == "badge":
+                    if amount not in earned_badges:
+                        earned_badges.append(amount)
+                        changed = True
+                else:
+                    # Numeric rewards are only granted once per rule per evaluation
+                    reward_id = (rule.index, reward_type, amount, puzzle_id)
+                    if reward_id in processed_rewards:
+                        reward = 0
+                    else:
+                        processed_rewards.add(reward_id)
+                        reward = rule_value * amount
+                        changed = True
+                    if reward_type == "points":
+                        points += reward
+                    elif reward_type == "hints":
+                        hints += reward
+                    else:
+                        puzzle_hints[puzzle_id] = puzzle_hints.get(puzzle_id, 0) + reward
+
+    return unlocked_puzzles, points, hints, puzzle_hints, earned_badges
+
+
+def next_trigger_time(compiled_config, puzzle_statuses, start_time, current_time, points):
+    """
+    Find the next time after current_time at which a time based rule could change what a team has
+    earned, assuming nothing else about the team changes in the meantime.
+
+    Returns:
+        datetime or None: The next trigger time, or None if no time based rule can change anymore
+    """
+    statuses = {status.puzzle_id: status for status in puzzle_statuses}
+    time_elapsed = current_time - start_time
+    return _earliest(*(rule.next_change(statuses, start_time, current_time, time_elapsed, points)
+                       for rule in compiled_config.time_rules))
+
+
+# A stand-in for a PuzzleStatus, used to describe a team's state before a solve and after new unlocks
+_PuzzleState = namedtuple("_PuzzleState", ["puzzle_id", "unlock_time", "solve_time"])
+
+
+def process_solve_rules(compiled_config, puzzle_statuses, solved_puzzle_id, start_time, current_time,
+                        points, badges):
+    """
+    Incrementally process the effects of a single puzzle being solved.
+
+    Rather than re-running every rule, this starts from the rules that reference the solved puzzle and
+    follows a worklist of only the rules that each resulting change (a new unlock or more points) can
+    affect. A rule's rewards are granted if it applies now but did not apply immediately before the
+    solve; anything else is assumed to already be reflected in the team's stored state. Changes that
+    come purely from the passage of time are left to the periodic full evaluation.
+
+    Args:
+        compiled_config: The hunt's CompiledConfig
+        puzzle_statuses: The team's puzzle statuses, including the newly solved one
+        solved_puzzle_id: The ID of the puzzle that was just solved
+        start_time: The team's hunt start time
+        current_time: The time of the solve
+        points: The team's current point total
+        badges: The team's current list of badges
+
+    Returns:
+        tuple: (set of newly unlocked puzzle IDs, points gained, hints gained,
+                dict of puzzle ID -> puzzle hints gained, list of newly earned badges).
+                For newly unlocked puzzles the puzzle hint count is the total earned so far.
+    """
+    new_statuses = {status.puzzle_id: status for status in puzzle_statuses}
+    old_statuses = dict(new_statuses)
+    solved_status = new_statuses.get(solved_puzzle_id)
+    if solved_status is not None:
+        old_statuses[solved_puzzle_id] = _PuzzleState(solved_puzzle_id, solved_status.unlock_time, None)
+
+    time_elapsed = current_time - start_time
+    new_points = points
+    hints = 0
+    unlocked_puzzles = set()
+    puzzle_hints = {}
+    earned_badges = []
+    applied_rules = set()
+
+    worklist = deque(compiled_config.rules_by_puzzle.get(solved_puzzle_id, ()))
+    while worklist:
+        rule = worklist.popleft()
+        if rule.index in applied_rules:
+            continue
+        rule_value = rule.count(new_statuses, start_time, current_time, time_elapsed, new_points)
+        if rule_value <= 0:
+            continue
+        if rule.count(old_statuses, start_time, current_time, time_elapsed, points) > 0:
+            # Already applied before this solve
+            continue
+        applied_rules.add(rule.index)
+
+        # Numeric rewards are only granted once per rule, as in process_compiled_rules
+        granted_rewards = set()
+        for reward_type, amount, puzzle_id in rule.rewards:
+            if reward_type == "puzzle":
+                if puzzle_id not in new_statuses:
+                    new_statuses[puzzle_id] = _PuzzleState(puzzle_id, current_time, None)
+                    unlocked_puzzles.add(puzzle_id)
+                    worklist.extend(compiled_config.rules_by_puzzle.get(puzzle_id, ()))
+            elif reward_type == "badge":
+                if amount not in badges and amount not in earned_badges:
+                    earned_badges.append(amount)
+            else:
+                if (reward_type, amount, puzzle_id) in granted_rewards:
+                    continue
+                granted_rewards.add((reward_type, amount, puzzle_id))
+                if reward_type == "points":
+                    new_points += rule_value * amount
+                    worklist.extend(compiled_config.points_rules)
+                elif reward_type == "hints":
+                    hints += rule_value * amount
+                else:
+                    puzzle_hints[puzzle_id] = puzzle_hints.get(puzzle_id, 0) + rule_value * amount
+
+    # Hints for puzzles without a status are only granted once the puzzle unlocks, so a newly unlocked
+    # puzzle gets everything its hint rules currently apply to, not just what this solve triggered.
+    for puzzle_id in list(puzzle_hints):
+        if puzzle_id not in new_statuses:
+            del puzzle_hints[puzzle_id]
+    for puzzle_id in unlocked_puzzles:
+        total = 0
+        for rule in compiled_config.puzzle_hint_rules.get(puzzle_id, ()):
+            rule_value = rule.count(new_statuses, start_time, current_time, time_elapsed, new_points)
+            if rule_value <= 0:
+                continue
+            amounts = {amount for reward_type, amount, reward_puzzle in rule.rewards
+                       if reward_type == "puzzle_hints" and reward_puzzle == puzzle_id}
+            total += rule_value * sum(amounts)
+        if total:
+            puzzle_hints[puzzle_id] = total
+        else:
+            puzzle_hints.pop(puzzle_id, None)
+
+    return unlocked_puzzles, new_points - points, hints, puzzle_hints, earned_badges
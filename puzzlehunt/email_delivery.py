@@ -0,0 +1,170 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass, asdict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .rate_limiter import get_limiter
+from .shared_cache import cache_is_process_local, get_shared_redis
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = "email-outbox"
+# Queued emails are dropped if the flush task that should have sent them was lost for this many seconds
+OUTBOX_EXPIRY = 60 * 60
+
+
+@dataclass
+class Email:
+    """ A notification email ready to send, kept as plain data so that it can wait in a shared outbox """
+    subject: str
+    body: str
+    from_email: str
+    to: str
+
+    def as_message(self, connection):
+        return EmailMessage(self.subject, self.body, self.from_email, [self.to], connection=connection)
+
+
+def _merged_messages(emails, connection):
+    """
+    Combine emails with the same sender and content into one message per group, using anymail's batch
+    sending so that the provider still delivers a separate copy to each recipient.
+    """
+    from anymail.message import AnymailMessage
+    groups = {}
+    for email in emails:
+        groups.setdefault((email.subject, email.body, email.from_email), []).append(email.to)
+    messages = []
+    for (subject, body, from_email), recipients in groups.items():
+        message = AnymailMessage(subject, body, from_email, recipients, connection=connection)
+        message.merge_data = {recipient: {} for recipient in recipients}
+        messages.append(message)
+    return messages
+
+
+def _take_send_tokens(count):
+    """
+    Take up to count tokens from the email bucket, which every worker sending through the same backend shares
+    and which refills at NOTIFICATION_EMAIL_MAX_PER_SECOND.
+
+    Returns:
+        (int, float): The number of tokens taken, and the seconds until the next one if they ran out
+    """
+    max_per_second = settings.NOTIFICATION_EMAIL_MAX_PER_SECOND
+    if not max_per_second:
+        return count, 0.0
+    limiter = get_limiter()
+    for taken in range(count):
+        result = limiter.consume(f"email:{settings.EMAIL_BACKEND}", max_per_second, 1)
+        if not result.allowed:
+            return taken, result.time_left
+    return count, 0.0
+
+
+def send_batch(emails):
+    """
+    Send emails over a single connection, in batches of NOTIFICATION_EMAIL_BATCH_SIZE. A batch that fails is
+    logged and the rest are still sent.
+
+    Each email takes a token from a bucket shared by every worker, so NOTIFICATION_EMAIL_MAX_PER_SECOND holds
+    across calls rather than within each one. Emails over the ceiling are handed back rather than waited for,
+    so that the caller can queue them for when the bucket has refilled.
+
+    Returns:
+        (int, list, float): The number of emails sent, the emails held back, and how many seconds until
+        more can be sent
+    """
+    if not emails:
+        return 0, [], 0.0
+    allowed, wait = _take_send_tokens(len(emails))
+    emails, held = emails[:allowed], emails[allowed:]
+    if not emails:
+        return 0, held, wait
+
+    batch_size = settings.NOTIFICATION_EMAIL_BATCH_SIZE
+    connection = get_connection()
+    merge = settings.NOTIFICATION_EMAIL_MERGE_BATCHES and 'anymail' in type(connection).__module__
+
+    num_sent = 0
+    with connection:
+        for i in range(0, len(emails), batch_size):
+            batch = emails[i:i + batch_size]
+            if merge:
+                messages = _merged_messages(batch, connection)
+            else:
+                messages = [email.as_message(connection) for email in batch]
+            try:
+                connection.send_messages(messages)
+                num_sent += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to send batch of {len(batch)} notification emails: {e}")
+    return num_sent, held, wait
+
+
+class RedisEmailOutbox:
+    """ Emails waiting to be sent in the next batch, shared by every worker through Redis """
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, emails):
+        """ Add emails to the outbox, returning True if it was empty """
+        pipe = self.client.pipeline()
+        pipe.rpush(OUTBOX_KEY, *[json.dumps(asdict(email)) for email in emails])
+        pipe.expire(OUTBOX_KEY, OUTBOX_EXPIRY)
+        length, _ = pipe.execute()
+        return length == len(emails)
+
+    def take(self):
+        """ Remove and return the emails in the outbox, in the order they were added """
+        pipe = self.client.pipeline()
+        pipe.lrange(OUTBOX_KEY, 0, -1)
+        pipe.delete(OUTBOX_KEY)
+        emails, _ = pipe.execute()
+        return [Email(**json.loads(email)) for email in emails]
+
+
+class MemoryEmailOutbox:
+    """ A process local outbox, used along with the process local cache in development and tests """
+
+    def __init__(self):
+        self.emails = []
+        self.lock = threading.Lock()
+
+    def add(self, emails):
+        with self.lock:
+            was_empty = not self.emails
+            self.emails.extend(emails)
+            return was_empty
+
+    def take(self):
+        with self.lock:
+            emails, self.emails = self.emails, []
+            return emails
+
+    def reset(self):
+        with self.lock:
+            self.emails = []
+
+
+_outbox = None
+_outbox_checked = False
+
+
+def get_email_outbox():
+    """
+    Get the shared email outbox: in Redis if the cache is, in memory if the cache is process local too, or
+    None if emails can't be gathered across workers, in which case each event's emails are sent together.
+    """
+    global _outbox, _outbox_checked
+    if not _outbox_checked:
+        client = get_shared_redis()
+        if client is not None:
+            _outbox = RedisEmailOutbox(client)
+        elif cache_is_process_local():
+            _outbox = MemoryEmailOutbox()
+        _outbox_checked = True
+    return _outbox
@@ -195,12 +195,14 @@ class NotificationSubscriptionForm(ModelForm):
             required=True,
             help_text="Select which events you want to be notified about"
         )
+        self.fields['digest_window'].required = False
         
         self.helper.layout = Layout(
             Field('platform'),
             Field('hunt'),
             Field('event_types'),
             Field('destination'),
+            Field('digest_window'),
             Field('active', type='hidden', initial=True),
             FormGroup(Submit('Create', 'Create', css_class="is-primary"), 
                      css_class="is-grouped-right")
@@ -225,6 +227,10 @@ class NotificationSubscriptionForm(ModelForm):
         """Convert list of selected events into comma-separated string"""
         return ','.join(self.cleaned_data['event_types'])
 
+    def clean_digest_window(self):
+        """Leaving the digest window empty sends each event as it happens"""
+        return self.cleaned_data['digest_window'] or 0
+
     class Meta:
         model = NotificationSubscription
-        fields = ['platform', 'hunt', 'event_types', 'destination', 'active']
+        fields = ['platform', 'hunt', 'event_types', 'destination', 'digest_window', 'active']
@@ -1,25 +1,30 @@
 from crispy_forms.utils import render_crispy_form
 from pathlib import Path
+import base64
+import binascii
+import json
 
 from django.conf import settings
 from django.core.exceptions import SuspiciousOperation
 from django.http import HttpResponse, HttpResponseNotFound, JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.urls import reverse_lazy
 from django.views.decorators.http import require_POST
 from django.contrib import messages
-from django.db.models import F
+from django.db.models import F, Q
 from django.db import transaction
 
 from django_htmx.http import retarget, reswap
-from django_ratelimit.core import get_usage
 from django_sendfile import sendfile
 from constance import config
 
 from .forms import AnswerForm
-from .models import Puzzle, Submission, Prepuzzle, Hint, PuzzleStatus, Update
+from .models import Puzzle, Submission, Prepuzzle, Hint, PuzzleStatus, Update, LeaderboardEntry
 from .utils import get_media_file_model
+from .rate_limiter import check_rate_limit
+from .team_state import get_team_state
 
 import logging
 logger = logging.getLogger(__name__)
@@ -56,19 +61,15 @@ def puzzle_view(request, pk):
     team = puzzle.hunt.team_from_user(request.user)
 
     # Determine access
-    # TODO: this is duplicative with the Puzzle.has_access method, but it would take more queries to get the 'solved'
-    #       boolean, so ideally that could somehow be returned by that method.
-    try:
-        puzzle_status = PuzzleStatus.objects.get(puzzle=puzzle, team=team)
-    except PuzzleStatus.DoesNotExist:
-        puzzle_status = None
     has_access = False
     solved = False
     if puzzle.hunt.is_public or request.user.is_staff:
         has_access = True
-    if team is not None and puzzle_status is not None and puzzle_status.unlock_time is not None:
-        has_access = True
-        solved = puzzle_status.solve_time is not None
+    if team is not None:
+        state = get_team_state(team)
+        if state.is_unlocked(puzzle.pk):
+            has_access = True
+            solved = state.is_solved(puzzle.pk)
 
     if not has_access:
         if request.user.is_authenticated:
@@ -119,18 +120,11 @@ def puzzle_submit(request, pk):
         if team is None:
             raise SuspiciousOperation
 
-        # Determine rate limit to use - puzzle override > hunt override > default
-        rate_limit = "3/5m"  # Default rate limit
-        if puzzle.ratelimit_override:
-            rate_limit = puzzle.ratelimit_override
-        elif puzzle.hunt.ratelimit_override:
-            rate_limit = puzzle.hunt.ratelimit_override
-
-        usage = get_usage(request, fn=puzzle_submit, key=lambda _, r: str(pk) + str(team.pk),
-                          rate=rate_limit, method='POST', increment=True)
-        if usage and usage['should_limit']:
+        # Rate limit to use is puzzle override > hunt override > default
+        usage = check_rate_limit(f"submit:{puzzle.pk}:{team.pk}", puzzle.submission_rate)
+        if usage and not usage.allowed:
             form = AnswerForm(puzzle=puzzle)
-            err_message = f"You have been rate limited. You can submit answers again in {usage['time_left']} seconds."
+            err_message = f"You have been rate limited. You can submit answers again in {usage.seconds_left} seconds."
             form.errors['answer'] = [err_message]
             return HttpResponse(render_crispy_form(form))
 
@@ -292,7 +286,7 @@ def hunt_view(request, hunt):
         puzzle_list = hunt.puzzle_set.all()
 
     elif team and team.playtest_happening:
-        puzzle_list = team.puzzle_statuses.all()
+        puzzle_list = hunt.puzzle_set.filter(pk__in=get_team_state(team).unlocked)
 
     # Hunt has not yet started
     elif hunt.is_locked:
@@ -308,7 +302,7 @@ def hunt_view(request, hunt):
         elif team is None or (team.hunt != hunt):
             return render(request, 'access_error.html', {'reason': "team"})
         else:
-            puzzle_list = team.puzzle_statuses.all()
+            puzzle_list = hunt.puzzle_set.filter(pk__in=get_team_state(team).unlocked)
 
 
     # No else case, all 3 possible hunt states have been checked.
@@ -317,7 +311,8 @@ def hunt_view(request, hunt):
     if team is None:
         solved = []
     else:
-        solved = team.puzzle_statuses.filter(puzzlestatus__solve_time__isnull=False)
+        solved_ids = get_team_state(team).solved
+        solved = [puzzle for puzzle in puzzles if puzzle.pk in solved_ids]
     context = {'hunt': hunt, 'puzzles': puzzles, 'team': team, 'solved': solved}
 
     if hunt.template_file is None or hunt.template_file == "":
@@ -326,51 +321,8 @@ def hunt_view(request, hunt):
         return render(request, f"hunt/{hunt.pk}/template.html", context)
 
 
-def _process_teams_for_leaderboard(teams_queryset, ruleset):
-    """Helper function to process teams and calculate rankings."""
-    # Sort teams based on the ruleset
-    teams_sorted = teams_queryset.order_by(*[rule.ordering_parameter for rule in ruleset]).all()
-
-    processed_teams = []
-    last_team_values = None
-    current_rank = 0
-    teams_processed_count = 0
-
-    # First pass: Calculate ranks with ties
-    for team in teams_sorted:
-        teams_processed_count += 1
-        current_team_values = tuple(getattr(team, rule.rule_type, None) for rule in ruleset)
-
-        if current_team_values != last_team_values:
-            current_rank = teams_processed_count
-            last_team_values = current_team_values
-
-        team.computed_rank = current_rank  # Temporarily store numeric rank
-        processed_teams.append(team)
-
-    # Determine the last rank value
-    last_rank_value = current_rank if processed_teams else 0
-
-    # Count how many teams share the last rank
-    last_rank_count = 0
-    if last_rank_value > 0:
-        last_rank_count = sum(1 for team in processed_teams if team.computed_rank == last_rank_value)
-
-    # Second pass: Relabel last tied rank if necessary
-    if last_rank_count > 1:
-        for team in processed_teams:
-            if team.computed_rank == last_rank_value:
-                team.computed_rank = "-"
-
-    return processed_teams
-
-
 def hunt_leaderboard(request, hunt):
-    ruleset = hunt.teamrankingrule_set.order_by("rule_order").all()
-
-    base_teams = hunt.team_set.exclude(playtester=True)
-    for rule in ruleset:
-        base_teams = rule.annotate_query(base_teams)
+    ruleset = list(hunt.teamrankingrule_set.order_by("rule_order"))
 
     # Check if we should split the leaderboard by custom data
     split_leaderboard = (
@@ -378,34 +330,150 @@ def hunt_leaderboard(request, hunt):
         config.TEAM_CUSTOM_DATA_TYPE == 'boolean'
     )
 
-    # Only split if there are teams in both categories
-    if split_leaderboard:
-        has_true_teams = base_teams.filter(custom_data="True").exists()
-        has_false_teams = base_teams.exclude(custom_data="True").exists()
-        split_leaderboard = has_true_teams and has_false_teams
+    # Ranks for all teams and for each custom data group come from a single windowed query
+    entries = list(LeaderboardEntry.objects.ranked(hunt, ruleset, split=split_leaderboard))
 
     context = {
         'ruleset': ruleset,
         'hunt': hunt,
-        'split_leaderboard': split_leaderboard,
+        'team_data': [LeaderboardEntry.objects.team_for_display(entry, ruleset) for entry in entries],
     }
 
+    # Only split if there are teams in both categories
     if split_leaderboard:
-        # Process all three team lists
-        context['team_data'] = _process_teams_for_leaderboard(base_teams, ruleset)
-        context['team_data_true'] = _process_teams_for_leaderboard(
-            base_teams.filter(custom_data="True"), ruleset
-        )
-        context['team_data_false'] = _process_teams_for_leaderboard(
-            base_teams.exclude(custom_data="True"), ruleset
-        )
+        true_entries = [entry for entry in entries if entry.group]
+        false_entries = [entry for entry in entries if not entry.group]
+        split_leaderboard = bool(true_entries) and bool(false_entries)
+
+    if split_leaderboard:
+        context['team_data_true'] = [LeaderboardEntry.objects.team_for_display(entry, ruleset, prefix='group_')
+                                     for entry in sorted(true_entries, key=lambda e: e.group_position)]
+        context['team_data_false'] = [LeaderboardEntry.objects.team_for_display(entry, ruleset, prefix='group_')
+                                      for entry in sorted(false_entries, key=lambda e: e.group_position)]
         context['custom_data_name'] = config.TEAM_CUSTOM_DATA_NAME or "Custom Field"
-    else:
-        context['team_data'] = _process_teams_for_leaderboard(base_teams, ruleset)
+    context['split_leaderboard'] = split_leaderboard
 
     return render(request, 'leaderboard.html', context)
 
 
+LEADERBOARD_PAGE_SIZE = 50
+LEADERBOARD_MAX_PAGE_SIZE = 200
+
+
+def _int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise SuspiciousOperation(f"Invalid {name} parameter")
+
+
+def _leaderboard_cursor(entry, ruleset):
+    """ An opaque cursor for an entry: its rule values followed by its team ID """
+    values = []
+    for rule in ruleset:
+        value = getattr(entry, rule.entry_field)
+        values.append(value.isoformat() if rule.is_time and value is not None else value)
+    return base64.urlsafe_b64encode(json.dumps(values + [entry.team_id]).encode()).decode()
+
+
+def _leaderboard_cursor_param(request, name, ruleset):
+    """ Decode a cursor made by _leaderboard_cursor back into rule values and a team ID """
+    value = request.GET.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(value.encode()))
+        if not isinstance(cursor, list) or len(cursor) != len(ruleset) + 1:
+            raise ValueError
+        for i, rule in enumerate(ruleset):
+            if cursor[i] is None:
+                continue
+            if rule.is_time:
+                cursor[i] = parse_datetime(cursor[i])
+                if cursor[i] is None:
+                    raise ValueError
+            elif not isinstance(cursor[i], int):
+                raise ValueError
+        if not isinstance(cursor[-1], int):
+            raise ValueError
+    except (ValueError, TypeError, binascii.Error):
+        raise SuspiciousOperation(f"Invalid {name} parameter")
+    return cursor
+
+
+def hunt_leaderboard_data(request, hunt):
+    """
+    A JSON page of the leaderboard.
+
+    Query parameters:
+        limit: The number of teams to return, default 50, max 200
+        after: Return the teams after this cursor, as given by the "next" value of a previous page
+        before: Return the teams before this cursor, as given by the "previous" value of a previous page
+        around: Return the page centered on this team ID instead
+        group: "true" or "false" to rank only teams whose custom data is or isn't "True"
+
+    Cursors hold the values a team was ranked by, so paging seeks straight to the next team and costs
+    the same however deep it goes. around is the only way in by position.
+    """
+    ruleset = list(hunt.teamrankingrule_set.order_by("rule_order"))
+    limit = max(1, min(_int_param(request, "limit", LEADERBOARD_PAGE_SIZE), LEADERBOARD_MAX_PAGE_SIZE))
+    group = {"true": True, "false": False}.get(request.GET.get("group", "").lower())
+
+    around = _int_param(request, "around")
+    if around is not None:
+        entry = LeaderboardEntry.objects.filter(hunt=hunt, team_id=around, team__playtester=False).first()
+        if entry is None:
+            return JsonResponse({'error': 'Team not found'}, status=404)
+        position = LeaderboardEntry.objects.position_of(entry, ruleset, group=group)
+        after = max(0, position - 1 - limit // 2)
+        entries = LeaderboardEntry.objects.ranked(hunt, ruleset)
+        if group is not None:
+            # Filtering before the windows are computed ranks the group on its own
+            group_filter = Q(team__custom_data="True")
+            entries = entries.filter(group_filter if group else ~group_filter)
+        page = list(entries.filter(position__gt=after, position__lte=after + limit + 1))
+        has_next = len(page) > limit
+        page = page[:limit]
+        has_previous = after > 0
+    else:
+        before = _leaderboard_cursor_param(request, "before", ruleset)
+        after = _leaderboard_cursor_param(request, "after", ruleset)
+        if before is not None:
+            page, has_previous = LeaderboardEntry.objects.page(hunt, ruleset, limit, before, before=True,
+                                                               group=group)
+            has_next = True
+        else:
+            page, has_next = LeaderboardEntry.objects.page(hunt, ruleset, limit, after, group=group)
+            has_previous = after is not None
+
+    visible_rules = [rule for rule in ruleset if rule.visible]
+    teams = []
+    for entry in page:
+        values = {}
+        for rule in visible_rules:
+            value = getattr(entry, rule.entry_field)
+            values[rule.rule_type] = value.isoformat() if rule.is_time and value is not None else value
+        teams.append({
+            'id': entry.team_id,
+            'name': entry.team.name,
+            'badges': entry.team.badges,
+            'rank': "-" if entry.tied_last else entry.rank,
+            'position': entry.position,
+            'values': values,
+        })
+
+    return JsonResponse({
+        'rules': [{'type': rule.rule_type, 'name': rule.display_name, 'is_time': rule.is_time}
+                  for rule in visible_rules],
+        'teams': teams,
+        'next': _leaderboard_cursor(page[-1], ruleset) if page and has_next else None,
+        'previous': _leaderboard_cursor(page[0], ruleset) if page and has_previous else None,
+    })
+
+
 def hunt_updates(request, hunt):
     updates = hunt.update_set
     if config.SHOW_UPDATE_FOR_LOCKED_PUZZLES or request.user.is_staff or hunt.is_public:
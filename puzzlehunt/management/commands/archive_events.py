@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from puzzlehunt.models import Hunt
+from puzzlehunt.retention import archive_hunt_events
+
+
+class Command(BaseCommand):
+    help = ("Archive the events of every finished hunt, or one finished hunt, to gzipped JSONL files. "
+            "Deleted events no longer show in the staff feed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output_dir",
+            help="The directory to write the archive files to"
+        )
+        parser.add_argument(
+            "--hunt",
+            type=int,
+            help="Only archive the events of the specified hunt ID"
+        )
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete the archived events from the database"
+        )
+
+    def handle(self, *args, **options):
+        hunt_id = options.get("hunt")
+        output_dir = Path(options["output_dir"])
+        if not output_dir.is_dir():
+            raise CommandError(f'Output directory "{output_dir}" does not exist')
+
+        hunts = Hunt.objects.filter(end_date__lt=timezone.now())
+        if hunt_id:
+            if not Hunt.objects.filter(pk=hunt_id).exists():
+                raise CommandError(f'Hunt "{hunt_id}" does not exist')
+            hunts = hunts.filter(pk=hunt_id)
+            if not hunts.exists():
+                raise CommandError(f'Hunt "{hunt_id}" has not finished yet')
+
+        for hunt in hunts:
+            path = output_dir / f"hunt-{hunt.pk}-events-{timezone.now():%Y%m%d%H%M%S}.jsonl.gz"
+            num_events = archive_hunt_events(hunt, path, delete=options["delete"])
+            if num_events:
+                self.stdout.write(f"Archived {num_events} events for hunt: {hunt.name} to {path}")
+
+        self.stdout.write(self.style.SUCCESS("Archived events"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from puzzlehunt.models import Hunt, ActivityRollup
+
+
+class Command(BaseCommand):
+    help = "Recount the activity rollups of every hunt, or one hunt, from its submissions, unlocks, solves and hints"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hunt",
+            type=int,
+            help="Only backfill rollups for the specified hunt ID"
+        )
+
+    def handle(self, *args, **options):
+        hunt_id = options.get("hunt")
+
+        hunts = Hunt.objects.all()
+        if hunt_id:
+            hunts = hunts.filter(pk=hunt_id)
+            if not hunts.exists():
+                raise CommandError(f'Hunt "{hunt_id}" does not exist')
+
+        for hunt in hunts:
+            num_buckets = ActivityRollup.objects.rebuild(hunt)
+            self.stdout.write(f"Wrote {num_buckets} buckets for hunt: {hunt.name}")
+
+        self.stdout.write(self.style.SUCCESS("Backfilled activity rollups"))
@@ -1,7 +1,7 @@
-import re
 from django.core.management.base import BaseCommand, CommandError
 
 from puzzlehunt.models import Hunt, Puzzle, Submission, Response
+from puzzlehunt.response_matcher import ResponseMatcher
 
 
 class Command(BaseCommand):
@@ -58,21 +58,16 @@ class Command(BaseCommand):
         else:
             puzzle_ids = list(submissions.values_list('puzzle_id', flat=True).distinct())
 
-        responses_by_puzzle = {}
+        matchers_by_puzzle = {}
         for pid in puzzle_ids:
-            responses_by_puzzle[pid] = list(Response.objects.filter(puzzle_id=pid))
+            matchers_by_puzzle[pid] = ResponseMatcher(Response.objects.filter(puzzle_id=pid))
 
         updated_count = 0
         matched_count = 0
 
         for submission in submissions.iterator():
-            responses = responses_by_puzzle.get(submission.puzzle_id, [])
-            matched_response = None
-
-            for resp in responses:
-                if re.match(resp.regex, submission.submission_text, re.IGNORECASE):
-                    matched_response = resp
-                    break
+            matcher = matchers_by_puzzle.get(submission.puzzle_id)
+            matched_response = matcher.match(submission.submission_text) if matcher else None
 
             # Only update if the matched_response changed
             if submission.matched_response_id != (matched_response.id if matched_response else None):
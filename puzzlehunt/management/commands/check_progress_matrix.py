@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from puzzlehunt.models import Hunt
+from puzzlehunt.progress_matrix import compare_hunt, rebuild_hunt
+
+
+class Command(BaseCommand):
+    help = "Compare a hunt's live progress matrix with the database, optionally rebuilding it if they differ"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hunt",
+            type=int,
+            help="The hunt ID to check, defaults to the current hunt"
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Rebuild the matrix from the database if it differs"
+        )
+
+    def handle(self, *args, **options):
+        hunt_id = options.get("hunt")
+        try:
+            hunt = Hunt.objects.get(pk=hunt_id) if hunt_id else Hunt.objects.get(is_current_hunt=True)
+        except Hunt.DoesNotExist:
+            raise CommandError(f'Hunt "{hunt_id}" does not exist' if hunt_id else "There is no current hunt")
+
+        differences = compare_hunt(hunt)
+        if differences is None:
+            self.stdout.write(self.style.WARNING(f"The progress matrix for hunt {hunt.name} is not ready"))
+        else:
+            for team_id, puzzle_id, db_cell, matrix_cell in differences:
+                self.stdout.write(f"Team {team_id}, puzzle {puzzle_id}: database {db_cell}, matrix {matrix_cell}")
+            if not differences:
+                self.stdout.write(self.style.SUCCESS(f"The progress matrix for hunt {hunt.name} is consistent"))
+                return
+            self.stdout.write(self.style.WARNING(f"Found {len(differences)} inconsistent cells"))
+
+        if options["repair"]:
+            if rebuild_hunt(hunt) is None:
+                raise CommandError("There is no progress matrix without a Redis cache")
+            self.stdout.write(self.style.SUCCESS("Rebuilt progress matrix"))
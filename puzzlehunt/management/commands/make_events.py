@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from puzzlehunt.models import Hunt, Event, Submission, Team, User, PuzzleStatus, Hint, Puzzle
+from puzzlehunt.progress_matrix import rebuild_hunt
 
 def random_user(team):
     # Return a random user from a team
@@ -78,3 +79,6 @@ class Command(BaseCommand):
                         user
                     )
 
+
+            # The events above were for progress that was already there, so count it again from scratch
+            rebuild_hunt(hunt)
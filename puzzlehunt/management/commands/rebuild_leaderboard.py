@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from puzzlehunt.models import Hunt, Team, LeaderboardEntry
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized leaderboard entries of every team, or every team in one hunt"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hunt",
+            type=int,
+            help="Only rebuild entries for teams in the specified hunt ID"
+        )
+
+    def handle(self, *args, **options):
+        hunt_id = options.get("hunt")
+
+        teams = Team.objects.all()
+        if hunt_id:
+            try:
+                hunt = Hunt.objects.get(pk=hunt_id)
+            except Hunt.DoesNotExist:
+                raise CommandError(f'Hunt "{hunt_id}" does not exist')
+            teams = teams.filter(hunt=hunt)
+            self.stdout.write(f"Filtering to hunt: {hunt.name}")
+
+        team_ids = list(teams.values_list('pk', flat=True))
+        for i in range(0, len(team_ids), BATCH_SIZE):
+            LeaderboardEntry.objects.refresh(team_ids[i:i + BATCH_SIZE])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt leaderboard entries for {len(team_ids)} teams"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from puzzlehunt.models import NotificationRoute
+
+
+class Command(BaseCommand):
+    help = "Rebuild the notification routes of every subscription, such as after subscriptions were bulk updated"
+
+    def handle(self, *args, **options):
+        num_routes = NotificationRoute.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {num_routes} notification routes"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from puzzlehunt.models import Hunt
+from puzzlehunt.progress_matrix import rebuild_hunt
+
+
+class Command(BaseCommand):
+    help = "Rebuild the live progress matrix of every hunt, or one hunt, from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hunt",
+            type=int,
+            help="Only rebuild the matrix of the specified hunt ID"
+        )
+
+    def handle(self, *args, **options):
+        hunt_id = options.get("hunt")
+
+        hunts = Hunt.objects.all()
+        if hunt_id:
+            hunts = hunts.filter(pk=hunt_id)
+            if not hunts.exists():
+                raise CommandError(f'Hunt "{hunt_id}" does not exist')
+
+        for hunt in hunts:
+            num_cells = rebuild_hunt(hunt)
+            if num_cells is None:
+                raise CommandError("There is no progress matrix without a Redis cache")
+            self.stdout.write(f"Rebuilt {num_cells} cells for hunt: {hunt.name}")
+
+        self.stdout.write(self.style.SUCCESS("Rebuilt progress matrix"))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0018_alter_hunt_display_end_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='next_unlock_check',
+            field=models.DateTimeField(blank=True, db_index=True, help_text="The next time a time based config rule could change this team's unlocks, null if unknown", null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0019_team_next_unlock_check'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('team', models.OneToOneField(help_text='The team this entry is for', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='leaderboard_entry', serialize=False, to='puzzlehunt.team')),
+                ('num_unlocks', models.PositiveIntegerField(default=0)),
+                ('num_solves', models.PositiveIntegerField(default=0)),
+                ('num_metas', models.PositiveIntegerField(default=0)),
+                ('final_solve_time', models.DateTimeField(blank=True, null=True)),
+                ('last_meta_time', models.DateTimeField(blank=True, null=True)),
+                ('last_solve_time', models.DateTimeField(blank=True, null=True)),
+                ('points', models.IntegerField(default=0)),
+                ('hints_left', models.IntegerField(default=0)),
+                ('hunt', models.ForeignKey(help_text='The hunt the team is in', on_delete=django.db.models.deletion.CASCADE, to='puzzlehunt.hunt')),
+            ],
+            options={
+                'verbose_name_plural': 'leaderboard entries',
+                'indexes': [models.Index(fields=['hunt', '-num_solves', 'last_solve_time'], name='leaderboard_solves_idx')],
+            },
+        ),
+    ]
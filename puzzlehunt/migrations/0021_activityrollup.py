@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0020_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('PSUB', 'Submission'), ('PSOL', 'Solve'), ('PUNL', 'Unlock'), ('HREQ', 'Hint Request'), ('HRES', 'Hint Response'), ('HREF', 'Hint Refund'), ('FINH', 'Finish Hunt'), ('TMJH', 'Team Join'), ('UPDT', 'New Update')], help_text='The type of event counted', max_length=4)),
+                ('bucket_start', models.DateTimeField(help_text='The start of the five minute bucket')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hunt', models.ForeignKey(help_text='The hunt the puzzle is in', on_delete=django.db.models.deletion.CASCADE, to='puzzlehunt.hunt')),
+                ('puzzle', models.ForeignKey(help_text='The puzzle the events are for', on_delete=django.db.models.deletion.CASCADE, to='puzzlehunt.puzzle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hunt', 'type', 'bucket_start'], name='activity_rollup_series_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(fields=('puzzle', 'type', 'bucket_start'), name='activity_rollup_bucket'),
+        ),
+    ]
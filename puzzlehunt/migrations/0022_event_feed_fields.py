@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_event_display_fields(apps, schema_editor):
+    """Copy team and puzzle names, and submission correctness, onto existing events"""
+    Event = apps.get_model('puzzlehunt', 'Event')
+    Team = apps.get_model('puzzlehunt', 'Team')
+    Puzzle = apps.get_model('puzzlehunt', 'Puzzle')
+    Submission = apps.get_model('puzzlehunt', 'Submission')
+
+    Event.objects.filter(team__isnull=False).update(
+        team_name=Subquery(Team.objects.filter(pk=OuterRef('team_id')).values('name')[:1]))
+    Event.objects.filter(puzzle__isnull=False).update(
+        puzzle_name=Subquery(Puzzle.objects.filter(pk=OuterRef('puzzle_id')).values('name')[:1]))
+
+    # Correctness depends on the puzzle's case sensitivity, so it is worked out here rather than in SQL
+    submission_events = Event.objects.filter(type='PSUB').only('pk', 'related_object_id')
+    batch = []
+    for event in submission_events.iterator(chunk_size=1000):
+        batch.append(event)
+        if len(batch) == 1000:
+            _fill_correctness(Event, Submission, batch)
+            batch = []
+    _fill_correctness(Event, Submission, batch)
+
+
+def _fill_correctness(Event, Submission, events):
+    submission_ids = [int(event.related_object_id) for event in events if event.related_object_id.isdigit()]
+    submissions = Submission.objects.filter(pk__in=submission_ids).select_related('puzzle')
+    correct = {}
+    for submission in submissions:
+        answer, text = submission.puzzle.answer, submission.submission_text
+        if not submission.puzzle.case_sensitive:
+            answer, text = answer.lower(), text.lower()
+        correct[str(submission.pk)] = text == answer
+    for event in events:
+        event.is_correct = correct.get(event.related_object_id)
+    Event.objects.bulk_update(events, ['is_correct'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0021_activityrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='is_correct',
+            field=models.BooleanField(blank=True, help_text="Whether a submission event's submission was correct", null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='puzzle_name',
+            field=models.CharField(blank=True, help_text="The puzzle's name when the event happened", max_length=200),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='team_name',
+            field=models.CharField(blank=True, help_text="The team's name when the event happened", max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['hunt', 'type', 'timestamp'], name='event_feed_idx'),
+        ),
+        migrations.RunPython(fill_event_display_fields, migrations.RunPython.noop),
+    ]
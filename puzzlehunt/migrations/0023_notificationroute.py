@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_notification_routes(apps, schema_editor):
+    NotificationSubscription = apps.get_model('puzzlehunt', 'NotificationSubscription')
+    NotificationRoute = apps.get_model('puzzlehunt', 'NotificationRoute')
+    NotificationRoute.objects.bulk_create([
+        NotificationRoute(subscription_id=subscription.pk, event_type=event_type,
+                          hunt_id=subscription.hunt_id, user_id=subscription.user_id)
+        for subscription in NotificationSubscription.objects.filter(active=True)
+        for event_type in {t.strip() for t in subscription.event_types.split(',') if t.strip()}
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0022_event_feed_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('PSUB', 'Submission'), ('PSOL', 'Solve'), ('PUNL', 'Unlock'), ('HREQ', 'Hint Request'), ('HRES', 'Hint Response'), ('HREF', 'Hint Refund'), ('FINH', 'Finish Hunt'), ('TMJH', 'Team Join'), ('UPDT', 'New Update')], max_length=4)),
+                ('hunt', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='puzzlehunt.hunt')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='routes', to='puzzlehunt.notificationsubscription')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event_type', 'hunt'], name='notification_route_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='notificationroute',
+            constraint=models.UniqueConstraint(fields=('subscription', 'event_type'), name='notification_route_unique'),
+        ),
+        migrations.RunPython(fill_notification_routes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0023_notificationroute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PEND', 'Pending'), ('SENT', 'Sent'), ('DEAD', 'Dead letter')], default='PEND', max_length=4)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times sending has been tried')),
+                ('last_error', models.TextField(blank=True, help_text='Why the last attempt failed')),
+                ('next_attempt_time', models.DateTimeField(blank=True, help_text='When a pending delivery will next be tried', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_time', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(help_text='The event being notified of', on_delete=django.db.models.deletion.CASCADE, to='puzzlehunt.event')),
+                ('subscription', models.ForeignKey(help_text='The subscription being notified', on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='puzzlehunt.notificationsubscription')),
+            ],
+            options={
+                'verbose_name_plural': 'notification deliveries',
+                'indexes': [models.Index(fields=['subscription', '-created_at'], name='notif_delivery_sub_idx'), models.Index(fields=['status'], name='notif_delivery_status_idx')],
+            },
+        ),
+    ]
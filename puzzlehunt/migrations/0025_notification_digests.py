@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0024_notificationdelivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='digest_event_ids',
+            field=models.JSONField(blank=True, default=list, help_text='Every event combined in this delivery, if it is a digest'),
+        ),
+        migrations.AddField(
+            model_name='notificationsubscription',
+            name='digest_window',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Seconds to gather events for before sending them as one notification, between 5 and 60, or 0 to send each event as it happens'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzlehunt', '0025_notification_digests'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationdelivery',
+            name='event',
+            field=models.ForeignKey(blank=True, help_text='The event being notified of, kept empty once the event has been archived', null=True, on_delete=django.db.models.deletion.SET_NULL, to='puzzlehunt.event'),
+        ),
+    ]
@@ -1,28 +1,42 @@
 import re
 
 from django.contrib.auth.base_user import BaseUserManager
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
 from dateutil import tz
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 import logging
+import operator
 import os
 import random
+import copy
+import functools
 import json
+import threading
+from collections import defaultdict, Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
 from constance import config
 from django.contrib.auth.models import AbstractUser
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 from django.utils.functional import cached_property
 
-from django.db.models import F, OuterRef, Count, Subquery, Max, Avg, Q
-from django.db.models.fields import PositiveIntegerField, DateTimeField, DurationField
-from django.db.models.functions import Lower
-from django.db.models.signals import m2m_changed
+from django.db.models import F, OuterRef, Count, Subquery, Max, Avg, Q, Window, Case, When, Value, Sum
+from django.db.models.fields import PositiveIntegerField, DateTimeField, DurationField, BooleanField
+from django.db.models.functions import Lower, Rank, RowNumber, TruncMinute
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.utils import timezone
 from django_eventstream import send_event
-from .config_parser import parse_config, process_config_rules
+from .response_matcher import get_response_matcher, invalidate_response_matcher
+from .rate_limiter import parse_rate, DEFAULT_SUBMISSION_RATE
+from .team_membership import get_user_team, invalidate_team_membership, forget_current_hunt
+from .team_state import get_team_state, invalidate_team_states
+from .progress_matrix import record_events, record_status_removed, record_team_removed, reset_hunt
+from .staff_events import publish_staff_events
+from .config_parser import (
+    parse_config, get_compiled_config, process_compiled_rules, process_solve_rules, next_trigger_time
+)
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +44,43 @@ time_zone = tz.gettz(settings.TIME_ZONE)
 
 
 def send_event_to_team_members(team, event_name, data):
-    """Send an SSE event to all members of a team via their user channels."""
-    for member_pk in team.members.values_list('pk', flat=True):
-        send_event(f"user-{member_pk}", event_name, data)
+    """Send an SSE event to all members of a team with a single publish to the team's channel."""
+    send_event(f"team-{team.pk}", event_name, data)
+
+
+_hunt_update_commits = threading.local()
+
+
+class _HuntUpdateCommit:
+    """ The huntUpdate events already sent by the on_commit callbacks of one transaction """
+
+    def __init__(self):
+        self.sent = set()
+        self.started = False
+
+
+def schedule_hunt_update(team_ids, data):
+    """
+    Send a huntUpdate event to the given teams once the current transaction commits, or immediately outside
+    of one. Each team gets a single event per kind of update however many times it was scheduled in the
+    transaction, so a cascade of unlocks after a meta solve only tells the team's pages to refresh once.
+    """
+    commit = getattr(_hunt_update_commits, 'current', None)
+    # A commit whose callbacks have run is finished with. One whose callbacks never ran was rolled back,
+    # and as nothing was sent for it, it can be carried on with.
+    if commit is None or commit.started:
+        commit = _hunt_update_commits.current = _HuntUpdateCommit()
+    team_ids = list(team_ids)
+    transaction.on_commit(lambda: _send_hunt_update(commit, team_ids, data))
+
+
+def _send_hunt_update(commit, team_ids, data):
+    commit.started = True
+    for team_id in team_ids:
+        if (team_id, data) not in commit.sent:
+            commit.sent.add((team_id, data))
+            send_event(f"team-{team_id}", "huntUpdate", data)
+
 
 # region User Model
 class CustomUserManager(BaseUserManager):
@@ -360,6 +408,16 @@ class Hunt(models.Model):
         """ A boolean indicating whether the hunt is open to the public """
         return timezone.now() > self.end_date
 
+    @cached_property
+    def submission_rate(self):
+        """ The parsed (count, period in seconds) answer submission rate limit for this hunt """
+        if self.ratelimit_override:
+            try:
+                return parse_rate(self.ratelimit_override)
+            except ValueError as e:
+                logger.warning(f"Ignoring rate limit override for hunt {self.pk}: {e}")
+        return parse_rate(DEFAULT_SUBMISSION_RATE)
+
     @property
     def is_day_of_hunt(self):
         """ A boolean indicating whether today is the day of the hunt """
@@ -414,16 +472,32 @@ class Hunt(models.Model):
     def save(self, *args, **kwargs):
         """ Overrides the standard save method to ensure that only one hunt is the current hunt """
         self.full_clean()
+        is_new = self._state.adding
         if self.is_current_hunt:
             Hunt.objects.filter(is_current_hunt=True).update(is_current_hunt=False)
         super(Hunt, self).save(*args, **kwargs)
+        forget_current_hunt()
+        if is_new:
+            reset_hunt(self)
+        # The config or dates may have changed, so every team's next unlock check needs recalculating
+        Team.objects.filter(hunt=self).update(next_unlock_check=None)
+
+    def get_compiled_config(self):
+        """
+        Returns the compiled unlock rules for this hunt's config. The compiled form is cached per process
+        and reused until either the config or the set of puzzles in the hunt changes.
+
+        Raises:
+            ValueError: If the config fails to parse
+        """
+        puzzles = self.puzzle_set.values_list('id', 'order_number')
+        puzzle_ids = set(p[0] for p in puzzles)
+        order_to_id = {p[1]: p[0] for p in puzzles}
+        return get_compiled_config(self.pk, self.config, puzzle_ids, order_to_id)
 
     def team_from_user(self, user):
         """ Takes a user and a hunt and returns either the user's team for that hunt or None """
-        if not user.is_authenticated:
-            return None
-        teams = user.team_set.filter(hunt=self)
-        return teams[0] if (len(teams) > 0) else None
+        return get_user_team(self, user)
 
     def check_access(self, user):
         if self.is_public or user.is_staff:
@@ -438,10 +512,13 @@ class Hunt(models.Model):
     
     def reset(self):
         PuzzleStatus.objects.filter(team__hunt=self).delete()
+        Team.objects.filter(hunt=self).update(next_unlock_check=None)
         Submission.objects.filter(puzzle__hunt=self).delete()
         Hint.objects.filter(puzzle__hunt=self).delete()
         self.update_set.all().delete()
         self.event_set.all().delete()
+        self.activityrollup_set.all().delete()
+        reset_hunt(self)
 
 # endregion
 
@@ -528,6 +605,16 @@ class Puzzle(models.Model):
     def solve_count(self):
         return PuzzleStatus.objects.filter(puzzle=self, solve_time__isnull=False).count()
 
+    @cached_property
+    def submission_rate(self):
+        """ The parsed (count, period in seconds) answer submission rate limit, falling back to the hunt's """
+        if self.ratelimit_override:
+            try:
+                return parse_rate(self.ratelimit_override)
+            except ValueError as e:
+                logger.warning(f"Ignoring rate limit override for puzzle {self.pk}: {e}")
+        return self.hunt.submission_rate
+
     # Does not check for hunt access, so do that before calling this method
     def check_access(self, user, solution=False):
         if self.hunt.is_public or user.is_staff:
@@ -535,11 +622,12 @@ class Puzzle(models.Model):
         team = self.hunt.team_from_user(user)
         if team is None:
             return False
+        state = get_team_state(team)
         if solution:
             # TODO: Maybe there could be a settings boolean for if viewing solutions is allowed before/after the hunt is public
-            return self in team.puzzle_statuses.filter(puzzlestatus__solve_time__isnull=False)
+            return state.is_solved(self.pk)
         else:
-            return self in team.puzzle_statuses.filter(puzzlestatus__unlock_time__isnull=False)
+            return state.is_unlocked(self.pk)
 
     @classmethod
     def annotate_query(cls, query, annotation_type):
@@ -696,6 +784,11 @@ class Team(models.Model):
         help_text="The total number of points this team has earned through config rules"
     )
     badges = models.JSONField(default=list, help_text="List of badge texts earned by this team")
+    next_unlock_check = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="The next time a time based config rule could change this team's unlocks, null if unknown")
 
     @property
     def is_playtester_team(self):
@@ -753,13 +846,9 @@ class Team(models.Model):
 
     def hints_open_for_puzzle(self, puzzle):
         """ Takes a puzzle and returns whether the team is allowed to view the hints page for that puzzle """    
-        try:
-            status = PuzzleStatus.objects.get(team=self, puzzle=puzzle)
-        except PuzzleStatus.DoesNotExist:
-            if self.hunt.is_public and puzzle.cannedhint_set.count() > 0:
-                return True
-            else:
-                return False
+        if not get_team_state(self).is_unlocked(puzzle.pk):
+            return self.hunt.is_public and puzzle.cannedhint_set.count() > 0
+        status = PuzzleStatus.objects.get(team=self, puzzle=puzzle)
 
         custom_open = self.num_custom_hint_requests_available(status) > 0
         canned_open = self.num_canned_hint_requests_available(status) > 0
@@ -811,89 +900,239 @@ class Team(models.Model):
             case Hunt.HintPoolAllocation.PUZZLE_PRIORITY:
                 return puzzle_status.num_available_hints > 0
 
-    def process_unlocks(self, parsed_config=None):
+    @property
+    def unlock_window(self):
+        """ The (start, end) times during which this team's config rules are processed """
+        if self.playtester:
+            return self.playtest_start_date, self.playtest_end_date
+        return self.hunt.start_date, self.hunt.end_date
+
+    def process_unlocks(self, compiled_config=None):
         """
         Calculate what puzzles, points, hints, and badges this team has unlocked based on the hunt config.
-        
-        Returns:
-            tuple: (set of unlocked puzzle IDs, total points, total hints)
+
+        Args:
+            compiled_config: Optional CompiledConfig to use instead of looking up the hunt's compiled config
         """
         hunt = self.hunt
-        if self.playtester:
-            start_time = self.playtest_start_date
-            end_time = self.playtest_end_date
-        else:
-            start_time = hunt.start_date
-            end_time = hunt.end_date
+        start_time, end_time = self.unlock_window
         
         if not self.hunt.config or timezone.now() < start_time or timezone.now() > end_time:
             return
         
-        if parsed_config:
-            config_rules = parsed_config
-        else:
-            puzzles = hunt.puzzle_set.values_list('id', 'order_number')
-            puzzle_ids = set(p[0] for p in puzzles)
-            order_to_id = {p[1]: p[0] for p in puzzles}
+        if compiled_config is None:
             try:
-                # Parse the config and process unlocks
-                config_rules = parse_config(self.hunt.config, puzzle_ids, order_to_id)
+                compiled_config = hunt.get_compiled_config()
             except Exception as e:
                 # Log the error if config parsing fails
                 logger.error(f"Error processing hunt config: {e}")
                 return
-            
-        puzzle_statuses = self.puzzlestatus_set.all()
-        unlocked_puzzles, points, hints, puzzle_hints, earned_badges = process_config_rules(
-            config_rules,
+
+        if Team.bulk_process_unlocks([self], {hunt.pk: compiled_config}):
+            self.refresh_from_db()
+
+    @staticmethod
+    def lock_rows(team_ids, fields=('points', 'badges', 'next_unlock_check')):
+        """
+        Lock the rows of the given teams until the end of the current transaction, returning their current
+        values for the given fields. Rows are always locked in ID order so that lockers can't deadlock.
+        """
+        return {team.pk: team for team in Team.objects.select_for_update().filter(pk__in=team_ids)
+                .order_by('pk').only(*fields)}
+
+    @classmethod
+    def bulk_process_unlocks(cls, teams, compiled_configs):
+        """
+        Process unlocks for a batch of teams, evaluating every team in memory first and then writing all
+        of the resulting changes with a fixed number of queries, regardless of how many teams changed.
+
+        Unlock events and huntUpdate messages are sent just as PuzzleStatus.save would, but in batches.
+        The teams' rows are locked while they are processed, so that an overlapping sweep or a solve
+        can't be overwritten with values worked out from an older state.
+
+        Args:
+            teams: The teams to process, ideally fetched with select_related('hunt')
+            compiled_configs: Dict of hunt ID -> CompiledConfig, teams whose hunt is missing are skipped
+
+        Returns:
+            list: The teams that had any of their fields changed
+        """
+        now = timezone.now()
+        teams = [team for team in teams if team.hunt_id in compiled_configs]
+        with transaction.atomic():
+            return cls._process_locked_unlocks(teams, compiled_configs, now)
+
+    @classmethod
+    def _process_locked_unlocks(cls, teams, compiled_configs, now):
+        locked = Team.lock_rows([team.pk for team in teams], ('points', 'badges', 'next_unlock_check',
+                                                             'num_available_hints', 'num_total_hints_earned'))
+        teams = [team for team in teams if team.pk in locked]
+        for team in teams:
+            for field in ('points', 'badges', 'next_unlock_check', 'num_available_hints', 'num_total_hints_earned'):
+                setattr(team, field, getattr(locked[team.pk], field))
+
+        statuses_by_team = defaultdict(list)
+        for status in PuzzleStatus.objects.filter(team__in=teams):
+            statuses_by_team[status.team_id].append(status)
+
+        new_statuses = []
+        updated_statuses = []
+        updated_teams = []
+        hint_teams = []
+        for team in teams:
+            start_time, end_time = team.unlock_window
+            if start_time is None or end_time is None or now < start_time or now > end_time:
+                continue
+
+            compiled_config = compiled_configs[team.hunt_id]
+            puzzle_statuses = statuses_by_team[team.pk]
+            unlocked_puzzles, points, hints, puzzle_hints, earned_badges = process_compiled_rules(
+                compiled_config,
+                puzzle_statuses,
+                start_time,
+                now
+            )
+            earned_badges = compiled_config.order_badges(earned_badges)
+
+            # Unlock new puzzles, along with any puzzle hints they've already earned
+            current_statuses = {status.puzzle_id: status for status in puzzle_statuses}
+            puzzles_to_add = unlocked_puzzles - current_statuses.keys()
+            for puzzle_id in sorted(puzzles_to_add):
+                num_hints = puzzle_hints.get(puzzle_id, 0)
+                new_status = PuzzleStatus(
+                    team=team,
+                    puzzle_id=puzzle_id,
+                    unlock_time=now,
+                    num_available_hints=num_hints,
+                    num_total_hints_earned=num_hints
+                )
+                new_statuses.append(new_status)
+                puzzle_statuses.append(new_status)
+
+            for puzzle_id, num_hints in puzzle_hints.items():
+                status = current_statuses.get(puzzle_id)
+                if status is not None and num_hints > status.num_total_hints_earned:
+                    status.num_available_hints = F('num_available_hints') + num_hints - F('num_total_hints_earned')
+                    status.num_total_hints_earned = num_hints
+                    updated_statuses.append(status)
+
+            # Rules depending on the puzzles just unlocked only see them on the next pass, so check again
+            # right away in that case. Otherwise nothing can change until a time based rule triggers.
+            if any(puzzle_id in compiled_config.rules_by_puzzle for puzzle_id in puzzles_to_add):
+                next_check = None
+            else:
+                next_check = next_trigger_time(compiled_config, puzzle_statuses, start_time, now, points) or end_time
+
+            if points != team.points or earned_badges != team.badges or next_check != team.next_unlock_check:
+                team.points = points
+                team.badges = earned_badges
+                team.next_unlock_check = next_check
+                updated_teams.append(team)
+            if hints > team.num_total_hints_earned:
+                team.num_available_hints = F('num_available_hints') + hints - F('num_total_hints_earned')
+                team.num_total_hints_earned = hints
+                hint_teams.append(team)
+
+        PuzzleStatus.objects.bulk_create(new_statuses)
+        invalidate_team_states(status.team_id for status in new_statuses)
+        LeaderboardEntry.objects.schedule_refresh(
+            [status.team_id for status in new_statuses] + [team.pk for team in updated_teams + hint_teams])
+        PuzzleStatus.objects.bulk_update(updated_statuses, ['num_available_hints', 'num_total_hints_earned'])
+        Team.objects.bulk_update(updated_teams, ['points', 'badges', 'next_unlock_check'])
+        Team.objects.bulk_update(hint_teams, ['num_available_hints', 'num_total_hints_earned'])
+
+        if new_statuses:
+            puzzles = Puzzle.objects.in_bulk({status.puzzle_id for status in new_statuses})
+            for status in new_statuses:
+                status.puzzle = puzzles[status.puzzle_id]
+            Event.objects.bulk_create_events(Event.EventType.PUZZLE_UNLOCK, new_statuses, user=None)
+            schedule_hunt_update({status.team_id for status in new_statuses}, "unlock")
+
+        # Swap the hint expressions back out for the values that were actually written
+        if hint_teams:
+            available = dict(Team.objects.filter(pk__in=[team.pk for team in hint_teams])
+                             .values_list('pk', 'num_available_hints'))
+            for team in hint_teams:
+                team.num_available_hints = available[team.pk]
+
+        changed_teams = {team.pk: team for team in updated_teams + hint_teams}
+        for status in new_statuses:
+            changed_teams.setdefault(status.team_id, status.team)
+        return list(changed_teams.values())
+
+    @transaction.atomic
+    def process_solve(self, puzzle_id):
+        """
+        Apply the puzzles, points, hints, and badges this team earns by solving a single puzzle.
+
+        Unlike process_unlocks, only the rules that can be affected by the solve are evaluated.
+        Anything that changes purely with time is left to the periodic check_team_unlocks task.
+        The team's row is locked first, so that two solves at once each see the other's once it commits,
+        rather than both missing a rule that needs the two of them.
+
+        Args:
+            puzzle_id: The ID of the puzzle that was just solved
+        """
+        hunt = self.hunt
+        start_time, end_time = self.unlock_window
+
+        now = timezone.now()
+        if not hunt.config or now < start_time or now > end_time:
+            return
+
+        try:
+            compiled_config = hunt.get_compiled_config()
+        except Exception as e:
+            # Log the error if config parsing fails
+            logger.error(f"Error processing hunt config: {e}")
+            return
+
+        if puzzle_id not in compiled_config.rules_by_puzzle:
+            return
+
+        locked = Team.lock_rows([self.pk])[self.pk]
+        puzzle_statuses = list(self.puzzlestatus_set.only('puzzle_id', 'unlock_time', 'solve_time'))
+        unlocked_puzzles, points, hints, puzzle_hints, earned_badges = process_solve_rules(
+            compiled_config,
             puzzle_statuses,
+            puzzle_id,
             start_time,
-            timezone.now()
+            now,
+            locked.points,
+            locked.badges
         )
-        
-        # Unlock new puzzles
-        current_unlocks = set(self.unlocked_puzzles().values_list('id', flat=True))
-        puzzles_to_add = unlocked_puzzles - current_unlocks
-        
-        for puzzle_id in puzzles_to_add:
-            new_status = PuzzleStatus.objects.create(
+
+        for unlocked_id in unlocked_puzzles:
+            num_hints = puzzle_hints.pop(unlocked_id, 0)
+            puzzle_statuses.append(PuzzleStatus.objects.create(
                 team=self,
-                puzzle_id=puzzle_id,
-                unlock_time=timezone.now()
-            )
-        
-        for puzzle_id, num_hints in puzzle_hints.items():
-            try:
-                status = PuzzleStatus.objects.get(team=self, puzzle_id=puzzle_id)
-            except PuzzleStatus.DoesNotExist:
-                continue
-            if num_hints > status.num_total_hints_earned:
-                PuzzleStatus.objects.filter(team=self, puzzle_id=puzzle_id).update(
-                    num_available_hints=F('num_available_hints') + num_hints - F('num_total_hints_earned'),
-                    num_total_hints_earned=num_hints
-                )
-    
-        updated = False
-        # Update points
-        if points != self.points:
-            Team.objects.filter(pk=self.pk).update(points=points)
-            updated = True
-        # Update hints
-        if hints > self.num_total_hints_earned:
-            updated = True
-            Team.objects.filter(pk=self.pk).update(
-                num_available_hints=F('num_available_hints') + hints - F('num_total_hints_earned'),
-                num_total_hints_earned=hints
+                puzzle_id=unlocked_id,
+                unlock_time=now,
+                num_available_hints=num_hints,
+                num_total_hints_earned=num_hints
+            ))
+
+        for hint_puzzle_id, num_hints in puzzle_hints.items():
+            PuzzleStatus.objects.filter(team=self, puzzle_id=hint_puzzle_id).update(
+                num_available_hints=F('num_available_hints') + num_hints,
+                num_total_hints_earned=F('num_total_hints_earned') + num_hints
             )
 
-        # Process badges (need to check current state)
-        current_badges = self.badges
-        new_badges = earned_badges
-        if current_badges != new_badges:
-            Team.objects.filter(pk=self.pk).update(badges=new_badges)
-            updated = True
-
-        if updated:
+        updates = {}
+        if points:
+            updates['points'] = F('points') + points
+        if hints:
+            updates['num_available_hints'] = F('num_available_hints') + hints
+            updates['num_total_hints_earned'] = F('num_total_hints_earned') + hints
+        if earned_badges:
+            updates['badges'] = compiled_config.order_badges(locked.badges + earned_badges)
+        # The solve may have started new timers, such as rules counting from this puzzle's solve time
+        next_check = next_trigger_time(compiled_config, puzzle_statuses, start_time, now, locked.points + points)
+        if next_check is not None and locked.next_unlock_check is not None and next_check < locked.next_unlock_check:
+            updates['next_unlock_check'] = next_check
+        if updates:
+            Team.objects.filter(pk=self.pk).update(**updates)
+            LeaderboardEntry.objects.schedule_refresh([self.pk])
             self.refresh_from_db()
 
     def validate_members(self, adding_pks=None, removing_pks=None):
@@ -939,6 +1178,45 @@ def validate_team_members(sender, instance, action, pk_set, **kwargs):
     elif action == "pre_remove":
         instance.validate_members(removing_pks=pk_set)
 
+
+def _invalidate_memberships(memberships):
+    """Forget cached teams for (hunt_id, user_id) pairs now and again once the change is visible"""
+    by_hunt = defaultdict(set)
+    for hunt_id, user_id in memberships:
+        by_hunt[hunt_id].add(user_id)
+
+    def invalidate():
+        for hunt_id, user_ids in by_hunt.items():
+            invalidate_team_membership(hunt_id, user_ids)
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def invalidate_team_membership_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate the cached teams of users joining or leaving a team"""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        user_ids = pk_set if pk_set is not None else instance.members.values_list('pk', flat=True)
+        _invalidate_memberships((instance.hunt_id, user_id) for user_id in user_ids)
+    else:
+        teams = Team.objects.filter(pk__in=pk_set) if pk_set is not None else instance.team_set.all()
+        _invalidate_memberships((hunt_id, instance.pk) for hunt_id in teams.values_list('hunt_id', flat=True))
+
+
+@receiver(pre_delete, sender=Team)
+def invalidate_deleted_team_members(sender, instance, **kwargs):
+    """Invalidate the cached teams of a deleted team's members"""
+    user_ids = instance.members.values_list('pk', flat=True)
+    _invalidate_memberships((instance.hunt_id, user_id) for user_id in user_ids)
+
+
+@receiver(post_delete, sender=Team)
+def remove_team_from_progress_matrix(sender, instance, **kwargs):
+    """Drop a deleted team's row from the progress matrix"""
+    record_team_removed(instance.hunt_id, instance.pk)
+
 # endregion
 
 
@@ -1003,12 +1281,9 @@ class Submission(models.Model):
         """ Takes the submission's text and uses various methods to craft and populate a response. """
 
         # Check against regexes
-        matched_response = None
-        for resp in self.puzzle.response_set.all():
-            if re.match(resp.regex, self.submission_text, re.IGNORECASE):
-                response = resp.text
-                matched_response = resp
-                break
+        matched_response = get_response_matcher(self.puzzle).match(self.submission_text)
+        if matched_response is not None:
+            response = matched_response.text
         else:  # Give a default response if no regex matches
             if self.is_correct:
                 response = "Correct"
@@ -1059,22 +1334,21 @@ class PuzzleStatus(models.Model):
         is_new = not bool(self.pk)
         super().save(*args, **kwargs)
         if is_new:
-            # This is to ensure that the event is sent after the view has completed the transaction
-            # It has no effect if the caller is not in a transaction
-            transaction.on_commit(lambda: send_event_to_team_members(self.team, "huntUpdate", "unlock"))
+            schedule_hunt_update([self.team_id], "unlock")
             Event.objects.create_event(Event.EventType.PUZZLE_UNLOCK, self, user=None)
 
+    @transaction.atomic
     def mark_solved(self):
         """ Update the solved timestamp to indicate this puzzle has been solved. """
         # Make sure we don't update the solve time if it is already solved
         if self.solve_time is not None:
             return
+        # Lock the team before the status, the same order the unlock sweep locks them in
+        Team.lock_rows([self.team_id])
         self.solve_time = timezone.now()
         self.save()
-        self.team.process_unlocks()
-        # This is to ensure that the event is sent after the view has completed the transaction
-        # It has no effect if the caller is not in a transaction
-        transaction.on_commit(lambda: send_event_to_team_members(self.team, "huntUpdate", "solve"))
+        self.team.process_solve(self.puzzle_id)
+        schedule_hunt_update([self.team_id], "solve")
         Event.objects.create_event(Event.EventType.PUZZLE_SOLVE, self, user=None)
         if self.puzzle.type == Puzzle.PuzzleType.FINAL_PUZZLE:
             Event.objects.create_event(Event.EventType.FINISH_HUNT, self, user=None)
@@ -1138,6 +1412,28 @@ class Response(models.Model):
         return (self.puzzle_id, self.regex)
 
 
+@receiver(post_save, sender=Response)
+@receiver(post_delete, sender=Response)
+def invalidate_response_cache(sender, instance, **kwargs):
+    """Rebuild the puzzle's response matcher in every process once the change is visible"""
+    puzzle_id = instance.puzzle_id
+    invalidate_response_matcher(puzzle_id)
+    transaction.on_commit(lambda: invalidate_response_matcher(puzzle_id))
+
+
+@receiver(post_save, sender=PuzzleStatus)
+@receiver(post_delete, sender=PuzzleStatus)
+def invalidate_team_state_cache(sender, instance, **kwargs):
+    """Bump the team's state version whenever one of its puzzles is unlocked, solved, or reset"""
+    invalidate_team_states([instance.team_id])
+
+
+@receiver(post_delete, sender=PuzzleStatus)
+def remove_status_from_progress_matrix(sender, instance, **kwargs):
+    """Take a deleted status's unlock and solve off the progress matrix"""
+    record_status_removed(instance.team_id, instance.puzzle_id)
+
+
 class Hint(models.Model):
     """ A class to represent a hint to a puzzle """
 
@@ -1431,10 +1727,298 @@ class TeamRankingRule(models.Model):
             case self.RuleType.NUM_HINTS_LEFT:
                 return query.annotate(**{self.rule_type: F("num_available_hints")})
 
+    @property
+    def entry_field(self):
+        """ The LeaderboardEntry field holding this rule's value """
+        return LeaderboardEntry.RULE_FIELDS[self.rule_type]
+
+    def entry_ordering(self, reverse=False):
+        """ Like ordering_parameter, but for ordering LeaderboardEntry rows, optionally worst first """
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        if self.is_time != reverse:
+            return F(self.entry_field).asc(**nulls)
+        return F(self.entry_field).desc(**nulls)
+
     def natural_key(self):
         return self.hunt.natural_key() + (self.rule_order,)
 
 
+class LeaderboardEntryManager(models.Manager):
+    _pending = threading.local()
+
+    def refresh(self, team_ids):
+        """
+        Recompute the leaderboard entries of the given teams from their puzzle statuses, creating any that
+        are missing. The entry rows are locked first, so concurrent refreshes of a team can't overwrite a
+        newer result with an older one.
+        """
+        team_ids = sorted(set(team_ids))
+        if not team_ids:
+            return
+        teams = Team.objects.filter(pk__in=team_ids).values_list('pk', 'hunt_id', 'points', 'num_available_hints')
+        meta_types = [Puzzle.PuzzleType.META_PUZZLE, Puzzle.PuzzleType.FINAL_PUZZLE]
+        solved = Q(solve_time__isnull=False)
+        with transaction.atomic():
+            self.bulk_create([LeaderboardEntry(team_id=pk, hunt_id=hunt_id) for pk, hunt_id, _, _ in teams],
+                             ignore_conflicts=True)
+            entries = {entry.team_id: entry
+                       for entry in self.select_for_update().filter(team_id__in=team_ids).order_by('team_id')}
+            metrics = (PuzzleStatus.objects.filter(team_id__in=team_ids).order_by().values('team_id').annotate(
+                num_unlocks=Count('pk'),
+                num_solves=Count('pk', filter=solved),
+                num_metas=Count('pk', filter=solved & Q(puzzle__type__in=meta_types)),
+                final_solve_time=Max('solve_time', filter=Q(puzzle__type=Puzzle.PuzzleType.FINAL_PUZZLE)),
+                last_meta_time=Max('solve_time', filter=Q(puzzle__type__in=meta_types)),
+                last_solve_time=Max('solve_time'),
+            ))
+            metrics = {row.pop('team_id'): row for row in metrics}
+            for pk, hunt_id, points, hints_left in teams:
+                entry = entries[pk]
+                team_metrics = metrics.get(pk, {})
+                for field in LeaderboardEntry.METRIC_FIELDS:
+                    setattr(entry, field, team_metrics.get(field, None if field.endswith('_time') else 0))
+                entry.points = points
+                entry.hints_left = hints_left
+            self.bulk_update(entries.values(), LeaderboardEntry.METRIC_FIELDS + ['points', 'hints_left'])
+
+    def schedule_refresh(self, team_ids):
+        """
+        Refresh the given teams' entries once the current transaction commits, or immediately outside of
+        one. Teams scheduled several times in one transaction are only refreshed once.
+        """
+        pending = getattr(self._pending, 'team_ids', None)
+        if pending is None:
+            pending = self._pending.team_ids = set()
+        pending.update(team_ids)
+        transaction.on_commit(self._flush)
+
+    def _flush(self):
+        team_ids = getattr(self._pending, 'team_ids', None)
+        if not team_ids:
+            return
+        self._pending.team_ids = set()
+        try:
+            self.refresh(team_ids)
+        except Exception as e:
+            # The leaderboard catching up later is better than failing the request that changed it
+            logger.error(f"Error refreshing leaderboard entries for teams {sorted(team_ids)}: {e}")
+
+    def ensure_entries(self, hunt):
+        """ Build entries for any of the hunt's teams that don't have one yet, such as imported teams """
+        self.refresh(hunt.team_set.filter(leaderboard_entry__isnull=True).values_list('pk', flat=True))
+
+    def ranked(self, hunt, ruleset, split=False):
+        """
+        Get the entries of the hunt's non-playtester teams in leaderboard order, ranked in the database.
+
+        Each entry is annotated with:
+            rank: Its RANK() under the ruleset, so tied teams share a rank
+            position: Its place in the ordering, unique and gapless, used as a pagination cursor
+            tied_last: Whether it is in a group of more than one team tied for last place
+
+        With split, each entry is also annotated with group (whether its custom data is "True") and
+        group_rank, group_position and group_tied_last, computed over only the teams in its group.
+        """
+        self.ensure_entries(hunt)
+        entries = self.filter(hunt=hunt, team__playtester=False).select_related('team')
+        partitions = {'': []}
+        if split:
+            entries = entries.annotate(group=Case(When(team__custom_data="True", then=Value(True)),
+                                                  default=Value(False), output_field=BooleanField()))
+            partitions['group_'] = [F('group')]
+
+        orderings = [rule.entry_ordering() for rule in ruleset]
+        reversed_orderings = [rule.entry_ordering(reverse=True) for rule in ruleset]
+        rule_fields = [F(rule.entry_field) for rule in ruleset]
+        annotations = {}
+        for prefix, partition in partitions.items():
+            annotations[f'{prefix}rank'] = Window(Rank(), partition_by=partition or None, order_by=orderings or None)
+            annotations[f'{prefix}position'] = Window(RowNumber(), partition_by=partition or None,
+                                                      order_by=orderings + [F('team_id').asc()])
+            # The last place group is the one ranked first when ordered worst first
+            annotations[f'{prefix}reverse_rank'] = Window(Rank(), partition_by=partition or None,
+                                                          order_by=reversed_orderings or None)
+            annotations[f'{prefix}tie_size'] = Window(Count('pk'), partition_by=partition + rule_fields or None)
+        entries = entries.annotate(**annotations)
+        for prefix in partitions:
+            entries = entries.annotate(**{f'{prefix}tied_last': Case(
+                When(**{f'{prefix}reverse_rank': 1, f'{prefix}tie_size__gt': 1}, then=Value(True)),
+                default=Value(False), output_field=BooleanField())})
+        return entries.order_by('position')
+
+    @staticmethod
+    def _in_group(entries, group):
+        """ Narrow entries to the teams whose custom data is (or with group False, isn't) "True" """
+        if group is None:
+            return entries
+        group_filter = Q(team__custom_data="True")
+        return entries.filter(group_filter if group else ~group_filter)
+
+    @staticmethod
+    def _tied_with(ruleset, values):
+        """ A Q matching the entries whose rule values are all equal to the given ones """
+        tied = Q()
+        for rule, value in zip(ruleset, values):
+            tied &= Q(**{f'{rule.entry_field}__isnull': True} if value is None else {rule.entry_field: value})
+        return tied
+
+    @staticmethod
+    def _compare(ruleset, values, team_id=None, behind=False):
+        """
+        A Q matching the entries ordered ahead of (or with behind, after) one with the given rule values,
+        breaking ties by team ID if it is given. This is the row value comparison (rule fields..., team_id)
+        against (values..., team_id) spelled out term by term, as each rule orders its own way and puts
+        missing values last.
+        """
+        matches = []
+        tied = Q()
+        for rule, value in zip(ruleset, values):
+            field = rule.entry_field
+            if value is None:
+                # Missing values rank last, so anyone with a value is ahead and no one is behind
+                if not behind:
+                    matches.append(tied & Q(**{f'{field}__isnull': False}))
+                tied &= Q(**{f'{field}__isnull': True})
+            elif behind:
+                lookup = 'gt' if rule.is_time else 'lt'
+                matches.append(tied & (Q(**{f'{field}__{lookup}': value}) | Q(**{f'{field}__isnull': True})))
+                tied &= Q(**{field: value})
+            else:
+                lookup = 'lt' if rule.is_time else 'gt'
+                matches.append(tied & Q(**{f'{field}__{lookup}': value}))
+                tied &= Q(**{field: value})
+        if team_id is not None:
+            matches.append(tied & Q(**{f'team_id__{"gt" if behind else "lt"}': team_id}))
+        if not matches:
+            return Q(pk__in=[])
+        return functools.reduce(operator.or_, matches)
+
+    def position_of(self, entry, ruleset, group=None):
+        """
+        Get the position an entry would have in ranked(), counting the entries ahead of it rather than
+        ranking the whole hunt. With group, count only the teams in that custom data group.
+        """
+        values = [getattr(entry, rule.entry_field) for rule in ruleset]
+        entries = self._in_group(self.filter(hunt_id=entry.hunt_id, team__playtester=False), group)
+        return entries.filter(self._compare(ruleset, values, entry.team_id)).count() + 1
+
+    def page(self, hunt, ruleset, limit, cursor=None, before=False, group=None):
+        """
+        Get up to limit entries in ranked() order, starting after the entry a cursor points at, or with
+        before, ending just before it. The cursor is an entry's rule values followed by its team ID, so
+        a page is found by seeking on those columns rather than by ranking every team ahead of it.
+
+        The entries get the rank, position and tied_last values ranked() would give them, worked out
+        from counts of the teams ahead of the page and tied for last place.
+
+        Returns:
+            (list, bool): The page of entries, and whether there are more entries past it
+        """
+        self.ensure_entries(hunt)
+        entries = self._in_group(self.filter(hunt=hunt, team__playtester=False), group)
+        orderings = [rule.entry_ordering() for rule in ruleset] + [F('team_id').asc()]
+        reversed_orderings = [rule.entry_ordering(reverse=True) for rule in ruleset] + [F('team_id').desc()]
+
+        page = entries.select_related('team')
+        if cursor is not None:
+            page = page.filter(self._compare(ruleset, cursor[:-1], cursor[-1], behind=not before))
+        page = list(page.order_by(*(reversed_orderings if before else orderings))[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        if before:
+            page.reverse()
+        if not page:
+            return page, has_more
+
+        values = [[getattr(entry, rule.entry_field) for rule in ruleset] for entry in page]
+        position = entries.filter(self._compare(ruleset, values[0], page[0].team_id)).count() + 1
+        rank = entries.filter(self._compare(ruleset, values[0])).count() + 1
+        last = entries.order_by(*reversed_orderings).first()
+        last_values = [getattr(last, rule.entry_field) for rule in ruleset]
+        tied_last = last_values in values and entries.filter(self._tied_with(ruleset, last_values)).count() > 1
+        for i, entry in enumerate(page):
+            if i > 0 and values[i] != values[i - 1]:
+                rank = position + i
+            entry.position = position + i
+            entry.rank = rank
+            entry.tied_last = tied_last and values[i] == last_values
+        return page, has_more
+
+    @staticmethod
+    def team_for_display(entry, ruleset, prefix=''):
+        """
+        Get an entry's team annotated the way the leaderboard templates expect: its rule values under the
+        rule type names, and computed_rank, which is "-" for teams tied for last.
+        """
+        team = copy.copy(entry.team)
+        for rule in ruleset:
+            setattr(team, rule.rule_type, getattr(entry, rule.entry_field))
+        team.computed_rank = "-" if getattr(entry, f'{prefix}tied_last') else getattr(entry, f'{prefix}rank')
+        return team
+
+
+class LeaderboardEntry(models.Model):
+    """ The values of every ranking rule for a team, kept up to date as the team progresses """
+    RULE_FIELDS = {
+        TeamRankingRule.RuleType.NUM_UNLOCKS: 'num_unlocks',
+        TeamRankingRule.RuleType.NUM_PUZZLES: 'num_solves',
+        TeamRankingRule.RuleType.NUM_METAS: 'num_metas',
+        TeamRankingRule.RuleType.FINAL_SOLVE_TIME: 'final_solve_time',
+        TeamRankingRule.RuleType.LAST_META_TIME: 'last_meta_time',
+        TeamRankingRule.RuleType.LAST_SOLVE_TIME: 'last_solve_time',
+        TeamRankingRule.RuleType.NUM_POINTS: 'points',
+        TeamRankingRule.RuleType.NUM_HINTS_LEFT: 'hints_left',
+    }
+    METRIC_FIELDS = ['num_unlocks', 'num_solves', 'num_metas', 'final_solve_time', 'last_meta_time',
+                     'last_solve_time']
+
+    class Meta:
+        verbose_name_plural = "leaderboard entries"
+        indexes = [
+            # The most common ruleset: most puzzles solved, then earliest last solve
+            models.Index(fields=['hunt', '-num_solves', 'last_solve_time'], name='leaderboard_solves_idx'),
+        ]
+
+    objects = LeaderboardEntryManager()
+
+    team = models.OneToOneField(
+        Team,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='leaderboard_entry',
+        help_text="The team this entry is for")
+    hunt = models.ForeignKey(
+        Hunt,
+        on_delete=models.CASCADE,
+        help_text="The hunt the team is in")
+    num_unlocks = models.PositiveIntegerField(default=0)
+    num_solves = models.PositiveIntegerField(default=0)
+    num_metas = models.PositiveIntegerField(default=0)
+    final_solve_time = models.DateTimeField(null=True, blank=True)
+    last_meta_time = models.DateTimeField(null=True, blank=True)
+    last_solve_time = models.DateTimeField(null=True, blank=True)
+    points = models.IntegerField(default=0)
+    hints_left = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Leaderboard entry for {self.team}"
+
+
+@receiver(post_save, sender=Team)
+def refresh_team_leaderboard_entry(sender, instance, raw=False, **kwargs):
+    """Keep the team's points and hints on the leaderboard current"""
+    if not raw:
+        LeaderboardEntry.objects.schedule_refresh([instance.pk])
+
+
+@receiver(post_save, sender=PuzzleStatus)
+@receiver(post_delete, sender=PuzzleStatus)
+def refresh_status_leaderboard_entry(sender, instance, raw=False, **kwargs):
+    """Keep the team's unlocks and solves on the leaderboard current"""
+    if not raw:
+        LeaderboardEntry.objects.schedule_refresh([instance.team_id])
+
+
 class Update(models.Model):
     """ A class to represent puzzle/hunt updates """
     hunt = models.ForeignKey(
@@ -1464,7 +2048,9 @@ class Update(models.Model):
 
 
 class EventManager(models.Manager):
-    def create_event(self, event_type, related_object, user, related_data=None):
+    @staticmethod
+    def _event_fields(event_type, related_object, related_data=None):
+        """ Work out the fields of an event of the given type from its related object """
         timestamp = timezone.now()
         extra_data = related_data if related_data else dict()
         team = None
@@ -1523,30 +2109,53 @@ class EventManager(models.Manager):
         if isinstance(related_object, models.Model):
             related_object_id = related_object.id
 
-        # Send all events to the staff channel for the feed page
-        event_metadata = {
+        return {
+            "timestamp": timestamp,
             "type": event_type,
-            "team_id": team.pk if team else None,
-            "puzzle_id": puzzle.pk if puzzle else None,
+            "related_data": extra_data if len(extra_data) > 0 else '',
+            "related_object_id": related_object_id,
+            "hunt": hunt,
+            "team": team,
+            "puzzle": puzzle,
+            # Copies of what the feed shows, so it never has to look up the related objects
+            "is_correct": related_object.is_correct if event_type == Event.EventType.PUZZLE_SUBMISSION else None,
+            "team_name": team.name if team else "",
+            "puzzle_name": puzzle.name if puzzle else "",
         }
-        send_event("staff", "events", event_metadata)
-
-        event = self.create(
-            timestamp=timestamp,
-            type=event_type,
-            related_data=extra_data if len(extra_data) > 0 else '',
-            related_object_id=related_object_id,
-            user=user,
-            hunt=hunt,
-            team=team,
-            puzzle=puzzle,
-        )
+
+    def create_event(self, event_type, related_object, user, related_data=None):
+        fields = self._event_fields(event_type, related_object, related_data)
+        event = self.create(user=user, **fields)
+        publish_staff_events([fields])
+        record_events([fields])
+        ActivityRollup.objects.record([fields])
 
         from .notifications import send_event_notifications
         transaction.on_commit(lambda: send_event_notifications(event.pk))
 
         return event
 
+    def bulk_create_events(self, event_type, related_objects, user):
+        """
+        Create events of one type for several related objects with a single insert. Notifications are
+        still sent for each event, as create_event would.
+        """
+        all_fields = [self._event_fields(event_type, related_object) for related_object in related_objects]
+        events = self.bulk_create([self.model(user=user, **fields) for fields in all_fields])
+        publish_staff_events(all_fields)
+        record_events(all_fields)
+        ActivityRollup.objects.record(all_fields)
+
+        from .notifications import send_event_notifications
+        event_pks = [event.pk for event in events]
+
+        def send_notifications():
+            for event_pk in event_pks:
+                send_event_notifications(event_pk)
+        transaction.on_commit(send_notifications)
+
+        return events
+
 
 class Event(models.Model):
     class EventType(models.TextChoices):
@@ -1607,9 +2216,27 @@ class Event(models.Model):
         blank=True,
         null=True,
         help_text="The puzzle associated with this event, if applicable")
+    is_correct = models.BooleanField(
+        null=True,
+        blank=True,
+        help_text="Whether a submission event's submission was correct")
+    team_name = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="The team's name when the event happened")
+    puzzle_name = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text="The puzzle's name when the event happened")
 
     objects = EventManager()
 
+    class Meta:
+        indexes = [
+            # The staff feed, which pages through a hunt's events of some types newest first
+            models.Index(fields=['hunt', 'type', 'timestamp'], name='event_feed_idx'),
+        ]
+
     @cached_property
     def related_object(self):
         match self.type:
@@ -1638,7 +2265,7 @@ class Event(models.Model):
     def color(self):
         match self.type:
             case Event.EventType.PUZZLE_SUBMISSION:
-                if self.related_object.is_correct:
+                if self.is_correct:
                     return "#a3d7a3"
                 else:
                     return "#ff9999"
@@ -1663,7 +2290,7 @@ class Event(models.Model):
     def icon(self):
         match self.type:
             case Event.EventType.PUZZLE_SUBMISSION:
-                if self.related_object.is_correct:
+                if self.is_correct:
                     return "fa-check"
                 else:
                     return "fa-ban"
@@ -1688,22 +2315,22 @@ class Event(models.Model):
     def web_text(self):
         match self.type:
             case Event.EventType.PUZZLE_SUBMISSION:
-                return f"<b>{ self.team.name }</b> submitted <b>{ self.related_data }</b> to <b>{ self.puzzle.name }</b>."
+                return f"<b>{ self.team_name }</b> submitted <b>{ self.related_data }</b> to <b>{ self.puzzle_name }</b>."
             case Event.EventType.PUZZLE_SOLVE:
-                return f"<b>{ self.team.name }</b> has solved <b>{ self.puzzle.name }</b>!"
+                return f"<b>{ self.team_name }</b> has solved <b>{ self.puzzle_name }</b>!"
             case Event.EventType.PUZZLE_UNLOCK:
-                return f"<b>{ self.team.name }</b> has unlocked <b>{ self.puzzle.name }</b>."
+                return f"<b>{ self.team_name }</b> has unlocked <b>{ self.puzzle_name }</b>."
             case Event.EventType.HINT_REQUEST:
-                return f"<b>{ self.team.name }</b> has requested a { self.related_data if self.related_data != '{}' else ''} hint for <b>{ self.puzzle.name }</b>."
+                return f"<b>{ self.team_name }</b> has requested a { self.related_data if self.related_data != '{}' else ''} hint for <b>{ self.puzzle_name }</b>."
             case Event.EventType.HINT_RESPONSE:
                 return (f"<b>{ self.user.first_name } { self.user.last_name }</b> has responded to the hint request from "
-                        f"<b>{ self.team.name }</b> for <b>{ self.puzzle.name }</b>.")
+                        f"<b>{ self.team_name }</b> for <b>{ self.puzzle_name }</b>.")
             case Event.EventType.HINT_REFUND:
-                return f"A hint has been refunded for <b>{ self.team.name }</b> on <b>{ self.puzzle.name }</b>."
+                return f"A hint has been refunded for <b>{ self.team_name }</b> on <b>{ self.puzzle_name }</b>."
             case Event.EventType.FINISH_HUNT:
-                return f"Team <b>{ self.team.name }</b> has finished!"
+                return f"Team <b>{ self.team_name }</b> has finished!"
             case Event.EventType.TEAM_JOIN:
-                return f"Team <b>{ self.team.name }</b> has joined!"
+                return f"Team <b>{ self.team_name }</b> has joined!"
             case _:
                 return ""
     @property
@@ -1731,6 +2358,133 @@ class Event(models.Model):
                 return ""
 
 
+class ActivityRollupManager(models.Manager):
+    # The finest bucket width, every supported width and time zone offset is a multiple of it
+    BUCKET_WIDTH = timedelta(minutes=5)
+
+    @classmethod
+    def bucket_start(cls, time):
+        """ The start of the bucket a time falls in, in UTC """
+        since_epoch = time - datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+        return datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + (since_epoch // cls.BUCKET_WIDTH) * cls.BUCKET_WIDTH
+
+    def record(self, all_fields):
+        """
+        Count newly created events, given the fields create_event worked out for them, into their buckets
+        once their transaction commits. Incrementing a bucket locks its row, so doing it within the
+        transaction would make everyone submitting to a puzzle wait on each other until the end of the request.
+        """
+        counts = Counter(
+            (fields["hunt"].pk, fields["puzzle"].pk, fields["type"], self.bucket_start(fields["timestamp"]))
+            for fields in all_fields
+            if fields["type"] in ActivityRollup.ROLLUP_TYPES and fields["puzzle"] is not None
+        )
+        if counts:
+            transaction.on_commit(lambda: self._increment_all(counts))
+
+    def _increment_all(self, counts):
+        for (hunt_id, puzzle_id, event_type, bucket_start), count in counts.items():
+            self._increment(hunt_id, puzzle_id, event_type, bucket_start, count)
+
+    def _increment(self, hunt_id, puzzle_id, event_type, bucket_start, count):
+        bucket = self.filter(puzzle_id=puzzle_id, type=event_type, bucket_start=bucket_start)
+        if bucket.update(count=F('count') + count):
+            return
+        try:
+            with transaction.atomic():
+                self.create(hunt_id=hunt_id, puzzle_id=puzzle_id, type=event_type, bucket_start=bucket_start,
+                            count=count)
+        except IntegrityError:
+            # Someone else created the bucket first
+            bucket.update(count=F('count') + count)
+
+    @transaction.atomic
+    def rebuild(self, hunt):
+        """
+        Recount all of a hunt's buckets from its submissions, puzzle statuses, and hints.
+
+        Returns:
+            int: The number of buckets written
+        """
+        sources = [
+            (Event.EventType.PUZZLE_SUBMISSION, Submission.objects.filter(puzzle__hunt=hunt), 'submission_time'),
+            (Event.EventType.PUZZLE_SOLVE, PuzzleStatus.objects.filter(puzzle__hunt=hunt), 'solve_time'),
+            (Event.EventType.PUZZLE_UNLOCK, PuzzleStatus.objects.filter(puzzle__hunt=hunt), 'unlock_time'),
+            (Event.EventType.HINT_REQUEST, Hint.objects.filter(puzzle__hunt=hunt), 'request_time'),
+        ]
+        counts = Counter()
+        for event_type, query, field in sources:
+            # Let the database count by the minute, then gather the minutes into buckets here
+            minutes = (query.filter(**{f"{field}__isnull": False})
+                       .values('puzzle', minute=TruncMinute(field, tzinfo=dt_timezone.utc))
+                       .annotate(c=Count('*')).order_by().values_list('puzzle', 'minute', 'c'))
+            for puzzle_id, minute, count in minutes:
+                counts[(puzzle_id, event_type, self.bucket_start(minute))] += count
+
+        self.filter(hunt=hunt).delete()
+        self.bulk_create([
+            self.model(hunt=hunt, puzzle_id=puzzle_id, type=event_type, bucket_start=bucket_start, count=count)
+            for (puzzle_id, event_type, bucket_start), count in counts.items()
+        ], batch_size=1000)
+        return len(counts)
+
+    def series(self, hunt, event_type, width=timedelta(hours=1), tz=None):
+        """
+        Count a hunt's events of one type over time, between the hunt's start and end.
+
+        Buckets are floored to the given width in the given time zone's wall clock time, defaulting to
+        the current time zone, so that hour buckets line up with local hours even with half hour offsets.
+
+        Returns:
+            list: (bucket start, count) pairs in order, with the bucket starts as naive local times
+        """
+        tz = tz or timezone.get_current_timezone()
+        rows = (self.filter(hunt=hunt, type=event_type, bucket_start__gte=self.bucket_start(hunt.start_date),
+                            bucket_start__lte=hunt.end_date)
+                .values('bucket_start').annotate(total=Sum('count')).order_by('bucket_start')
+                .values_list('bucket_start', 'total'))
+        totals = Counter()
+        for bucket_start, total in rows:
+            local_start = bucket_start.astimezone(tz).replace(tzinfo=None)
+            totals[datetime.min + ((local_start - datetime.min) // width) * width] += total
+        return sorted(totals.items())
+
+
+class ActivityRollup(models.Model):
+    """ The number of one type of event for a puzzle within a five minute bucket, for charting activity over time """
+    ROLLUP_TYPES = [Event.EventType.PUZZLE_SUBMISSION, Event.EventType.PUZZLE_SOLVE, Event.EventType.PUZZLE_UNLOCK,
+                    Event.EventType.HINT_REQUEST]
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['puzzle', 'type', 'bucket_start'], name='activity_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['hunt', 'type', 'bucket_start'], name='activity_rollup_series_idx'),
+        ]
+
+    objects = ActivityRollupManager()
+
+    hunt = models.ForeignKey(
+        Hunt,
+        on_delete=models.CASCADE,
+        help_text="The hunt the puzzle is in")
+    puzzle = models.ForeignKey(
+        Puzzle,
+        on_delete=models.CASCADE,
+        help_text="The puzzle the events are for")
+    type = models.CharField(
+        max_length=4,
+        choices=Event.EventType.choices,
+        help_text="The type of event counted")
+    bucket_start = models.DateTimeField(
+        help_text="The start of the five minute bucket")
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.get_type_display()} x{self.count} for {self.puzzle_id} at {self.bucket_start}"
+
+
 class DisplayOnlyHunt(models.Model):
     """ Model for the display only hunt, only to be shown on the archive page """
 
@@ -1790,6 +2544,11 @@ class NotificationPlatform(models.Model):
         unique_together = ['type', 'name']
 
 
+# The range of digest windows, in seconds, long enough to gather an unlock cascade but short enough to stay timely
+MIN_DIGEST_WINDOW = 5
+MAX_DIGEST_WINDOW = 60
+
+
 class NotificationSubscription(models.Model):
     """A user's subscription to notifications for specific event types"""
     
@@ -1818,6 +2577,10 @@ class NotificationSubscription(models.Model):
     active = models.BooleanField(
         default=True,
         help_text="Whether this subscription is currently active")
+    digest_window = models.PositiveSmallIntegerField(
+        default=0,
+        help_text=f"Seconds to gather events for before sending them as one notification, between "
+                  f"{MIN_DIGEST_WINDOW} and {MAX_DIGEST_WINDOW}, or 0 to send each event as it happens")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -1839,6 +2602,12 @@ class NotificationSubscription(models.Model):
                 'event_types': f"Invalid event types: {', '.join(invalid_types)}"
             })
 
+        if self.digest_window and not MIN_DIGEST_WINDOW <= self.digest_window <= MAX_DIGEST_WINDOW:
+            raise ValidationError({
+                'digest_window': f"The digest window must be 0, or between {MIN_DIGEST_WINDOW} and "
+                                 f"{MAX_DIGEST_WINDOW} seconds"
+            })
+
         # Validate destination using the platform's handler
         from .notifications import NotificationHandler
         handler = NotificationHandler.create_handler(self.platform)
@@ -1850,4 +2619,137 @@ class NotificationSubscription(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            NotificationRoute.objects.sync(self)
+
+
+class NotificationRouteManager(models.Manager):
+    def sync(self, subscription):
+        """ Replace a subscription's routes with one per event type, or none if it is inactive """
+        self.filter(subscription=subscription).delete()
+        if subscription.active:
+            self.bulk_create([self.model(subscription=subscription, event_type=event_type,
+                                         hunt_id=subscription.hunt_id, user_id=subscription.user_id)
+                              for event_type in set(subscription.event_types_list)])
+
+    def rebuild(self):
+        """ Rebuild the routes of every subscription, returning how many routes there are """
+        with transaction.atomic():
+            self.all().delete()
+            routes = [self.model(subscription=subscription, event_type=event_type,
+                                 hunt_id=subscription.hunt_id, user_id=subscription.user_id)
+                      for subscription in NotificationSubscription.objects.filter(active=True)
+                      for event_type in set(subscription.event_types_list)]
+            self.bulk_create(routes)
+        return len(routes)
+
+    def for_event(self, event):
+        """
+        The routes of the active subscriptions that should be notified of an event, with their subscription,
+        platform and user, in a single query.
+        """
+        routes = self.filter(Q(hunt_id=event.hunt_id) | Q(hunt__isnull=True),
+                             event_type=event.type, subscription__platform__enabled=True)
+        # Team events only go to the team's members
+        if event.team_id is not None:
+            routes = routes.filter(user__team=event.team_id)
+        return routes.select_related('subscription__platform', 'subscription__user')
+
+
+class NotificationRoute(models.Model):
+    """
+    One event type that an active subscription is notified of, so that the subscriptions for an event are
+    found with an index lookup rather than a scan of every subscription's event types. Routes are derived
+    from the subscriptions, and kept up to date when they are saved.
+    """
+    subscription = models.ForeignKey(
+        NotificationSubscription,
+        on_delete=models.CASCADE,
+        related_name='routes')
+    event_type = models.CharField(
+        max_length=4,
+        choices=Event.EventType.choices)
+    # Copies of the subscription's hunt and user to filter on without joining the subscription
+    hunt = models.ForeignKey(
+        'Hunt',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE)
+
+    objects = NotificationRouteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subscription', 'event_type'], name='notification_route_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['event_type', 'hunt'], name='notification_route_idx'),
+        ]
+
+
+class NotificationDelivery(models.Model):
+    """
+    A notification sent over the network, recording its attempts so that failed ones can be retried and
+    ones that can't be delivered are kept, as dead letters, for staff to look at.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'PEND', 'Pending'
+        SENT = 'SENT', 'Sent'
+        DEAD = 'DEAD', 'Dead letter'
+
+    event = models.ForeignKey(
+        Event,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text="The event being notified of, kept empty once the event has been archived")
+    subscription = models.ForeignKey(
+        NotificationSubscription,
+        on_delete=models.CASCADE,
+        related_name='deliveries',
+        help_text="The subscription being notified")
+    status = models.CharField(
+        max_length=4,
+        choices=Status.choices,
+        default=Status.PENDING)
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="How many times sending has been tried")
+    last_error = models.TextField(
+        blank=True,
+        help_text="Why the last attempt failed")
+    next_attempt_time = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When a pending delivery will next be tried")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_time = models.DateTimeField(
+        null=True,
+        blank=True)
+    digest_event_ids = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Every event combined in this delivery, if it is a digest")
+
+    class Meta:
+        verbose_name_plural = "notification deliveries"
+        indexes = [
+            models.Index(fields=['subscription', '-created_at'], name='notif_delivery_sub_idx'),
+            models.Index(fields=['status'], name='notif_delivery_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Event {self.event_id} to subscription {self.subscription_id} ({self.get_status_display()})"
+
+    @property
+    def events(self):
+        """ The events this delivery notifies of, in order, leaving out any that have been archived """
+        if not self.digest_event_ids:
+            return [self.event] if self.event is not None else []
+        return list(Event.objects.select_related('hunt', 'puzzle', 'user').filter(pk__in=self.digest_event_ids)
+                    .order_by('timestamp', 'pk'))
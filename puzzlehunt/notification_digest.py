@@ -0,0 +1,79 @@
+import threading
+
+from .shared_cache import cache_is_process_local, get_shared_redis
+
+# Pending digests are dropped if they somehow outlive their window by this many seconds, such as when the
+# flush task was lost, so that they can't pile up forever
+DIGEST_EXPIRY_MARGIN = 10 * 60
+
+
+def _digest_key(subscription_id):
+    return f"digest:{subscription_id}"
+
+
+class RedisDigestStore:
+    """ Event IDs waiting to be sent in each subscription's next digest, shared by every worker through Redis """
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, subscription_id, event_id, window):
+        """ Add an event to a subscription's digest, returning True if it starts a new one """
+        key = _digest_key(subscription_id)
+        pipe = self.client.pipeline()
+        pipe.rpush(key, event_id)
+        pipe.expire(key, window + DIGEST_EXPIRY_MARGIN)
+        length, _ = pipe.execute()
+        return length == 1
+
+    def take(self, subscription_id):
+        """ Remove and return the event IDs in a subscription's digest, in the order they were added """
+        key = _digest_key(subscription_id)
+        pipe = self.client.pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        event_ids, _ = pipe.execute()
+        return [int(event_id) for event_id in event_ids]
+
+
+class MemoryDigestStore:
+    """ A process local digest store, used along with the process local cache in development and tests """
+
+    def __init__(self):
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def add(self, subscription_id, event_id, window):
+        with self.lock:
+            event_ids = self.digests.setdefault(subscription_id, [])
+            event_ids.append(event_id)
+            return len(event_ids) == 1
+
+    def take(self, subscription_id):
+        with self.lock:
+            return self.digests.pop(subscription_id, [])
+
+    def reset(self):
+        with self.lock:
+            self.digests.clear()
+
+
+_store = None
+_store_checked = False
+
+
+def get_digest_store():
+    """
+    Get the shared digest store: in Redis if the cache is, in memory if the cache is process local too, or
+    None if digests can't be shared between the workers that add to them and the one that sends them.
+    Subscriptions are notified of each event on its own when there is no store.
+    """
+    global _store, _store_checked
+    if not _store_checked:
+        client = get_shared_redis()
+        if client is not None:
+            _store = RedisDigestStore(client)
+        elif cache_is_process_local():
+            _store = MemoryDigestStore()
+        _store_checked = True
+    return _store
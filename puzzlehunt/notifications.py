@@ -1,16 +1,29 @@
 from abc import ABC, abstractmethod
 import re
-from django.db.models import Q
 from django.forms import ValidationError
 from django_eventstream import send_event
 from huey.contrib.djhuey import task
 import json
-import requests
-from .models import Event, NotificationPlatform, NotificationSubscription
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Event, NotificationPlatform, NotificationSubscription, NotificationRoute, NotificationDelivery
+from .rate_limiter import get_limiter, parse_rate
+from .notification_digest import get_digest_store
+from . import email_delivery, webhook_delivery
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Attempts at sending a webhook before it becomes a dead letter
+MAX_DELIVERY_ATTEMPTS = 6
+# Seconds before the first retry of a failed webhook, doubling with every attempt up to the maximum
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+# Subscriptions are deactivated once this many of their latest deliveries in a row are dead letters
+DEAD_LETTER_THRESHOLD = 3
+
 
 class NotificationHandler(ABC):
     """Base class for platform-specific notification handlers"""
@@ -64,6 +77,21 @@ class NotificationHandler(ABC):
         """Validate platform config. Override in subclasses. Raises ValidationError if invalid."""
         pass  # Default: no validation needed
 
+    # Handlers whose notifications are webhooks, sent concurrently and retried through NotificationDelivery
+    concurrent = False
+    # Handlers whose notifications are emails, gathered across events and sent in batches over one connection
+    batched = False
+    # Handlers that can combine several events into one notification, for subscriptions with a digest window.
+    # They must be concurrent or batched.
+    supports_digest = False
+
+    def prepare_notification(self, subscription: NotificationSubscription, events: list):
+        """
+        Build the webhook_delivery.Webhook or email_delivery.Email that sends a notification of one or more
+        events. Only needed for concurrent and batched handlers.
+        """
+        raise NotImplementedError
+
 
 class BrowserHandler(NotificationHandler):
     """Handler for browser SSE notifications"""
@@ -108,20 +136,21 @@ class EmailHandler(NotificationHandler):
         except DjangoValidationError:
             raise ValidationError('Invalid email address')
 
+    batched = True
+    supports_digest = True
+
+    def prepare_notification(self, subscription: NotificationSubscription, events: list):
+        if len(events) == 1:
+            subject = f"[PuzzleSpring] {events[0].get_type_display()}"
+            body = events[0].notification_text
+        else:
+            subject = f"[PuzzleSpring] {len(events)} notifications"
+            body = "\n".join(f"{event.get_type_display()}: {event.notification_text}" for event in events)
+        return email_delivery.Email(subject, body, self.config['from_email'], subscription.destination)
+
     def send_notification(self, subscription: NotificationSubscription, event: Event) -> bool:
-        from django.core.mail import send_mail
-        try:
-            send_mail(
-                subject=f"[PuzzleSpring] {event.get_type_display()}",
-                message=event.notification_text,
-                from_email=self.config['from_email'],
-                recipient_list=[subscription.destination],
-                fail_silently=False,
-            )
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {e}")
-            return False
+        # An email held back by the rate ceiling is queued, and so still counts as sent
+        return send_emails([self.prepare_notification(subscription, [event])]) == 1
 
 
 class WebhookHandler(NotificationHandler):
@@ -135,8 +164,14 @@ class WebhookHandler(NotificationHandler):
     - destination_payload_key: If set, adds destination to payload under this key
     - extra_payload: Additional fields to merge into payload
     - required_config: List of required config keys for this format
+
+    The config may also set a timeout, in seconds, for the destination to respond, and the rate at which
+    webhooks are sent to each destination, such as "5/2s".
     """
 
+    concurrent = True
+    supports_digest = True
+
     FORMAT_DEFAULTS = {
         'slack': {
             'destination_regex': r'^https://hooks\.slack\.com/',
@@ -189,6 +224,17 @@ class WebhookHandler(NotificationHandler):
             except re.error as e:
                 raise ValidationError(f"Invalid destination_regex: {e}")
 
+        if 'timeout' in config:
+            timeout = config['timeout']
+            if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+                raise ValidationError("timeout must be a positive number of seconds")
+
+        if 'rate' in config:
+            try:
+                parse_rate(str(config['rate']))
+            except ValueError as e:
+                raise ValidationError(str(e))
+
     def _get_setting(self, key, default=None):
         """Get a setting from config, falling back to format defaults."""
         fmt = self.config.get('format', 'generic')
@@ -203,79 +249,298 @@ class WebhookHandler(NotificationHandler):
             fmt = self.config.get('format', 'generic')
             raise ValidationError(f'Invalid destination for {fmt} format')
 
-    def send_notification(self, subscription: NotificationSubscription, event: Event) -> bool:
-        fmt = self.config.get('format', 'generic')
+    @staticmethod
+    def _event_json(event):
+        return {
+            "event_type": event.type,
+            "event_type_display": event.get_type_display(),
+            "notification_text": event.notification_text,
+            "timestamp": event.timestamp.isoformat(),
+            "hunt_id": event.hunt_id,
+            "puzzle_id": event.puzzle_id,
+            "team_id": event.team_id,
+        }
+
+    def build_request(self, subscription: NotificationSubscription, events: list):
+        """
+        Build the URL and JSON payload of a webhook notification. Several events are combined into one
+        message, a line per event, or for the generic format a list of events.
+        """
+        # Build URL from template
+        url_template = self._get_setting('url_template', '{destination}')
+        url = url_template.format(destination=subscription.destination, **self.config)
+
+        # Build payload
+        payload_key = self._get_setting('payload_key')
+        if payload_key:
+            # Message-based payload
+            msg_format = self._get_setting('message_format', '{type}: {text}')
+            message = "\n".join(msg_format.format(type=event.get_type_display(), text=event.notification_text)
+                                for event in events)
+            payload = {payload_key: message}
+
+            # Add destination to payload if configured
+            dest_key = self._get_setting('destination_payload_key')
+            if dest_key:
+                payload[dest_key] = subscription.destination
+
+            # Merge extra payload fields
+            extra = self._get_setting('extra_payload', {})
+            payload.update(extra)
+        elif len(events) == 1:
+            # Generic format - send full event JSON
+            payload = self._event_json(events[0])
+        else:
+            payload = {"events": [self._event_json(event) for event in events]}
+        return url, payload
+
+    def prepare_notification(self, subscription: NotificationSubscription, events: list):
+        url, payload = self.build_request(subscription, events)
+        return webhook_delivery.Webhook(url, payload,
+                                        timeout=self.config.get('timeout', webhook_delivery.DEFAULT_TIMEOUT),
+                                        rate=str(self.config.get('rate', webhook_delivery.DEFAULT_RATE)))
 
+    def send_notification(self, subscription: NotificationSubscription, event: Event) -> bool:
         try:
-            # Build URL from template
-            url_template = self._get_setting('url_template', '{destination}')
-            url = url_template.format(destination=subscription.destination, **self.config)
-
-            # Build payload
-            payload_key = self._get_setting('payload_key')
-            if payload_key:
-                # Message-based payload
-                msg_format = self._get_setting('message_format', '{type}: {text}')
-                message = msg_format.format(type=event.get_type_display(), text=event.notification_text)
-                payload = {payload_key: message}
-
-                # Add destination to payload if configured
-                dest_key = self._get_setting('destination_payload_key')
-                if dest_key:
-                    payload[dest_key] = subscription.destination
-
-                # Merge extra payload fields
-                extra = self._get_setting('extra_payload', {})
-                payload.update(extra)
-            else:
-                # Generic format - send full event JSON
-                payload = {
-                    "event_type": event.type,
-                    "event_type_display": event.get_type_display(),
-                    "notification_text": event.notification_text,
-                    "timestamp": event.timestamp.isoformat(),
-                    "hunt_id": event.hunt_id,
-                    "puzzle_id": event.puzzle_id,
-                    "team_id": event.team_id,
-                }
-
-            response = requests.post(url, json=payload, timeout=10)
-            response.raise_for_status()
+            self.prepare_notification(subscription, [event]).send()
             return True
         except Exception as e:
-            logger.error(f"Failed to send {fmt} notification: {e}")
+            logger.error(f"Failed to send {self.config.get('format', 'generic')} notification: {e}")
             return False
 
 
+def _retry_delay(attempts, retry_after=None):
+    """ Seconds to wait before the next attempt, backing off exponentially but never sooner than asked """
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return max(delay, retry_after or 0)
+
+
+def _park_failing_subscriptions(subscription_ids):
+    """ Deactivate subscriptions whose latest deliveries were all dead letters, they are unlikely to recover """
+    parked = []
+    for subscription in NotificationSubscription.objects.filter(pk__in=subscription_ids, active=True):
+        latest = list(subscription.deliveries.order_by('-created_at', '-pk')
+                      .values_list('status', flat=True)[:DEAD_LETTER_THRESHOLD])
+        if len(latest) == DEAD_LETTER_THRESHOLD and all(s == NotificationDelivery.Status.DEAD for s in latest):
+            logger.warning(f"Deactivating notification subscription {subscription.pk} after "
+                           f"{DEAD_LETTER_THRESHOLD} undeliverable notifications")
+            parked.append(subscription.pk)
+    if parked:
+        # Update the rows directly rather than saving, which would validate destinations that may well no
+        # longer pass, failing the very subscriptions that most need parking
+        with transaction.atomic():
+            NotificationSubscription.objects.filter(pk__in=parked).update(active=False)
+            NotificationRoute.objects.filter(subscription_id__in=parked).delete()
+
+
+def send_deliveries(deliveries):
+    """
+    Send (NotificationDelivery, Webhook) pairs concurrently and record how each went.
+
+    Webhooks to a destination over its rate are put off until it has room, without counting as an attempt.
+    Failed webhooks are retried with exponential backoff, waiting at least as long as the destination's
+    Retry-After, until they fail permanently or run out of attempts and become dead letters.
+    """
+    limiter = get_limiter()
+    to_send = []
+    retries = []
+    for delivery, webhook in deliveries:
+        result = limiter.consume(webhook.rate_limit_key, *webhook.parsed_rate)
+        if result.allowed:
+            to_send.append((delivery, webhook))
+        else:
+            retries.append((delivery, result.time_left))
+
+    errors = webhook_delivery.deliver_concurrently([webhook for _, webhook in to_send])
+    now = timezone.now()
+    dead_subscription_ids = set()
+    for (delivery, _), error in zip(to_send, errors):
+        delivery.attempts += 1
+        if error is None:
+            delivery.status = NotificationDelivery.Status.SENT
+            delivery.sent_time = now
+            delivery.last_error = ""
+            continue
+        delivery.last_error = str(error) or error.__class__.__name__
+        if getattr(error, 'permanent', False) or delivery.attempts >= MAX_DELIVERY_ATTEMPTS:
+            logger.error(f"Giving up on notification delivery {delivery.pk}: {delivery.last_error}")
+            delivery.status = NotificationDelivery.Status.DEAD
+            dead_subscription_ids.add(delivery.subscription_id)
+        else:
+            retries.append((delivery, _retry_delay(delivery.attempts, getattr(error, 'retry_after', None))))
+
+    for delivery, delay in retries:
+        delivery.next_attempt_time = now + timedelta(seconds=delay)
+    NotificationDelivery.objects.bulk_update(
+        [delivery for delivery, _ in deliveries],
+        ['status', 'attempts', 'last_error', 'next_attempt_time', 'sent_time'])
+    for delivery, delay in retries:
+        retry_notification_delivery.schedule((delivery.pk,), delay=delay)
+    _park_failing_subscriptions(dead_subscription_ids)
+
+
+@task()
+def retry_notification_delivery(delivery_id: int):
+    """Huey task to try sending a pending notification delivery again"""
+    delivery = (NotificationDelivery.objects
+                .select_related('event__hunt', 'event__puzzle', 'event__user', 'subscription__platform')
+                .filter(pk=delivery_id, status=NotificationDelivery.Status.PENDING).first())
+    if delivery is None:
+        return
+    subscription = delivery.subscription
+    handler = NotificationHandler.create_handler(subscription.platform)
+    if not (subscription.active and subscription.platform.enabled and handler and handler.concurrent):
+        delivery.status = NotificationDelivery.Status.DEAD
+        delivery.last_error = "The subscription or its platform was disabled"
+        delivery.save()
+        return
+    events = delivery.events
+    if not events:
+        delivery.status = NotificationDelivery.Status.DEAD
+        delivery.last_error = "The events were archived"
+        delivery.save()
+        return
+    try:
+        webhook = handler.prepare_notification(subscription, events)
+    except Exception as e:
+        delivery.status = NotificationDelivery.Status.DEAD
+        delivery.last_error = f"Could not build notification: {e}"
+        delivery.save()
+        return
+    send_deliveries([(delivery, webhook)])
+
+
+def queue_emails(emails):
+    """
+    Queue notification emails to be sent with any others queued in the next NOTIFICATION_EMAIL_BATCH_INTERVAL
+    seconds. They are sent straight away if the interval is 0 or there is no shared outbox.
+    """
+    if not emails:
+        return
+    interval = settings.NOTIFICATION_EMAIL_BATCH_INTERVAL
+    outbox = email_delivery.get_email_outbox()
+    if interval and outbox is not None:
+        try:
+            if outbox.add(emails):
+                send_queued_emails.schedule(delay=interval)
+            return
+        except Exception as e:
+            logger.error(f"Error queueing {len(emails)} notification emails: {e}")
+    send_emails(emails)
+
+
+def send_emails(emails):
+    """
+    Send notification emails as fast as NOTIFICATION_EMAIL_MAX_PER_SECOND allows, putting any held back by it
+    in the outbox, or a task of their own if there is none, to be sent once the ceiling allows.
+
+    Returns:
+        int: The number of emails sent or queued
+    """
+    num_sent, held, wait = email_delivery.send_batch(emails)
+    if not held:
+        return num_sent
+    outbox = email_delivery.get_email_outbox()
+    if outbox is not None:
+        try:
+            if outbox.add(held):
+                send_queued_emails.schedule(delay=wait)
+            return num_sent + len(held)
+        except Exception as e:
+            logger.error(f"Error queueing {len(held)} notification emails: {e}")
+    send_held_emails.schedule((held,), delay=wait)
+    return num_sent + len(held)
+
+
+@task()
+def send_queued_emails():
+    """Huey task to send every email in the outbox as one batch"""
+    send_emails(email_delivery.get_email_outbox().take())
+
+
+@task()
+def send_held_emails(emails):
+    """Huey task to send emails held back by the rate ceiling when there is no outbox to wait in"""
+    send_emails(emails)
+
+
 @task()
 def send_event_notifications(event_id: int):
     """Huey task to send notifications for an event"""
     try:
-        event = Event.objects.get(pk=event_id)
-
-        # Get all active subscriptions that match this event type
-        subscriptions = NotificationSubscription.objects.filter(
-            active=True,
-            event_types__contains=event.type,
-            platform__enabled=True
-        )
-
-        # Filter by hunt (hunt-specific OR global subscriptions)
-        subscriptions = subscriptions.filter(
-            Q(hunt=event.hunt) | Q(hunt__isnull=True)
-        )
-
-        # If event is team-specific, filter to team members only
-        if event.team:
-            subscriptions = subscriptions.filter(user__in=event.team.members.all())
-
-        # Send notifications through appropriate handlers
-        for subscription in subscriptions:
-            handler = NotificationHandler.create_handler(subscription.platform)
-            if handler:
+        event = Event.objects.select_related('hunt', 'puzzle', 'user').get(pk=event_id)
+
+        # Send notifications through appropriate handlers, creating one handler per platform
+        handlers = {}
+        webhooks = []
+        emails = []
+        digest_store = get_digest_store()
+        for route in NotificationRoute.objects.for_event(event):
+            subscription = route.subscription
+            if subscription.platform_id not in handlers:
+                handlers[subscription.platform_id] = NotificationHandler.create_handler(subscription.platform)
+            handler = handlers[subscription.platform_id]
+            if not handler:
+                continue
+            if subscription.digest_window and handler.supports_digest and digest_store is not None:
+                try:
+                    if digest_store.add(subscription.pk, event.pk, subscription.digest_window):
+                        flush_notification_digest.schedule((subscription.pk,), delay=subscription.digest_window)
+                    continue
+                except Exception as e:
+                    # Sending the event on its own is better than losing it
+                    logger.error(f"Error adding event {event_id} to digest of subscription {subscription.pk}: {e}")
+            if not handler.concurrent and not handler.batched:
                 handler.send_notification(subscription, event)
+                continue
+            try:
+                notification = handler.prepare_notification(subscription, [event])
+            except Exception as e:
+                logger.error(f"Failed to prepare notification for subscription {subscription.pk}: {e}")
+                continue
+            if handler.batched:
+                emails.append(notification)
+            else:
+                webhooks.append((subscription, notification))
+
+        queue_emails(emails)
+
+        # Webhooks are sent together, so a slow destination doesn't hold up the others, and are recorded
+        # so that failures can be retried
+        deliveries = NotificationDelivery.objects.bulk_create(
+            [NotificationDelivery(event=event, subscription=subscription) for subscription, _ in webhooks])
+        send_deliveries(list(zip(deliveries, [webhook for _, webhook in webhooks])))
 
     except Event.DoesNotExist:
         logger.error(f"Event {event_id} not found")
     except Exception as e:
         logger.error(f"Error sending notifications for event {event_id}: {e}")
+
+
+@task()
+def flush_notification_digest(subscription_id: int):
+    """Huey task to send the events gathered in a subscription's digest window as one notification"""
+    event_ids = get_digest_store().take(subscription_id)
+    if not event_ids:
+        return
+    subscription = (NotificationSubscription.objects.select_related('platform', 'user')
+                    .filter(pk=subscription_id, active=True, platform__enabled=True).first())
+    handler = NotificationHandler.create_handler(subscription.platform) if subscription else None
+    if handler is None:
+        return
+    events = list(Event.objects.select_related('hunt', 'puzzle', 'user').filter(pk__in=event_ids)
+                  .order_by('timestamp', 'pk'))
+    if not events:
+        return
+
+    try:
+        notification = handler.prepare_notification(subscription, events)
+    except Exception as e:
+        logger.error(f"Failed to prepare digest for subscription {subscription.pk}: {e}")
+        return
+    if handler.batched:
+        queue_emails([notification])
+        return
+    delivery = NotificationDelivery.objects.create(event=events[0], subscription=subscription,
+                                                   digest_event_ids=[event.pk for event in events])
+    send_deliveries([(delivery, notification)])
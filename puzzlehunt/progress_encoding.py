@@ -0,0 +1,118 @@
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# One team's row of the progress board, with its ranking values in the order of the hunt's ranking rules
+ProgressTeam = namedtuple("ProgressTeam", ["id", "name", "ranking"])
+# One team x puzzle cell of the progress board
+ProgressCell = namedtuple("ProgressCell", ["team_id", "puzzle_id", "unlock_time", "solve_time", "last_submission",
+                                           "num_submissions", "num_hints"])
+
+# Cell fields that hold times, sent as offsets from the epoch in the columnar formats
+_CELL_TIME_FIELDS = ["unlock_time", "solve_time", "last_submission"]
+_CELL_COUNT_FIELDS = ["num_submissions", "num_hints"]
+
+FORMATS = ["json", "columnar", "msgpack"]
+CONTENT_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+
+def available_formats():
+    """ The formats that can be produced here, msgpack needs the optional msgpack package """
+    return [name for name in FORMATS if name != "msgpack" or msgpack is not None]
+
+
+def encode_rows(teams, cells, column_names):
+    """
+    Encode the progress board as the original row format, one object per team holding one object per cell.
+
+    Returns:
+        list: The "data" list of the progress_data response
+    """
+    cells_by_team = {}
+    for cell in cells:
+        cells_by_team.setdefault(cell.team_id, {})[str(cell.puzzle_id)] = {
+            "unlock_time": cell.unlock_time.isoformat() if cell.unlock_time else None,
+            "solve_time": cell.solve_time.isoformat() if cell.solve_time else None,
+            "last_submission": cell.last_submission.isoformat() if cell.last_submission else None,
+            "num_submissions": cell.num_submissions,
+            "num_hints": cell.num_hints,
+        }
+    return [
+        {
+            "team": {"id": team.id, "name": team.name},
+            "ranking_columns": dict(zip(column_names, team.ranking)),
+            "puzzles": cells_by_team.get(team.id, {}),
+        }
+        for team in teams
+    ]
+
+
+def _offset(value, epoch):
+    if isinstance(value, datetime):
+        return int((value - epoch).total_seconds())
+    return value
+
+
+def encode_columnar(teams, cells, column_names, epoch):
+    """
+    Encode the progress board column by column: parallel arrays of team fields, a list of the puzzles
+    the cells refer to, and a sparse cell matrix as parallel arrays indexing into the team and puzzle
+    lists. Times are whole seconds from the epoch, usually the hunt's start.
+
+    Returns:
+        dict: The teams, puzzles, and cells parts of the response
+    """
+    team_index = {team.id: i for i, team in enumerate(teams)}
+    puzzle_ids = []
+    puzzle_index = {}
+    columns = {"team": [], "puzzle": []}
+    columns.update({field: [] for field in _CELL_TIME_FIELDS + _CELL_COUNT_FIELDS})
+    for cell in cells:
+        if cell.team_id not in team_index:
+            continue
+        if cell.puzzle_id not in puzzle_index:
+            puzzle_index[cell.puzzle_id] = len(puzzle_ids)
+            puzzle_ids.append(str(cell.puzzle_id))
+        columns["team"].append(team_index[cell.team_id])
+        columns["puzzle"].append(puzzle_index[cell.puzzle_id])
+        for field in _CELL_TIME_FIELDS:
+            columns[field].append(_offset(getattr(cell, field), epoch))
+        for field in _CELL_COUNT_FIELDS:
+            columns[field].append(getattr(cell, field))
+
+    return {
+        "epoch": epoch.isoformat(),
+        "columns": list(column_names),
+        "teams": {
+            "id": [team.id for team in teams],
+            "name": [team.name for team in teams],
+            # One array per ranking column, rather than one per team
+            "ranking": [[_offset(team.ranking[i], epoch) for team in teams] for i in range(len(column_names))],
+        },
+        "puzzles": puzzle_ids,
+        "cells": columns,
+    }
+
+
+def serialize(payload, format):
+    """ Serialize a columnar payload as JSON or msgpack bytes """
+    if format == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+
+
+def etag(body):
+    """ A strong ETag for a serialized response body """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
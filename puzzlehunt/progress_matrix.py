@@ -0,0 +1,396 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+from django.db import transaction
+from django.db.models import Max, Count
+
+from .progress_encoding import ProgressCell
+from .shared_cache import cache_is_process_local, cache_shared_with_tasks, get_shared_redis
+
+logger = logging.getLogger(__name__)
+
+# Per cell fields, stored in each team's hash as "<puzzle id>:<field>"
+UNLOCK = "u"
+SOLVE = "s"
+SUBMISSIONS = "n"
+LAST_SUBMISSION = "l"
+HINTS = "h"
+# Times are stored as whole microseconds since the Unix epoch, so they survive the round trip exactly
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _teams_key(hunt_id):
+    return f"progress:{hunt_id}:teams"
+
+
+def _team_key(team_id):
+    # Team IDs are unique across hunts, so a team's hash can be found without looking up its hunt
+    return f"progress:team:{team_id}"
+
+
+def _ready_key(hunt_id):
+    return f"progress:{hunt_id}:ready"
+
+
+class RedisProgressMatrix:
+    """
+    The progress board of every hunt, kept in Redis as a hash per team holding each puzzle's unlock time,
+    solve time, submission count, last submission time and hint count.
+
+    A hunt's matrix is only read once it has been marked ready, either when the hunt is created or by
+    the rebuild_progress_matrix command, so a matrix that started partway through a hunt is never trusted.
+    A failed write unmarks the hunt, sending readers back to the database until it is rebuilt.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def apply(self, ops):
+        """
+        Apply (hunt_id, team_id, field, op, value) operations, op being "set", "setnx" or "incr".
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for hunt_id, team_id, field, op, value in ops:
+            key = _team_key(team_id)
+            pipe.sadd(_teams_key(hunt_id), team_id)
+            if op == "incr":
+                pipe.hincrby(key, field, value)
+            elif op == "setnx":
+                pipe.hsetnx(key, field, value)
+            else:
+                pipe.hset(key, field, value)
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Error updating progress matrix: {e}")
+            self.unmark({op[0] for op in ops})
+
+    def remove_fields(self, team_id, fields):
+        try:
+            self.client.hdel(_team_key(team_id), *fields)
+        except redis.RedisError as e:
+            # Without the hunt there's nothing to unmark, the consistency check will find the stale cell
+            logger.error(f"Error updating progress matrix for team {team_id}: {e}")
+
+    def remove_team(self, hunt_id, team_id):
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.srem(_teams_key(hunt_id), team_id)
+            pipe.delete(_team_key(team_id))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Error updating progress matrix: {e}")
+            self.unmark([hunt_id])
+
+    def replace_hunt(self, hunt_id, teams):
+        """ Replace a hunt's whole matrix with {team_id: {field: value}} and mark it ready """
+        try:
+            old_teams = self.client.smembers(_teams_key(hunt_id))
+            pipe = self.client.pipeline(transaction=True)
+            pipe.delete(_teams_key(hunt_id), *[_team_key(int(team_id)) for team_id in old_teams])
+            for team_id, fields in teams.items():
+                pipe.sadd(_teams_key(hunt_id), team_id)
+                if fields:
+                    pipe.hset(_team_key(team_id), mapping=fields)
+            pipe.set(_ready_key(hunt_id), 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Error rebuilding progress matrix for hunt {hunt_id}: {e}")
+            self.unmark([hunt_id])
+
+    def unmark(self, hunt_ids):
+        try:
+            self.client.delete(*[_ready_key(hunt_id) for hunt_id in hunt_ids])
+        except redis.RedisError as e:
+            logger.error(f"Error unmarking progress matrix: {e}")
+
+    def read_hunt(self, hunt_id, team_ids=None):
+        """
+        Read a hunt's matrix in two round trips.
+
+        Returns:
+            dict or None: {team_id: {field: value}}, or None if the hunt's matrix isn't ready
+        """
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(_ready_key(hunt_id))
+            pipe.smembers(_teams_key(hunt_id))
+            ready, members = pipe.execute()
+            if not ready:
+                return None
+            members = [int(team_id) for team_id in members]
+            if team_ids is not None:
+                members = [team_id for team_id in members if team_id in team_ids]
+            pipe = self.client.pipeline(transaction=False)
+            for team_id in members:
+                pipe.hgetall(_team_key(team_id))
+            hashes = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Error reading progress matrix for hunt {hunt_id}: {e}")
+            return None
+        return {team_id: {field.decode(): value.decode() for field, value in fields.items()}
+                for team_id, fields in zip(members, hashes)}
+
+
+class MemoryProgressMatrix:
+    """ A process local progress matrix, used along with the process local cache in development and tests """
+
+    def __init__(self):
+        self.hunts = {}
+        self.ready = set()
+        self.lock = threading.Lock()
+
+    def apply(self, ops):
+        with self.lock:
+            for hunt_id, team_id, field, op, value in ops:
+                fields = self.hunts.setdefault(hunt_id, {}).setdefault(team_id, {})
+                if op == "incr":
+                    fields[field] = str(int(fields.get(field, 0)) + value)
+                elif op == "setnx":
+                    fields.setdefault(field, str(value))
+                else:
+                    fields[field] = str(value)
+
+    def remove_fields(self, team_id, fields):
+        with self.lock:
+            for teams in self.hunts.values():
+                for field in fields:
+                    teams.get(team_id, {}).pop(field, None)
+
+    def remove_team(self, hunt_id, team_id):
+        with self.lock:
+            self.hunts.get(hunt_id, {}).pop(team_id, None)
+
+    def replace_hunt(self, hunt_id, teams):
+        with self.lock:
+            self.hunts[hunt_id] = {team_id: {field: str(value) for field, value in fields.items()}
+                                   for team_id, fields in teams.items()}
+            self.ready.add(hunt_id)
+
+    def unmark(self, hunt_ids):
+        with self.lock:
+            self.ready.difference_update(hunt_ids)
+
+    def read_hunt(self, hunt_id, team_ids=None):
+        with self.lock:
+            if hunt_id not in self.ready:
+                return None
+            return {team_id: dict(fields) for team_id, fields in self.hunts.get(hunt_id, {}).items()
+                    if team_ids is None or team_id in team_ids}
+
+    def reset(self):
+        with self.lock:
+            self.hunts.clear()
+            self.ready.clear()
+
+
+_matrix = None
+_matrix_checked = False
+
+
+def get_progress_matrix():
+    """
+    Get the shared progress matrix: in Redis if the cache is, in memory if the cache is process local and
+    tasks run in this process too, or None if there is no shared cache to keep it consistent with the
+    task consumer's unlocks.
+    """
+    global _matrix, _matrix_checked
+    if not _matrix_checked:
+        client = get_shared_redis()
+        if client is not None:
+            _matrix = RedisProgressMatrix(client)
+        elif cache_is_process_local() and cache_shared_with_tasks():
+            _matrix = MemoryProgressMatrix()
+        _matrix_checked = True
+    return _matrix
+
+
+def _timestamp(value):
+    return (value - _EPOCH) // _MICROSECOND if value is not None else None
+
+
+def _datetime(value):
+    return _EPOCH + int(value) * _MICROSECOND if value is not None else None
+
+
+def _event_ops(fields):
+    """ The matrix operations for one event, given the fields create_event worked out for it """
+    from .models import Event
+    team = fields.get("team")
+    puzzle = fields.get("puzzle")
+    if team is None or puzzle is None:
+        return []
+    hunt_id, team_id, puzzle_id = fields["hunt"].pk, team.pk, puzzle.pk
+    timestamp = _timestamp(fields["timestamp"])
+    match fields["type"]:
+        case Event.EventType.PUZZLE_UNLOCK:
+            return [(hunt_id, team_id, f"{puzzle_id}:{UNLOCK}", "setnx", timestamp)]
+        case Event.EventType.PUZZLE_SOLVE:
+            return [(hunt_id, team_id, f"{puzzle_id}:{SOLVE}", "set", timestamp)]
+        case Event.EventType.PUZZLE_SUBMISSION:
+            return [(hunt_id, team_id, f"{puzzle_id}:{SUBMISSIONS}", "incr", 1),
+                    (hunt_id, team_id, f"{puzzle_id}:{LAST_SUBMISSION}", "set", timestamp)]
+        case Event.EventType.HINT_REQUEST:
+            return [(hunt_id, team_id, f"{puzzle_id}:{HINTS}", "incr", 1)]
+    return []
+
+
+def record_events(all_fields):
+    """ Update the matrix for newly created events once their transaction commits """
+    matrix = get_progress_matrix()
+    if matrix is None:
+        return
+    ops = [op for fields in all_fields for op in _event_ops(fields)]
+    if ops:
+        transaction.on_commit(lambda: matrix.apply(ops))
+
+
+def record_status_removed(team_id, puzzle_id):
+    """ Take a deleted puzzle status's unlock and solve off the matrix once the deletion commits """
+    matrix = get_progress_matrix()
+    if matrix is not None:
+        fields = [f"{puzzle_id}:{UNLOCK}", f"{puzzle_id}:{SOLVE}"]
+        transaction.on_commit(lambda: matrix.remove_fields(team_id, fields))
+
+
+def record_team_removed(hunt_id, team_id):
+    """ Drop a deleted team from the matrix once the deletion commits """
+    matrix = get_progress_matrix()
+    if matrix is not None:
+        transaction.on_commit(lambda: matrix.remove_team(hunt_id, team_id))
+
+
+def reset_hunt(hunt):
+    """ Start a new or reset hunt's matrix over with no progress, which it can be trusted to be from here on """
+    matrix = get_progress_matrix()
+    if matrix is not None:
+        teams = {team_id: {} for team_id in hunt.team_set.values_list('pk', flat=True)}
+        transaction.on_commit(lambda: matrix.replace_hunt(hunt.pk, teams))
+
+
+def load_progress_cells(hunt, team_ids=None, puzzle_ids=None):
+    """
+    Build the progress board's cells from the database, optionally only for some teams and puzzles.
+
+    Returns:
+        list: A ProgressCell for each of the hunt's puzzle statuses
+    """
+    from .models import PuzzleStatus, Submission, Hint
+    statuses = PuzzleStatus.objects.filter(puzzle__hunt=hunt)
+    submissions = Submission.objects.filter(team__hunt=hunt)
+    hints = Hint.objects.filter(team__hunt=hunt)
+    if team_ids is not None:
+        statuses = statuses.filter(team_id__in=team_ids)
+        submissions = submissions.filter(team_id__in=team_ids)
+        hints = hints.filter(team_id__in=team_ids)
+    if puzzle_ids is not None:
+        statuses = statuses.filter(puzzle_id__in=puzzle_ids)
+        submissions = submissions.filter(puzzle_id__in=puzzle_ids)
+        hints = hints.filter(puzzle_id__in=puzzle_ids)
+
+    submissions = {(s['team'], s['puzzle']): s for s in submissions.values('team', 'puzzle').annotate(
+        last_submission=Max('submission_time'), num_submissions=Count('*'))}
+    hints = {(h['team'], h['puzzle']): h['num_hints']
+             for h in hints.values('team', 'puzzle').annotate(num_hints=Count('*'))}
+
+    cells = []
+    for team_id, puzzle_id, unlock_time, solve_time in statuses.values_list('team_id', 'puzzle_id', 'unlock_time',
+                                                                           'solve_time'):
+        submission = submissions.get((team_id, puzzle_id), {})
+        cells.append(ProgressCell(team_id, puzzle_id, unlock_time, solve_time, submission.get('last_submission'),
+                                  submission.get('num_submissions', 0), hints.get((team_id, puzzle_id), 0)))
+    return cells
+
+
+def _cell_fields(cell):
+    fields = {f"{cell.puzzle_id}:{UNLOCK}": _timestamp(cell.unlock_time)}
+    if cell.solve_time is not None:
+        fields[f"{cell.puzzle_id}:{SOLVE}"] = _timestamp(cell.solve_time)
+    if cell.num_submissions:
+        fields[f"{cell.puzzle_id}:{SUBMISSIONS}"] = cell.num_submissions
+        fields[f"{cell.puzzle_id}:{LAST_SUBMISSION}"] = _timestamp(cell.last_submission)
+    if cell.num_hints:
+        fields[f"{cell.puzzle_id}:{HINTS}"] = cell.num_hints
+    return fields
+
+
+def rebuild_hunt(hunt):
+    """
+    Rehydrate a hunt's matrix from the database and mark it ready.
+
+    Returns:
+        int: The number of cells written, or None if there is no progress matrix
+    """
+    matrix = get_progress_matrix()
+    if matrix is None:
+        return None
+    teams = {team_id: {} for team_id in hunt.team_set.values_list('pk', flat=True)}
+    cells = load_progress_cells(hunt)
+    for cell in cells:
+        teams.setdefault(cell.team_id, {}).update(_cell_fields(cell))
+    matrix.replace_hunt(hunt.pk, teams)
+    return len(cells)
+
+
+def read_progress_cells(hunt, team_ids=None, puzzle_ids=None):
+    """
+    Read the progress board's cells from the matrix, in the same form as load_progress_cells.
+
+    Returns:
+        list or None: The cells, or None if the hunt's matrix isn't available
+    """
+    matrix = get_progress_matrix()
+    if matrix is None:
+        return None
+    teams = matrix.read_hunt(hunt.pk, team_ids=team_ids)
+    if teams is None:
+        return None
+
+    cells = []
+    for team_id, fields in teams.items():
+        puzzles = defaultdict(dict)
+        for key, value in fields.items():
+            puzzle_id, field = key.rsplit(":", 1)
+            puzzles[puzzle_id][field] = value
+        for puzzle_id, values in puzzles.items():
+            # Only puzzles the team has unlocked are on the board
+            if UNLOCK not in values or (puzzle_ids is not None and puzzle_id not in puzzle_ids):
+                continue
+            cells.append(ProgressCell(team_id, puzzle_id, _datetime(values.get(UNLOCK)), _datetime(values.get(SOLVE)),
+                                      _datetime(values.get(LAST_SUBMISSION)), int(values.get(SUBMISSIONS, 0)),
+                                      int(values.get(HINTS, 0))))
+    return cells
+
+
+def compare_hunt(hunt):
+    """
+    Compare a hunt's matrix with the database.
+
+    Returns:
+        list or None: (team_id, puzzle_id, database cell, matrix cell) for every cell that differs, with None
+        for a missing cell, or None if the hunt's matrix isn't available
+    """
+    matrix_cells = read_progress_cells(hunt)
+    if matrix_cells is None:
+        return None
+    db_cells = {(cell.team_id, cell.puzzle_id): cell for cell in load_progress_cells(hunt)}
+    matrix_cells = {(cell.team_id, cell.puzzle_id): cell for cell in matrix_cells}
+
+    def normalize(cell):
+        # The matrix hands back times in UTC, compare on the same terms
+        if cell is None:
+            return None
+        return cell._replace(**{field: getattr(cell, field).astimezone(dt_timezone.utc)
+                                for field in ("unlock_time", "solve_time", "last_submission")
+                                if getattr(cell, field) is not None})
+
+    differences = []
+    for key in sorted(db_cells.keys() | matrix_cells.keys(), key=str):
+        db_cell, matrix_cell = normalize(db_cells.get(key)), normalize(matrix_cells.get(key))
+        if db_cell != matrix_cell:
+            differences.append((key[0], key[1], db_cell, matrix_cell))
+    return differences
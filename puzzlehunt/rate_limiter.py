@@ -0,0 +1,169 @@
+import math
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+from .shared_cache import get_shared_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBMISSION_RATE = "3/5m"
+
+_PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+@lru_cache(maxsize=256)
+def parse_rate(rate):
+    """
+    Parse a rate string like "3/5m" (3 requests per 5 minutes) into (count, period in seconds).
+
+    Raises:
+        ValueError: If the rate isn't of the form X/YZ or X/Z, with Z one of s, m, h or d
+    """
+    try:
+        count, period = rate.strip().split("/")
+        unit = period[-1].lower()
+        multiplier = int(period[:-1]) if period[:-1] else 1
+        count = int(count)
+        seconds = multiplier * _PERIODS[unit]
+    except (ValueError, KeyError, IndexError):
+        raise ValueError(f"Invalid rate limit: {rate!r}")
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {rate!r}")
+    return count, seconds
+
+
+@dataclass
+class RateLimitResult:
+    """ The outcome of trying to consume from a rate limit bucket """
+    allowed: bool
+    time_left: float  # Seconds until the next request would be allowed, 0 if this one was
+
+    @property
+    def seconds_left(self):
+        """ time_left rounded up to whole seconds, for display """
+        return math.ceil(self.time_left)
+
+
+class MemoryTokenBucketLimiter:
+    """
+    A process local token bucket limiter, used when Redis isn't available (including in tests).
+    Buckets aren't shared between processes, so limits are per worker.
+    """
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, period):
+        refill_rate = capacity / period
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                result = RateLimitResult(True, 0.0)
+            else:
+                self.buckets[key] = (tokens, now)
+                result = RateLimitResult(False, (1 - tokens) / refill_rate)
+            if len(self.buckets) > self.MAX_BUCKETS:
+                self._prune(now)
+        return result
+
+    def _prune(self, now):
+        # Drop buckets that have been idle long enough to be full again, we can't tell them apart from new ones
+        for key, (tokens, last) in list(self.buckets.items()):
+            if now - last > 24 * 60 * 60:
+                del self.buckets[key]
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class RedisTokenBucketLimiter:
+    """
+    A token bucket limiter shared by every process through Redis. Checking and consuming happen in a
+    single Lua script, so concurrent requests can never both take the last token, and the bucket is
+    refilled using Redis' own clock so workers with skewed clocks agree.
+    """
+    SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local refill_rate = tonumber(ARGV[2])
+        local redis_time = redis.call('TIME')
+        local now = tonumber(redis_time[1]) + tonumber(redis_time[2]) / 1000000
+
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+
+        local allowed = 0
+        local time_left = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        else
+            time_left = (1 - tokens) / refill_rate
+        end
+
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        -- Once the bucket would be full again it's the same as a missing one, so let it expire
+        redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate * 1000) + 1000)
+        return {allowed, tostring(time_left)}
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, period):
+        try:
+            allowed, time_left = self.script(keys=[f"ratelimit:{key}"], args=[capacity, capacity / period])
+        except redis.RedisError as e:
+            # Fail open, a Redis hiccup shouldn't stop teams from submitting answers
+            logger.warning(f"Error checking rate limit for {key}: {e}")
+            return RateLimitResult(True, 0.0)
+        return RateLimitResult(bool(allowed), float(time_left))
+
+
+_limiter = None
+
+
+def get_limiter():
+    """ Get the shared limiter, backed by the Redis cache if it is configured """
+    global _limiter
+    if _limiter is None:
+        client = get_shared_redis()
+        if client is not None:
+            _limiter = RedisTokenBucketLimiter(client)
+        else:
+            _limiter = MemoryTokenBucketLimiter()
+    return _limiter
+
+
+def check_rate_limit(key, rate):
+    """
+    Atomically check and consume one request from the token bucket for key.
+
+    Buckets hold up to count requests, allowing bursts of that size, and refill continuously at
+    count / period requests per second.
+
+    Args:
+        key: The bucket to consume from
+        rate: A (count, period in seconds) tuple, as returned by parse_rate
+
+    Returns:
+        RateLimitResult or None: The result, or None if rate limiting is disabled
+    """
+    if not getattr(settings, 'RATELIMIT_ENABLE', True):
+        return None
+    count, period = rate
+    return get_limiter().consume(key, count, period)
@@ -0,0 +1,111 @@
+import re
+import uuid
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Patterns using any of these can't safely be combined into one regex, since their group numbers
+# and names would change or clash: numbered backreferences, named backreferences and conditionals.
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+class ResponseMatcher:
+    """
+    Matches submission text against a puzzle's auto responses.
+
+    Where possible, every response regex is combined into a single alternation with one named group
+    per response, so finding the first matching response takes a single regex pass. Patterns that
+    can't be combined fall back to being tried one at a time, exactly as re.match would. Invalid
+    patterns are logged and skipped.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.combined = None
+        self.patterns = None
+
+        combinable = not any(_UNCOMBINABLE.search(resp.regex) for resp in self.responses)
+        if combinable and self.responses:
+            try:
+                self.combined = re.compile(
+                    "|".join(f"(?P<r{i}>{resp.regex})" for i, resp in enumerate(self.responses)),
+                    re.IGNORECASE
+                )
+            except re.error:
+                # Most likely an inline global flag or a named group, fall back to separate patterns
+                self.combined = None
+        if self.combined is None:
+            self.patterns = []
+            for resp in self.responses:
+                try:
+                    self.patterns.append(re.compile(resp.regex, re.IGNORECASE))
+                except re.error as e:
+                    # One broken response shouldn't stop every submission to the puzzle from being checked
+                    logger.error(f"Skipping invalid regex {resp.regex!r} of response {resp.pk}: {e}")
+                    self.patterns.append(None)
+
+    def match(self, text):
+        """
+        Find the first response whose regex matches the start of the text.
+
+        Returns:
+            Response or None: The matching response, if any
+        """
+        if self.combined is not None:
+            match = self.combined.match(text)
+            # The wrapping group is always the last one to close, so lastgroup names the response
+            return self.responses[int(match.lastgroup[1:])] if match else None
+
+        for pattern, resp in zip(self.patterns, self.responses):
+            if pattern is not None and pattern.match(text):
+                return resp
+        return None
+
+
+# Maps puzzle IDs to (version, ResponseMatcher). The version is shared between processes through the
+# cache, so saving or deleting a response in one worker invalidates the matchers held by every worker.
+_matchers = {}
+
+
+def _version_key(puzzle_id):
+    return f"response_matcher_version:{puzzle_id}"
+
+
+def get_response_matcher(puzzle):
+    """
+    Get the ResponseMatcher for a puzzle's current auto responses, building it only if the puzzle's
+    responses have changed since this process last built one.
+
+    Without a shared cache there's no way to hear about changes made by other processes, so the
+    matcher is rebuilt every time.
+    """
+    key = _version_key(puzzle.pk)
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Error getting response matcher version for puzzle {puzzle.pk}: {e}")
+        version = None
+
+    cached = _matchers.get(puzzle.pk)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+
+    matcher = ResponseMatcher(puzzle.response_set.all())
+    if version is not None:
+        _matchers[puzzle.pk] = (version, matcher)
+    return matcher
+
+
+def invalidate_response_matcher(puzzle_id):
+    """ Mark the cached matchers for a puzzle as stale in every process """
+    _matchers.pop(puzzle_id, None)
+    try:
+        # A fresh random version rather than an increment, so a lost key can never resurrect an old version
+        cache.set(_version_key(puzzle_id), uuid.uuid4().hex, None)
+    except Exception as e:
+        logger.warning(f"Error invalidating response matcher for puzzle {puzzle_id}: {e}")
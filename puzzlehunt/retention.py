@@ -0,0 +1,85 @@
+import gzip
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django_eventstream.storage import DjangoModelStorage
+
+logger = logging.getLogger(__name__)
+
+# How long eventstream keeps messages for clients that reconnect, matching django_eventstream's own default
+DEFAULT_EVENTSTREAM_RETENTION = 24 * 60
+# Number of rows deleted per statement, so that trimming never holds locks on a huge range of rows
+DELETE_BATCH_SIZE = 5000
+# Number of events read from the database at a time while archiving
+ARCHIVE_CHUNK_SIZE = 2000
+
+
+class PuzzlehuntEventStorage(DjangoModelStorage):
+    """
+    Eventstream storage in the database, trimmed by the trim_eventstream_storage task.
+
+    DjangoModelStorage looks for expired messages on every publish and deletes them one row at a time,
+    this leaves that to a periodic bulk delete instead.
+    """
+
+    def trim_event_log(self):
+        pass
+
+
+def _delete_in_batches(queryset):
+    """ Delete the rows of a queryset a batch at a time, returning how many were deleted """
+    total = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:DELETE_BATCH_SIZE])
+        if not pks:
+            return total
+        total += queryset.model.objects.filter(pk__in=pks).delete()[0]
+
+
+def trim_eventstream(retention=None):
+    """
+    Delete stored eventstream messages older than the retention window, in minutes, which defaults to the
+    EVENTSTREAM_RETENTION setting. Clients reconnecting from further back are told to reload.
+
+    Returns:
+        int: The number of messages deleted
+    """
+    from django_eventstream.models import Event as StreamEvent
+
+    if retention is None:
+        retention = getattr(settings, 'EVENTSTREAM_RETENTION', DEFAULT_EVENTSTREAM_RETENTION)
+    cutoff = timezone.now() - timedelta(minutes=retention)
+    return _delete_in_batches(StreamEvent.objects.filter(created__lt=cutoff))
+
+
+def archive_hunt_events(hunt, path, delete=False):
+    """
+    Write all of a hunt's events to a gzipped JSONL file, one event per line, optionally deleting
+    them from the database once the file is complete.
+
+    Returns:
+        int: The number of events archived
+    """
+    from .models import Event
+
+    events = Event.objects.filter(hunt=hunt)
+    last_pk = events.order_by('-pk').values_list('pk', flat=True).first()
+    if last_pk is None:
+        return 0
+    # Only events up to the last one seen are archived, and so deleted, even if more arrive meanwhile
+    events = events.filter(pk__lte=last_pk)
+
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        for event in events.order_by('pk').values().iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+            archive.write(json.dumps(event, cls=DjangoJSONEncoder) + "\n")
+            count += 1
+
+    if delete:
+        _delete_in_batches(events)
+        logger.info(f"Archived and deleted {count} events of hunt {hunt.name} to {path}")
+    return count
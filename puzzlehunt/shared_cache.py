@@ -0,0 +1,36 @@
+import redis
+from django.conf import settings
+
+LOCMEM_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+REDIS_BACKEND = 'django.core.cache.backends.redis.RedisCache'
+
+_redis = None
+_redis_checked = False
+
+
+def get_shared_redis():
+    """
+    Get a Redis client for the default cache's server, or None if the cache isn't in Redis. The client, and
+    with it one connection pool, is shared by everything that keeps its own state alongside the cache.
+    """
+    global _redis, _redis_checked
+    if not _redis_checked:
+        cache_settings = settings.CACHES['default']
+        if cache_settings['BACKEND'] == REDIS_BACKEND:
+            _redis = redis.from_url(cache_settings['LOCATION'])
+        _redis_checked = True
+    return _redis
+
+
+def cache_is_process_local():
+    """ Whether the default cache lives in this process's memory, so other processes can't see it """
+    return settings.CACHES['default']['BACKEND'] == LOCMEM_BACKEND
+
+
+def cache_shared_with_tasks():
+    """
+    Whether Huey tasks see the same default cache as the process that queued them. A process local cache
+    only is when tasks run immediately, as in tests; with a separate consumer, such as in local development,
+    anything the consumer stores is invisible to the web process.
+    """
+    return not cache_is_process_local() or settings.HUEY.get('immediate', False)
@@ -0,0 +1,104 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django_eventstream import send_event
+
+logger = logging.getLogger(__name__)
+
+# Staff pages can take a moment's delay, so messages for the staff channel are gathered into batches
+# of up to STAFF_EVENT_BATCH_SIZE events, published at most STAFF_EVENT_BATCH_INTERVAL ms after the
+# first event in the batch. Every batch is a single SSE message (and eventstream storage row) holding
+# a list of events.
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_INTERVAL = 250
+
+
+class StaffEventBuffer:
+    """
+    A process wide buffer of staff channel messages, shared by every request and worker thread.
+    Events are only added once the transaction that created them commits.
+
+    Batches are published by a single long lived flusher thread, as soon as a full batch is waiting or
+    once the first event has waited the batch interval, so requests never wait on publishing and events
+    go out in the order they were added. With a batch interval of 0 batching is off, and events are
+    published by the thread adding them.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._publish_lock = threading.Lock()
+        self._events = []
+        self._flusher = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'STAFF_EVENT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    @property
+    def batch_interval(self):
+        return getattr(settings, 'STAFF_EVENT_BATCH_INTERVAL', DEFAULT_BATCH_INTERVAL)
+
+    def add(self, events):
+        """ Add events to the buffer, waking the flusher once it holds a full batch """
+        with self._condition:
+            was_empty = not self._events
+            self._events.extend(events)
+            if self.batch_interval > 0:
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(target=self._run_flusher, name='staff-events', daemon=True)
+                    self._flusher.start()
+                if was_empty or len(self._events) >= self.batch_size:
+                    self._condition.notify_all()
+                return
+        self.flush()
+
+    def _full_or_flushed(self):
+        return not self._events or len(self._events) >= self.batch_size
+
+    def _run_flusher(self):
+        while True:
+            with self._condition:
+                while not self._events:
+                    self._condition.wait()
+                # Cut short by a full batch, or by something else flushing the buffer in the meantime
+                self._condition.wait_for(self._full_or_flushed, self.batch_interval / 1000)
+            self.flush()
+            # Django only closes connections at the end of requests, and this thread never is one, so
+            # the connection storing eventstream messages has to be recycled here
+            close_old_connections()
+
+    def flush(self):
+        """ Publish everything in the buffer, in batches of at most the batch size """
+        # Held while publishing, so that batches taken from the buffer go out in the order they were taken
+        with self._publish_lock:
+            with self._condition:
+                events, self._events = self._events, []
+                self._condition.notify_all()
+            for start in range(0, len(events), self.batch_size):
+                batch = events[start:start + self.batch_size]
+                try:
+                    send_event("staff", "events", batch)
+                except Exception as e:
+                    # A staff page missing a refresh is better than failing whatever flushed the buffer
+                    logger.error(f"Error publishing {len(batch)} staff events: {e}")
+
+
+staff_event_buffer = StaffEventBuffer()
+atexit.register(staff_event_buffer.flush)
+
+
+def publish_staff_events(all_fields):
+    """
+    Queue staff channel messages for newly created events, given their Event fields. They are buffered
+    once the current transaction commits, or immediately outside of one, and never sent if it rolls back.
+    """
+    events = [{
+        "type": fields["type"],
+        "team_id": fields["team"].pk if fields["team"] else None,
+        "puzzle_id": fields["puzzle"].pk if fields["puzzle"] else None,
+    } for fields in all_fields]
+    if events:
+        transaction.on_commit(lambda: staff_event_buffer.add(events))
@@ -1,5 +1,4 @@
 import io
-from collections import Counter
 import json
 import shutil
 from pathlib import Path
@@ -7,7 +6,8 @@ from zipfile import ZipFile
 import csv
 
 from dataclasses import dataclass
-from datetime import timedelta
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
@@ -17,9 +17,10 @@ from django.core.paginator import Paginator
 from django.forms import ValidationError
 from django.views.decorators.http import require_GET, require_POST
 from django.shortcuts import redirect, render, get_object_or_404
-from django.db.models import F, Max, Count, Subquery, OuterRef, PositiveIntegerField, Min
+from django.db.models import F, Count, Subquery, OuterRef
 from django.db.models.functions import Coalesce
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
 from django.utils import timezone
 from django.contrib import messages
 from django.template.loader import engines
@@ -30,9 +31,14 @@ from django.core import serializers
 from django_sendfile import sendfile
 from .utils import create_media_files, get_media_file_model, get_media_file_parent_model, create_hunt_export_zip, import_hunt_from_zip, import_hunt_from_zip, validate_hunt_zip
 from .hunt_views import protected_static
-from .models import Hunt, Team, Event, PuzzleStatus, Submission, Hint, User, Puzzle, SolutionFile, HuntFile
+from .models import Hunt, Team, Event, PuzzleStatus, Submission, Hint, User, Puzzle, SolutionFile, HuntFile, \
+    LeaderboardEntry
 from .tasks import import_hunt_background
-from .config_parser import parse_config, process_config_rules
+from .progress_matrix import read_progress_cells, load_progress_cells
+from .chart_data import get_chart_snapshot, refresh_chart_snapshot, activity_series
+from .config_parser import process_compiled_rules
+from .progress_encoding import ProgressTeam, encode_rows, encode_columnar, serialize, available_formats, \
+    etag as progress_etag, CONTENT_TYPES as PROGRESS_CONTENT_TYPES
 
 
 @staff_member_required
@@ -57,8 +63,19 @@ def staff_base(request):
     return render(request, "staff_index.html", context)
 
 
+# The most events shown on one page of the staff feed
+FEED_MAX_PAGE_SIZE = 100
+
+
 @staff_member_required
 def feed(request, hunt):
+    """
+    View function to display the staff event feed, newest first.
+
+    Pages are fetched by keyset rather than by page number: ?before=<cursor> gives the events older than
+    a cursor, and ?after=<cursor> the events newer than it, where a cursor is an event's timestamp and ID.
+    Events carry their own team and puzzle names, so a page is one query with no per event lookups.
+    """
     events = Event.objects.filter(hunt=hunt)
 
     puzzle_ids = []
@@ -66,7 +83,7 @@ def feed(request, hunt):
     tags = request.GET.getlist("tags", [])
     for tag in tags:
         if tag.startswith("p:"):
-            puzzle_ids.append(int(tag[2:]))
+            puzzle_ids.append(tag[2:])
         elif tag.startswith("t:"):
             team_ids.append(int(tag[2:]))
     if len(puzzle_ids) > 0:
@@ -82,19 +99,55 @@ def feed(request, hunt):
         events = events.filter(type__in=Event.queue_types)
     display_checkboxes = Event.queue_types if checkboxes == "all" else checkboxes.split(",")
 
-    events = events.select_related('team', 'puzzle', 'user').order_by('-timestamp')
-
-    num_items = int(request.GET.get("numItems", 25))
+    # Only the user is still needed for display, for hint responses
+    events = events.select_related('user')
 
-    page = request.GET.get("page", None)
-    pages = Paginator(events, num_items)
-    paged_events = pages.get_page(page)
-    context = {"hunt": hunt, "feed_items": paged_events, "types": Event.queue_types, 'num_items': num_items,
-               "puzzle_tags": puzzle_ids, "team_tags": team_ids, 'display_checkboxes': display_checkboxes}
+    try:
+        num_items = max(1, min(int(request.GET.get("numItems", 25)), FEED_MAX_PAGE_SIZE))
+    except ValueError:
+        raise SuspiciousOperation("Invalid numItems parameter")
+
+    before = _parse_feed_cursor(request.GET.get("before"))
+    after = _parse_feed_cursor(request.GET.get("after"))
+    if after is not None:
+        # Take the oldest events newer than the cursor, then show them newest first like any other page
+        timestamp, pk = after
+        page = events.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk))
+        feed_items = list(page.order_by('timestamp', 'pk')[:num_items + 1])
+        has_newer = len(feed_items) > num_items
+        feed_items = feed_items[:num_items][::-1]
+        has_older = True
+    else:
+        if before is not None:
+            timestamp, pk = before
+            events = events.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+        feed_items = list(events.order_by('-timestamp', '-pk')[:num_items + 1])
+        has_older = len(feed_items) > num_items
+        feed_items = feed_items[:num_items]
+        has_newer = before is not None
+
+    context = {"hunt": hunt, "feed_items": feed_items, "types": Event.queue_types, 'num_items': num_items,
+               "puzzle_tags": puzzle_ids, "team_tags": team_ids, 'display_checkboxes': display_checkboxes,
+               "older_cursor": _feed_cursor(feed_items[-1]) if feed_items and has_older else None,
+               "newer_cursor": _feed_cursor(feed_items[0]) if feed_items and has_newer else None}
 
     return render(request, "staff_feed.html", context)
 
 
+def _feed_cursor(event):
+    return f"{event.timestamp.isoformat()},{event.pk}"
+
+
+def _parse_feed_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, pk = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        raise SuspiciousOperation("Invalid feed cursor")
+
+
 @staff_member_required
 def progress(request, hunt):
     """
@@ -124,100 +177,106 @@ def progress(request, hunt):
 
 
 
+# Events that change a cell of the progress board
+PROGRESS_EVENT_TYPES = [Event.EventType.PUZZLE_SUBMISSION, Event.EventType.PUZZLE_SOLVE, Event.EventType.PUZZLE_UNLOCK,
+                        Event.EventType.HINT_REQUEST]
+# Event IDs are assigned when the row is inserted, not when its transaction commits, so a delta also rescans
+# events this recent in case one committed after a later event was already returned
+PROGRESS_DELTA_OVERLAP = timedelta(minutes=2)
+# Widths, in minutes, the activity over time charts can be bucketed by
+CHART_BUCKET_WIDTHS = [5, 15, 60]
+
+
 @staff_member_required
 def progress_data(request, hunt):
     """
     API endpoint to return progress data for DataTables consumption.
+
+    The format query parameter picks the encoding: "json" (the default) for one object per team and cell,
+    "columnar" for parallel arrays with times as seconds from the hunt's start, or "msgpack" for the columnar
+    form packed with msgpack, if it is installed. The compact formats are sent with an ETag.
+
+    Every response includes a "cursor" in its metadata. Passing it back as ?since=<cursor> returns only the
+    teams and puzzle cells that have changed since then, worked out from the hunt's events, along with the
+    current order of every team, for the client to merge into what it already has. Changes that don't create
+    events, such as edits in the admin, are only picked up by a full reload.
     """
     start_time = timezone.now()
-    
-    info_columns = hunt.teamrankingrule_set.order_by("rule_order").all()
-
-    # Fetch puzzles with their stats
-    puzzle_stats = [
-        ('num_hints', '# Hints Used'),
-        ('num_solves', '# Solves'),
-        ('num_unlocks', '# Unlocks'),
-        ('num_submissions', '# Submissions'),
-    ]
 
-    # Fetch puzzles
-    puzzles = hunt.puzzle_set
-    for stat in puzzle_stats:
-        puzzles = Puzzle.annotate_query(puzzles, stat[0])
-    puzzles = puzzles.all()
-
-    # Fetch teams with their ranking data
-    teams = hunt.active_teams
-    for rule in info_columns:
-        teams = rule.annotate_query(teams)
-    teams = teams.order_by(*[rule.ordering_parameter for rule in info_columns]).all()
-
-    # Fetch all puzzle statuses
-    statuses = (PuzzleStatus.objects.filter(puzzle__hunt=hunt)
-                .select_related('puzzle', 'team')
-                .annotate(time_since=timezone.now() - F('unlock_time')))
-    
-    # Fetch submissions data
-    submissions = (Submission.objects.filter(team__hunt=hunt)
-                  .values('team', 'puzzle')
-                  .annotate(last_submission=Max('submission_time'),
-                           num_submissions=Count('*')))
-    
-    # Fetch hints data
-    hints = (Hint.objects.filter(team__hunt=hunt)
-            .values('team', 'puzzle')
-            .annotate(num_hints=Count('*')))
-
-    # Build response data
-    response_data = {
-        "data": [],
-        "metadata": {
-            "last_updated": timezone.now().isoformat(),
-            "hunt_id": hunt.pk,
-        }
-    }
+    info_columns = list(hunt.teamrankingrule_set.order_by("rule_order"))
 
-    # Create lookup dictionaries for faster access
-    submission_data_lookup = {(s['team'], s['puzzle']): s for s in submissions}
-    hint_data_lookup = {(h['team'], h['puzzle']): h for h in hints}
-    status_lookup = {(s.team_id, s.puzzle_id): s for s in statuses}
+    response_format = request.GET.get("format", "json")
+    if response_format not in available_formats():
+        return JsonResponse({'error': f'Unsupported format, expected one of {", ".join(available_formats())}'},
+                            status=406)
 
-    # Build team data
-    for team in teams:
-        team_data = {
-            "team": {
-                "id": team.pk,
-                "name": team.name,
-            },
-            "ranking_columns": {
-                column.display_name: getattr(team, column.rule_type) for column in info_columns
-            }
-        }
-
-        # Build puzzle data for this team
-        puzzle_data = {}
-        for puzzle in puzzles:
-            status = status_lookup.get((team.pk, puzzle.pk))
-            submission = submission_data_lookup.get((team.pk, puzzle.pk), {})
-            hint = hint_data_lookup.get((team.pk, puzzle.pk), {})
-
-            if status:
-                puzzle_data[str(puzzle.pk)] = {
-                    "unlock_time": status.unlock_time.isoformat() if status and status.unlock_time else None,
-                    "solve_time": status.solve_time.isoformat() if status and status.solve_time else None,
-                    "last_submission": submission.get('last_submission').isoformat() if submission and submission.get('last_submission') else None,
-                    "num_submissions": submission.get('num_submissions', 0) if submission else 0,
-                    "num_hints": hint.get('num_hints', 0) if hint else 0
-                }
-
-        team_data["puzzles"] = puzzle_data
-        response_data["data"].append(team_data)
-
-    end_time = timezone.now()
-    response_data["metadata"]["calculation_time_ms"] = (end_time - start_time).total_seconds() * 1000
-
-    return JsonResponse(response_data)
+    since = request.GET.get("since")
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        raise SuspiciousOperation("Invalid since parameter")
+
+    # Read the cursor before anything else, so changes made while building the response are in the next delta
+    cursor = Event.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    # Ranking data comes from the materialized leaderboard
+    LeaderboardEntry.objects.ensure_entries(hunt)
+    entries = (LeaderboardEntry.objects.filter(team__in=hunt.active_teams)
+               .order_by(*[rule.entry_ordering() for rule in info_columns], 'team_id'))
+
+    changed_teams = changed_puzzles = None
+    if since is not None:
+        changes = (Event.objects.filter(hunt=hunt, type__in=PROGRESS_EVENT_TYPES)
+                   .filter(Q(pk__gt=since) | Q(timestamp__gte=start_time - PROGRESS_DELTA_OVERLAP))
+                   .values_list('team_id', 'puzzle_id').distinct())
+        changed_cells = set(changes)
+        changed_teams = {team_id for team_id, _ in changed_cells}
+        changed_puzzles = {puzzle_id for _, puzzle_id in changed_cells}
+
+    # The cells come from the live progress matrix when it's available, only falling back to the database
+    cells = read_progress_cells(hunt, team_ids=changed_teams, puzzle_ids=changed_puzzles)
+    if cells is None:
+        cells = load_progress_cells(hunt, team_ids=changed_teams, puzzle_ids=changed_puzzles)
+    if since is not None:
+        cells = [cell for cell in cells if (cell.team_id, cell.puzzle_id) in changed_cells]
+
+    rows = entries if since is None else entries.filter(team_id__in=changed_teams)
+    teams = [ProgressTeam(entry.team_id, entry.team.name,
+                          [getattr(entry, column.entry_field) for column in info_columns])
+             for entry in rows.select_related('team')]
+    column_names = [column.display_name for column in info_columns]
+
+    metadata = {
+        "hunt_id": hunt.pk,
+        "cursor": cursor,
+        "delta": since is not None,
+    }
+    # Any team's rank may have moved, so deltas carry the full team order for the client to re-sort by
+    order = list(entries.values_list('team_id', flat=True)) if since is not None else None
+
+    if response_format == "json":
+        response_data = {"data": encode_rows(teams, cells, column_names), "metadata": metadata}
+        if order is not None:
+            response_data["order"] = order
+        metadata["last_updated"] = timezone.now().isoformat()
+        metadata["calculation_time_ms"] = (timezone.now() - start_time).total_seconds() * 1000
+        return JsonResponse(response_data)
+
+    # The compact formats leave out the timing metadata, so identical data gives an identical body and ETag
+    payload = encode_columnar(teams, cells, column_names, hunt.start_date)
+    payload["metadata"] = metadata
+    if order is not None:
+        payload["order"] = order
+    body = serialize(payload, response_format)
+    tag = quote_etag(progress_etag(body))
+    not_modified = get_conditional_response(request, etag=tag)
+    if not_modified is not None:
+        return not_modified
+    response = HttpResponse(body, content_type=PROGRESS_CONTENT_TYPES[response_format])
+    response["ETag"] = tag
+    # Staff only data, always revalidated, but a 304 saves sending it again
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @staff_member_required
@@ -415,157 +474,38 @@ def get_modal(request, pk):
 def charts(request, hunt):
     """
     View function to display charts for the current hunt.
-    """
 
-    num_teams = hunt.active_teams.count()
-
-    # First, get a subquery of the minimum solve time for each puzzle
-    earliest_solves = PuzzleStatus.objects.filter(
-        puzzle__hunt=hunt,
-        solve_time__isnull=False,
-        team__playtester=False
-    ).values('puzzle').annotate(
-        min_solve_time=Min('solve_time')
-    )
-
-    # Then use that to get the actual PuzzleStatus objects
-    earliest_solve_statuses = PuzzleStatus.objects.filter(
-        puzzle__hunt=hunt,
-        solve_time__isnull=False,
-        team__playtester=False
-    ).filter(
-        solve_time__in=Subquery(
-            earliest_solves.values('min_solve_time')
-        )
-    ).select_related('puzzle', 'team').order_by('puzzle__order_number')
-
-    # Build a lookup dict for earliest solves by puzzle id
-    earliest_solve_lookup = {status.puzzle_id: status for status in earliest_solve_statuses}
-
-    # Puzzle Statistics
-    puzzle_stats = [
-        ('num_hints', '# Hints Used'),
-        ('num_solves', '# Solves'),
-        ('num_unlocks', '# Unlocks'),
-        ('num_submissions', '# Submissions'),
-        ('avg_solve_time', 'Avg. Solve Time'),
-    ]
-
-    stats_puzzles = hunt.puzzle_set
-    for stat in puzzle_stats:
-        stats_puzzles = Puzzle.annotate_query(stats_puzzles, stat[0])
-    stats_puzzles = stats_puzzles.order_by('order_number').all()
-
-    chart_solves_data = []
-    chart_submissions_data = []
-    chart_hints_data = []
-
-    for puzzle in stats_puzzles:
-        # Submission count table
-        sq = (Submission.objects.filter(team__pk=OuterRef('pk'), puzzle=puzzle).values('team', 'puzzle')
-              .annotate(c=Count('*')).values('c'))
-        num_subs = (puzzle.team_set.filter(puzzlestatus__solve_time__isnull=False)
-                    .annotate(num_s=Subquery(sq, output_field=PositiveIntegerField())).values_list('num_s', flat=True))
-        sub_table_full = sorted(list(Counter(num_subs).items()), key=lambda x: x[0])
-        cutoff = 5
-        sub_table = sub_table_full[:cutoff]
-        if len(sub_table_full) > cutoff:
-            sub_table.append((f"{int(sub_table[-1][0]) + 1}+", sum([x[1] for x in sub_table_full[cutoff:]])))
-        puzzle.sub_table = sub_table
-
-        # Commonly guessed wrong answers (submissions that didn't match any custom response)
-        commonly_guessed_answers = (
-            Submission.objects
-            .filter(puzzle=puzzle, matched_response__isnull=True)
-            .exclude(submission_text__iexact=puzzle.answer)
-            .values('submission_text')
-            .annotate(count=Count('submission_text'))
-            .order_by('-count')[:6]
-        )
-        puzzle.commonly_guessed_answers = commonly_guessed_answers
-
-        # First solve info
-        earliest_solve = earliest_solve_lookup.get(puzzle.id)
-        puzzle.first_solve_team = earliest_solve.team if earliest_solve else None
-        puzzle.first_solve_time = earliest_solve.solve_time if earliest_solve else None
-    
-        # Solves chart data
-        chart_solves_data.append({
-            "name": puzzle.name,
-            "locked": num_teams - (puzzle.num_unlocks or 0),
-            "unlocked": (puzzle.num_unlocks or 0) - (puzzle.num_solves or 0),
-            "solved": puzzle.num_solves or 0
-        })
-
-        # Submissions breakdown (for table and chart)
-        # Count submissions that matched a custom response (excluding correct answers)
-        custom_response_count = (
-            Submission.objects
-            .filter(puzzle=puzzle, matched_response__isnull=False)
-            .exclude(submission_text__iexact=puzzle.answer)
-            .count()
-        )
-        total_incorrect = (puzzle.num_submissions or 0) - (puzzle.num_solves or 0)
-        puzzle.num_custom_response = custom_response_count
-        puzzle.num_incorrect = total_incorrect - custom_response_count
-
-        chart_submissions_data.append({
-            "name": puzzle.name,
-            "incorrect": puzzle.num_incorrect,
-            "custom_response": puzzle.num_custom_response,
-            "correct": puzzle.num_solves or 0
-        })
-
-        # Hints chart data
-        chart_hints_data.append({
-            "name": puzzle.name,
-            "hints": puzzle.num_hints or 0
-        })
+    The charts are drawn from a cached snapshot of the hunt's statistics, kept fresh by the
+    refresh_chart_snapshots task while the hunt is running. Passing ?refresh=1 recomputes it first.
+    """
+    if request.GET.get("refresh"):
+        snapshot = refresh_chart_snapshot(hunt)
+    else:
+        snapshot = get_chart_snapshot(hunt)
 
-    # Submissions over time chart data
-    submission_hours = []
-    subs = Submission.objects.filter(puzzle__hunt=hunt,
-                                     submission_time__gte=hunt.start_date,
-                                     submission_time__lte=hunt.end_date)
-    subs = subs.values_list('submission_time__year',
-                            'submission_time__month',
-                            'submission_time__day',
-                            'submission_time__hour')
-    subs = subs.annotate(Count("id")).order_by('submission_time__year',
-                                               'submission_time__month',
-                                               'submission_time__day',
-                                               'submission_time__hour')
-    for sub in subs:
-        time_string = "%02d/%02d/%04d - %02d:00" % (sub[1], sub[2], sub[0], sub[3])
-        submission_hours.append({"hour": time_string, "amount": sub[4]})
-
-    # Solves over time chart data
-    solve_hours = []
-    solves = PuzzleStatus.objects.filter(puzzle__hunt=hunt,
-                                       solve_time__isnull=False,
-                                       solve_time__gte=hunt.start_date,
-                                       solve_time__lte=hunt.end_date)
-    solves = solves.values_list('solve_time__year',
-                               'solve_time__month',
-                               'solve_time__day',
-                               'solve_time__hour')
-    solves = solves.annotate(Count("id")).order_by('solve_time__year',
-                                                  'solve_time__month',
-                                                  'solve_time__day',
-                                                  'solve_time__hour')
-    for solve in solves:
-        time_string = "%02d/%02d/%04d - %02d:00" % (solve[1], solve[2], solve[0], solve[3])
-        solve_hours.append({"hour": time_string, "amount": solve[4]})
+    # The activity over time charts are cheap to draw from the rollups, so they are always current
+    try:
+        bucket = int(request.GET.get("bucket", CHART_BUCKET_WIDTHS[-1]))
+    except ValueError:
+        raise SuspiciousOperation("Invalid bucket parameter")
+    if bucket not in CHART_BUCKET_WIDTHS:
+        raise SuspiciousOperation("Invalid bucket parameter")
+    tz_name = request.GET.get("tz") or timezone.get_current_timezone_name()
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise SuspiciousOperation("Invalid tz parameter")
+    width = timedelta(minutes=bucket)
 
     context = {
-        'chart_solves_data': chart_solves_data,
-        'chart_submissions_data': chart_submissions_data,
-        'chart_submissions_by_time_data': submission_hours,
-        'chart_solves_by_time_data': solve_hours,
-        'chart_hints_data': chart_hints_data,
+        **snapshot["data"],
         'hunt': hunt,
-        'stats_puzzles': stats_puzzles,
-        'num_teams': num_teams,
+        'computed_at': snapshot["computed_at"],
+        'chart_submissions_by_time_data': activity_series(hunt, Event.EventType.PUZZLE_SUBMISSION, width, tz),
+        'chart_solves_by_time_data': activity_series(hunt, Event.EventType.PUZZLE_SOLVE, width, tz),
+        'bucket': bucket,
+        'bucket_widths': CHART_BUCKET_WIDTHS,
+        'tz_name': tz_name,
     }
     return render(request, "staff_charts.html", context)
 
@@ -1035,8 +975,6 @@ def config_tester(request, hunt):
     Simulates puzzle unlocks based on provided solved states and time.
     """
     puzzles = hunt.puzzle_set.order_by('order_number').all()
-    puzzle_ids = set(str(p.id) for p in puzzles)
-    order_to_id = {p.order_number: str(p.id) for p in puzzles}
 
     # Parse simulated time offset from URL params as integer minutes (default: 0)
     time_offset_mins = int(request.GET.get('t', 0))
@@ -1076,9 +1014,8 @@ def config_tester(request, hunt):
 
     if hunt.config and hunt.config.strip():
         try:
-            config_rules = parse_config(hunt.config, puzzle_ids, order_to_id)
-            unlocked_puzzles, points, hints, puzzle_hints, earned_badges = process_config_rules(
-                config_rules,
+            unlocked_puzzles, points, hints, puzzle_hints, earned_badges = process_compiled_rules(
+                hunt.get_compiled_config(),
                 mock_statuses,
                 hunt.start_date,
                 simulated_time
@@ -1,19 +1,38 @@
 import time
 
 from huey import crontab
-from huey.contrib.djhuey import periodic_task, task
+from huey.contrib.djhuey import HUEY, periodic_task, task
+from huey.exceptions import RetryTask, TaskException, TaskLockedException
+from django.db.models import Q
 from django.utils import timezone
-from .models import Team
-from .config_parser import parse_config
+from .models import Team, Hunt
 import logging
 from pathlib import Path
 from .utils import import_hunt_from_zip
+from .chart_data import refresh_chart_snapshot
+from .retention import trim_eventstream
 
 logger = logging.getLogger(__name__)
 
+# Number of teams evaluated in memory before their changes are written in bulk
+UNLOCK_BATCH_SIZE = 500
+# Number of subtasks the due teams are split across, so the sweep can run on several Huey workers at once
+UNLOCK_SHARDS = 4
+# How long the sweep report waits for slow shards before logging what it has
+UNLOCK_REPORT_TIMEOUT = 60
+
+
 @periodic_task(crontab(minute='*'))  # Runs every minute
 def check_team_unlocks():
-    """Check and process unlocks for all active teams in active hunts."""
+    """
+    Check and process unlocks for active teams whose next time based trigger has passed.
+
+    Each call to Team.process_unlocks records when the team's config rules could next change with time,
+    so teams with nothing due are skipped entirely. Teams with no recorded time are always processed.
+    The due teams are split by ID into UNLOCK_SHARDS subtasks, and a final task reports on the sweep
+    once they have all finished. A shard still running from an earlier sweep is skipped, and its teams
+    are picked up again by the next sweep.
+    """
     task_start = time.perf_counter()
     current_time = timezone.now()
 
@@ -31,41 +50,150 @@ def check_team_unlocks():
         playtest_end_date__gte=current_time
     )
 
-    all_teams = list(regular_teams | playtest_teams)
+    due = Q(next_unlock_check__isnull=True) | Q(next_unlock_check__lte=current_time)
+    team_ids = list((regular_teams | playtest_teams).filter(due).values_list('pk', flat=True))
     query_time = time.perf_counter() - task_start
 
-    hunt_configs = {}
+    shards = [[] for _ in range(UNLOCK_SHARDS)]
+    for team_id in team_ids:
+        shards[team_id % UNLOCK_SHARDS].append(team_id)
+    results = [process_unlock_shard(shard, index) for index, shard in enumerate(shards) if shard]
+
+    report_unlock_sweep(
+        [result.id for result in results],
+        time.time(),
+        {"query": query_time, "teams": len(team_ids)}
+    )
+
+
+@task()
+def process_unlock_shard(team_ids, shard=0):
+    """
+    Process unlocks for one shard of the due teams, one hunt at a time so that a hunt with a broken
+    config or a failing rule can't stop the rest of the shard. Only one run of each shard can go at a
+    time, so that a slow sweep and the next one can't process the same teams at once.
+
+    Returns:
+        dict: The time spent compiling configs and processing teams, and which hunts failed
+    """
+    try:
+        with HUEY.lock_task(f'unlock-shard-{shard}'):
+            return _process_unlock_shard(team_ids)
+    except TaskLockedException:
+        logger.warning(f"Skipping unlock shard {shard}, its previous run is still going")
+        return {"config": 0.0, "process": 0.0, "teams": 0, "hunts": [], "failed_hunts": [], "skipped": True}
+
+
+def _process_unlock_shard(team_ids):
     config_time = 0.0
     process_time = 0.0
+    failed_hunts = []
 
-    # Process unlocks for all active teams
-    for team in all_teams:
-        if team.hunt.id not in hunt_configs:
-            config_start = time.perf_counter()
-            puzzles = team.hunt.puzzle_set.values_list('id', 'order_number')
-            puzzle_ids = set(p[0] for p in puzzles)
-            order_to_id = {p[1]: p[0] for p in puzzles}
-            try:
-                # Parse the config and process unlocks
-                config_rules = parse_config(team.hunt.config, puzzle_ids, order_to_id)
-            except Exception as e:
-                # Log the error if config parsing fails
-                logger.error(f"Error processing hunt config: {e}")
-                return
-            hunt_configs[team.hunt.id] = config_rules
+    teams_by_hunt = {}
+    for team in Team.objects.filter(pk__in=team_ids).select_related('hunt'):
+        teams_by_hunt.setdefault(team.hunt, []).append(team)
+
+    for hunt, teams in teams_by_hunt.items():
+        config_start = time.perf_counter()
+        try:
+            # Compiled configs are cached across runs, so this only re-parses after a config change
+            compiled_config = hunt.get_compiled_config()
+        except Exception as e:
+            # Log the error if config parsing fails
+            logger.error(f"Error processing hunt config for {hunt.name}: {e}")
+            failed_hunts.append(hunt.id)
+            continue
+        finally:
             config_time += time.perf_counter() - config_start
 
+        # Process unlocks for the hunt's teams, a chunk at a time
         process_start = time.perf_counter()
-        team.process_unlocks(parsed_config=hunt_configs[team.hunt.id])
+        try:
+            for i in range(0, len(teams), UNLOCK_BATCH_SIZE):
+                Team.bulk_process_unlocks(teams[i:i + UNLOCK_BATCH_SIZE], {hunt.id: compiled_config})
+        except Exception as e:
+            logger.exception(f"Error processing unlocks for {hunt.name}: {e}")
+            failed_hunts.append(hunt.id)
         process_time += time.perf_counter() - process_start
 
-    total_time = time.perf_counter() - task_start
-    logger.info(
-        f"check_team_unlocks: total={total_time:.3f}s, query={query_time:.3f}s, "
-        f"config={config_time:.3f}s, process={process_time:.3f}s, "
-        f"teams={len(all_teams)}, hunts={len(hunt_configs)}"
+    return {
+        "config": config_time,
+        "process": process_time,
+        "teams": len(team_ids),
+        "hunts": [hunt.id for hunt in teams_by_hunt],
+        "failed_hunts": failed_hunts,
+    }
+
+
+@task()
+def report_unlock_sweep(shard_task_ids, sweep_start, sweep_timings):
+    """
+    Log the combined timing breakdown of an unlock sweep once all of its shards have finished.
+
+    Rather than blocking a worker while the shards run, this retries itself until every shard has a
+    result or UNLOCK_REPORT_TIMEOUT has passed.
+    """
+    shard_timings = []
+    pending = 0
+    for task_id in shard_task_ids:
+        try:
+            result = HUEY.result(task_id, preserve=True)
+        except TaskException:
+            result = {"error": True}
+        if result is None:
+            pending += 1
+        else:
+            shard_timings.append(result)
+
+    elapsed = time.time() - sweep_start
+    if pending and elapsed < UNLOCK_REPORT_TIMEOUT:
+        raise RetryTask(delay=1)
+
+    for task_id in shard_task_ids:
+        HUEY.result(task_id)  # Clear the stored shard results
+
+    completed = [timings for timings in shard_timings if "error" not in timings]
+    skipped = sum(1 for timings in completed if timings.get("skipped"))
+    hunts = set()
+    failed_hunts = set()
+    for timings in completed:
+        hunts.update(timings["hunts"])
+        failed_hunts.update(timings["failed_hunts"])
+
+    log = logger.warning if pending or failed_hunts or skipped or len(completed) < len(shard_timings) else logger.info
+    log(
+        f"check_team_unlocks: total={elapsed:.3f}s, query={sweep_timings['query']:.3f}s, "
+        f"config={sum(t['config'] for t in completed):.3f}s, "
+        f"process={sum(t['process'] for t in completed):.3f}s, "
+        f"slowest_shard={max((t['config'] + t['process'] for t in completed), default=0):.3f}s, "
+        f"teams={sweep_timings['teams']}, hunts={len(hunts)}, shards={len(shard_task_ids)}, "
+        f"failed_shards={len(shard_timings) - len(completed)}, unfinished_shards={pending}, skipped_shards={skipped}, "
+        f"failed_hunts={sorted(failed_hunts)}"
     )
 
+
+@periodic_task(crontab(minute='*'))  # Runs every minute
+def refresh_chart_snapshots():
+    """
+    Recompute the staff chart snapshots of running hunts, so that opening the charts page never has to
+    compute them itself while a hunt is busy. Hunts that aren't running are computed when first viewed.
+    """
+    current_time = timezone.now()
+    for hunt in Hunt.objects.filter(start_date__lte=current_time, end_date__gte=current_time):
+        try:
+            refresh_chart_snapshot(hunt)
+        except Exception as e:
+            logger.exception(f"Error refreshing chart snapshot for {hunt.name}: {e}")
+
+
+@periodic_task(crontab(minute='*/10'))  # Runs every ten minutes
+def trim_eventstream_storage():
+    """ Delete stored eventstream messages that are older than the EVENTSTREAM_RETENTION window """
+    num_deleted = trim_eventstream()
+    if num_deleted:
+        logger.info(f"Trimmed {num_deleted} eventstream messages")
+
+
 @task()
 def import_hunt_background(zip_path: str, include_activity: bool = False) -> None:
     """
@@ -0,0 +1,139 @@
+import logging
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Teams rarely change membership and every change goes through invalidate_team_membership,
+# so the shared cache entries can live for a long time
+MEMBERSHIP_TIMEOUT = 24 * 60 * 60
+# Cached in place of a team ID for users that aren't on a team in the hunt
+NO_TEAM = 0
+
+# Lookups made during the current request, set up by TeamMembershipMiddleware. Outside of a request
+# (tasks, management commands, the shell) nothing is memoized beyond the shared cache.
+_request_memo = ContextVar("team_membership_request_memo", default=None)
+
+
+class TeamMembershipMiddleware:
+    """ Gives each request its own memo of team lookups, so repeated lookups in a request are free """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request_memo.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _request_memo.reset(token)
+
+
+def _membership_key(hunt_id, user_id):
+    return f"team_membership:{hunt_id}:{user_id}"
+
+
+def _team_ids_key(user_id):
+    return f"team_membership_ids:{user_id}"
+
+
+def _memoized(memo_key, lookup):
+    memo = _request_memo.get()
+    if memo is None:
+        return lookup()
+    if memo_key not in memo:
+        memo[memo_key] = lookup()
+    return memo[memo_key]
+
+
+def get_user_team(hunt, user):
+    """
+    Get the team a user is on for a hunt, or None if they aren't on one.
+
+    Lookups are memoized for the rest of the request, and the user -> team mapping is kept in the
+    shared cache so most requests don't need the membership join at all.
+    """
+    if user is None or not user.is_authenticated:
+        return None
+    return _memoized(("team", hunt.pk, user.pk), lambda: _lookup_user_team(hunt, user))
+
+
+def _lookup_user_team(hunt, user):
+    key = _membership_key(hunt.pk, user.pk)
+    try:
+        team_id = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Error reading team membership cache: {e}")
+        team_id = None
+
+    if team_id == NO_TEAM:
+        return None
+    if team_id is not None:
+        team = hunt.team_set.filter(pk=team_id).first()
+        if team is not None:
+            team.hunt = hunt
+            return team
+
+    team = user.team_set.filter(hunt=hunt).first()
+    if team is not None:
+        team.hunt = hunt
+    try:
+        cache.set(key, team.pk if team is not None else NO_TEAM, MEMBERSHIP_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Error writing team membership cache: {e}")
+    return team
+
+
+def get_user_team_ids(user):
+    """
+    Get the IDs of every team a user is on, across all hunts, with the most recent hunt's first.
+
+    Like get_user_team, lookups are memoized for the rest of the request and kept in the shared cache.
+    """
+    if user is None or not user.is_authenticated:
+        return []
+    return _memoized(("team_ids", user.pk), lambda: _lookup_user_team_ids(user))
+
+
+def _lookup_user_team_ids(user):
+    key = _team_ids_key(user.pk)
+    try:
+        team_ids = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Error reading team membership cache: {e}")
+        team_ids = None
+    if team_ids is not None:
+        return team_ids
+
+    team_ids = list(user.team_set.order_by('-hunt__start_date', '-pk').values_list('pk', flat=True))
+    try:
+        cache.set(key, team_ids, MEMBERSHIP_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Error writing team membership cache: {e}")
+    return team_ids
+
+
+def get_current_hunt():
+    """ Get the current hunt, memoized for the rest of the request """
+    from .models import Hunt
+    return _memoized(("current_hunt",), lambda: Hunt.objects.get(is_current_hunt=True))
+
+
+def forget_current_hunt():
+    """ Drop this request's memoized current hunt, for when a different hunt becomes current """
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.pop(("current_hunt",), None)
+
+
+def invalidate_team_membership(hunt_id, user_ids):
+    """ Forget the cached teams of the given users in a hunt, both shared and for this request """
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.clear()
+    try:
+        cache.delete_many([_membership_key(hunt_id, user_id) for user_id in user_ids] +
+                          [_team_ids_key(user_id) for user_id in user_ids])
+    except Exception as e:
+        logger.warning(f"Error invalidating team membership cache: {e}")
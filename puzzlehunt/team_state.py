@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .shared_cache import cache_shared_with_tasks
+
+logger = logging.getLogger(__name__)
+
+# Snapshots are keyed by version, so old ones are never read again and only need to live long enough
+# to be useful
+STATE_TIMEOUT = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class TeamState:
+    """ A snapshot of which puzzles a team has unlocked and solved """
+    version: int
+    unlocked: frozenset
+    solved: frozenset
+
+    def is_unlocked(self, puzzle_id):
+        return puzzle_id in self.unlocked
+
+    def is_solved(self, puzzle_id):
+        return puzzle_id in self.solved
+
+
+def _version_key(team_id):
+    return f"team_state_version:{team_id}"
+
+
+def _state_key(team_id, version):
+    return f"team_state:{team_id}:{version}"
+
+
+# Teams invalidated by this thread's open transaction, whose snapshots mustn't be cached until it commits
+_uncommitted = threading.local()
+
+
+def _uncommitted_team_ids():
+    if not hasattr(_uncommitted, 'team_ids'):
+        _uncommitted.team_ids = set()
+    return _uncommitted.team_ids
+
+
+def _initial_version():
+    # If the version key is ever lost, start again from the clock rather than 1 so that snapshots
+    # stored under the old versions can't be mistaken for current ones
+    return time.time_ns() // 1000
+
+
+def _build_state(team, version):
+    unlocked = set()
+    solved = set()
+    for puzzle_id, solve_time in team.puzzlestatus_set.values_list('puzzle_id', 'solve_time'):
+        unlocked.add(puzzle_id)
+        if solve_time is not None:
+            solved.add(puzzle_id)
+    return TeamState(version, frozenset(unlocked), frozenset(solved))
+
+
+def get_team_state(team):
+    """
+    Get the current TeamState for a team.
+
+    Snapshots are kept in the shared cache under the team's current version, which is bumped every
+    time one of the team's puzzles is unlocked or solved. Reading a snapshot costs two cache lookups
+    and no queries; only the first read after a change goes to the database. Without a cache shared
+    with the task consumer, which unlocks puzzles too, every read goes to the database.
+    """
+    if not cache_shared_with_tasks():
+        return _build_state(team, None)
+
+    uncommitted = _uncommitted_team_ids()
+    if not connection.in_atomic_block:
+        # Anything left over belongs to transactions that were rolled back
+        uncommitted.clear()
+    try:
+        version = cache.get(_version_key(team.pk))
+        if version is None:
+            cache.add(_version_key(team.pk), _initial_version(), None)
+            version = cache.get(_version_key(team.pk))
+        cached = cache.get(_state_key(team.pk, version)) if version is not None else None
+    except Exception as e:
+        logger.warning(f"Error reading state for team {team.pk}: {e}")
+        version = None
+        cached = None
+
+    if cached is not None:
+        unlocked, solved = cached
+        return TeamState(version, frozenset(unlocked), frozenset(solved))
+
+    state = _build_state(team, version)
+    # A snapshot built from this transaction's own changes could be rolled back, so it isn't cached
+    if version is not None and team.pk not in uncommitted:
+        try:
+            cache.set(_state_key(team.pk, version), (tuple(state.unlocked), tuple(state.solved)), STATE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Error caching state for team {team.pk}: {e}")
+    return state
+
+
+def _bump_versions(team_ids):
+    for team_id in team_ids:
+        try:
+            cache.incr(_version_key(team_id))
+        except ValueError:
+            # No version yet, so there is no snapshot that could be stale either
+            pass
+        except Exception as e:
+            logger.warning(f"Error bumping state version for team {team_id}: {e}")
+
+
+def invalidate_team_states(team_ids):
+    """
+    Mark the cached state of the given teams as stale. The versions are bumped once now, so the rest of
+    this transaction sees the change, and again once it commits, so that snapshots other processes built
+    from data from before the commit are never used.
+    """
+    team_ids = set(team_ids)
+    if not team_ids:
+        return
+    _bump_versions(team_ids)
+    if connection.in_atomic_block:
+        _uncommitted_team_ids().update(team_ids)
+
+    def committed():
+        _uncommitted_team_ids().difference_update(team_ids)
+        _bump_versions(team_ids)
+    transaction.on_commit(committed)
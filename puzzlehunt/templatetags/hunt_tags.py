@@ -3,6 +3,7 @@ from django.conf import settings
 from django.template import Template, Context
 from django.urls import reverse
 from puzzlehunt.models import Hunt, Prepuzzle
+from puzzlehunt.team_membership import get_current_hunt, get_user_team
 from constance import config
 from urllib.parse import urlparse
 
@@ -53,7 +54,7 @@ def favicon():
 
 @register.filter()
 def render_with_context(value):
-    return Template(value).render(Context({'curr_hunt': Hunt.objects.get(is_current_hunt=True)}))
+    return Template(value).render(Context({'curr_hunt': get_current_hunt()}))
 
 
 @register.tag
@@ -66,8 +67,8 @@ class CurrentTeamEventNode(template.Node):
         if "hunt" in context and context['hunt'].is_current_hunt:
             hunt = context['hunt']
         else:
-            hunt = Hunt.objects.get(is_current_hunt=True)
-        context['current_hunt_team'] = hunt.team_from_user(context['request'].user)
+            hunt = get_current_hunt()
+        context['current_hunt_team'] = get_user_team(hunt, context['request'].user)
         return ''
 
 
@@ -97,7 +98,7 @@ class HuntFromContextEventNode(template.Node):
             context['tmpl_hunt'] = context['puzzle'].hunt
             return ''
         else:
-            context['tmpl_hunt'] = Hunt.objects.get(is_current_hunt=True)
+            context['tmpl_hunt'] = get_current_hunt()
             return ''
 
 
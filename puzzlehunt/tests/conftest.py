@@ -1,10 +1,31 @@
 import pytest
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from puzzlehunt.models import Hunt
+from django.core.cache import cache
+from puzzlehunt.models import Hunt, Submission
+from puzzlehunt.response_matcher import _matchers
+from puzzlehunt.progress_matrix import get_progress_matrix, MemoryProgressMatrix
+from puzzlehunt.email_delivery import get_email_outbox, MemoryEmailOutbox
+from puzzlehunt.notification_digest import get_digest_store, MemoryDigestStore
+from puzzlehunt.rate_limiter import get_limiter, MemoryTokenBucketLimiter
 
 User = get_user_model()
 
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    """Rolled back test data never fires delete signals, so don't let cached state outlive a test."""
+    yield
+    _matchers.clear()
+    cache.clear()
+    if isinstance(get_progress_matrix(), MemoryProgressMatrix):
+        get_progress_matrix().reset()
+    if isinstance(get_limiter(), MemoryTokenBucketLimiter):
+        get_limiter().reset()
+    if isinstance(get_digest_store(), MemoryDigestStore):
+        get_digest_store().reset()
+    if isinstance(get_email_outbox(), MemoryEmailOutbox):
+        get_email_outbox().reset()
+
 @pytest.fixture
 def basic_hunt():
     """A basic hunt fixture with standard settings."""
@@ -18,6 +39,15 @@ def basic_hunt():
         display_end_date=timezone.now() + timezone.timedelta(days=1)
     )
 
+@pytest.fixture
+def submit():
+    """Make submissions for a team, count of them at once if given."""
+    def submit(team, puzzle, text="WRONG", count=1, matched_response=None):
+        return [Submission.objects.create(team=team, puzzle=puzzle, submission_text=text,
+                                          submission_time=timezone.now(), matched_response=matched_response)
+                for _ in range(count)]
+    return submit
+
 @pytest.fixture
 def basic_user():
     """A basic user fixture with standard credentials."""
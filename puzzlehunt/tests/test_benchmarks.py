@@ -0,0 +1,89 @@
+import pytest
+from datetime import datetime, timedelta
+from puzzlehunt.config_parser import parse_config, compile_config, process_config_rules, process_compiled_rules
+from puzzlehunt.staff_views import MockPuzzleStatus
+from puzzlehunt.progress_encoding import ProgressTeam, ProgressCell, encode_rows, encode_columnar, serialize
+from django.http import JsonResponse
+
+# Roughly the shape of a large hunt: 12 rounds of 10 puzzles, each round gated on the previous meta,
+# plus the usual point, hint and time based rules.
+NUM_ROUNDS = 12
+PUZZLES_PER_ROUND = 10
+PUZZLE_IDS = [f"{i:04X}" for i in range(1, NUM_ROUNDS * PUZZLES_PER_ROUND + 1)]
+
+
+def build_large_config():
+    lines = ["1 HINT <= EVERY 30 MINUTES LIMIT 10"]
+    for r in range(NUM_ROUNDS):
+        round_ids = PUZZLE_IDS[r * PUZZLES_PER_ROUND:(r + 1) * PUZZLES_PER_ROUND]
+        meta = round_ids[-1]
+        gate = "0 POINTS" if r == 0 else f"(P{PUZZLE_IDS[r * PUZZLES_PER_ROUND - 1]} OR +{r}:00)"
+        for pid in round_ids[:5]:
+            lines.append(f"P{pid} <= {gate}")
+        for i, pid in enumerate(round_ids[5:-1]):
+            lines.append(f"P{pid} <= 3 OF ({', '.join('P' + p for p in round_ids[:5])}, {(i + 1) * 10} POINTS)")
+        lines.append(f"P{meta} <= ({' AND '.join('P' + p for p in round_ids[:3])})")
+        lines.append(f"5 POINTS <= [{', '.join('P' + p for p in round_ids)}]")
+        lines.append(f"1 P{meta} HINT <= 30 MINUTES AFTER P{round_ids[0]} UNLOCK")
+        lines.append(f'"Round {r + 1}" BADGE <= P{meta}')
+    return "\n".join(lines)
+
+
+@pytest.fixture(scope="module")
+def large_config():
+    config_rules = parse_config(build_large_config(), set(PUZZLE_IDS), {})
+    start = datetime(2025, 1, 1, 12, 0)
+    # A team about halfway through the hunt
+    statuses = [
+        MockPuzzleStatus(pid, start + timedelta(minutes=i), start + timedelta(minutes=i + 20))
+        for i, pid in enumerate(PUZZLE_IDS[:len(PUZZLE_IDS) // 2])
+    ]
+    return config_rules, statuses, start, start + timedelta(hours=6)
+
+
+@pytest.mark.benchmark(group="unlock-rules")
+def test_benchmark_interpreted_rules(benchmark, large_config):
+    config_rules, statuses, start, now = large_config
+    result = benchmark(process_config_rules, config_rules, statuses, start, now)
+    assert len(result[0]) > len(statuses)
+
+
+@pytest.mark.benchmark(group="unlock-rules")
+def test_benchmark_compiled_rules(benchmark, large_config):
+    config_rules, statuses, start, now = large_config
+    compiled = compile_config(config_rules, set(PUZZLE_IDS))
+    result = benchmark(process_compiled_rules, compiled, statuses, start, now)
+    assert result == process_config_rules(config_rules, statuses, start, now)
+
+
+# The progress board of a large hunt: 1,500 teams, each with about half of the puzzles unlocked
+NUM_TEAMS = 1500
+
+
+@pytest.fixture(scope="module")
+def large_progress():
+    start = datetime(2025, 1, 1, 12, 0)
+    teams = [ProgressTeam(i, f"Team {i}", [i % 60, start + timedelta(minutes=i)]) for i in range(NUM_TEAMS)]
+    cells = []
+    for team in teams:
+        for i, pid in enumerate(PUZZLE_IDS[:len(PUZZLE_IDS) // 2 + team.id % 10]):
+            unlock = start + timedelta(minutes=i * 5)
+            solve = unlock + timedelta(minutes=20) if i % 3 else None
+            cells.append(ProgressCell(team.id, pid, unlock, solve, solve, i % 7, i % 4))
+    return teams, cells, ["# Solves", "Last Solve Time"], start
+
+
+@pytest.mark.benchmark(group="progress-encoding")
+def test_benchmark_progress_rows(benchmark, large_progress):
+    teams, cells, columns, start = large_progress
+    response = benchmark(lambda: JsonResponse({"data": encode_rows(teams, cells, columns)}))
+    assert len(response.content) > 0
+
+
+@pytest.mark.benchmark(group="progress-encoding")
+def test_benchmark_progress_columnar(benchmark, large_progress):
+    teams, cells, columns, start = large_progress
+    body = benchmark(lambda: serialize(encode_columnar(teams, cells, columns, start), "columnar"))
+    rows = JsonResponse({"data": encode_rows(teams, cells, columns)}).content
+    # The columnar form should be a fraction of the size of the row form
+    assert len(body) * 3 < len(rows)
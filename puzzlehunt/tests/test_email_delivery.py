@@ -0,0 +1,123 @@
+from unittest.mock import patch
+import pytest
+from django.core import mail
+from django.utils import timezone
+from puzzlehunt.email_delivery import Email, send_batch, get_email_outbox
+from puzzlehunt.models import NotificationPlatform, NotificationSubscription, Event, Team, Puzzle, PuzzleStatus, User
+from puzzlehunt.notifications import send_event_notifications, send_queued_emails, send_emails
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Count the email connections opened"""
+    from django.core.mail.backends.locmem import EmailBackend
+    opened = []
+    original = EmailBackend.__init__
+
+    def init(self, *args, **kwargs):
+        opened.append(self)
+        original(self, *args, **kwargs)
+    monkeypatch.setattr(EmailBackend, '__init__', init)
+    return opened
+
+
+def emails(count):
+    return [Email(f"Subject {i}", "Body", "noreply@example.com", f"user{i}@example.com") for i in range(count)]
+
+
+def test_batch_uses_one_connection(settings, connections):
+    """Test that a batch of emails is sent over a single connection"""
+    settings.NOTIFICATION_EMAIL_MAX_PER_SECOND = 0
+    assert send_batch(emails(120)) == (120, [], 0.0)
+    assert len(mail.outbox) == 120
+    assert [message.to for message in mail.outbox[:2]] == [["user0@example.com"], ["user1@example.com"]]
+    assert len(connections) == 1
+
+
+def test_batch_max_per_second(settings):
+    """Test that the ceiling holds across batches, with emails over it handed back instead of waited for"""
+    settings.NOTIFICATION_EMAIL_MAX_PER_SECOND = 20
+    batch = emails(50)
+
+    num_sent, held, wait = send_batch(batch)
+    assert (num_sent, held) == (20, batch[20:])
+    assert 0 < wait <= 1
+    assert len(mail.outbox) == 20
+
+    # The next batch shares the same bucket
+    num_sent, held, wait = send_batch(held)
+    assert num_sent == 0 and len(held) == 30
+    assert len(mail.outbox) == 20
+
+
+def test_held_emails_are_queued(settings):
+    """Test that emails held back by the ceiling wait in the outbox for a flush once it has refilled"""
+    settings.NOTIFICATION_EMAIL_MAX_PER_SECOND = 20
+    batch = emails(50)
+
+    with patch('puzzlehunt.notifications.send_queued_emails.schedule') as schedule:
+        assert send_emails(batch) == 50
+    assert len(mail.outbox) == 20
+    assert get_email_outbox().take() == batch[20:]
+    assert 0 < schedule.call_args.kwargs['delay'] <= 1
+
+
+def test_merged_batches(settings):
+    """Test that emails with the same content become one anymail batch send when enabled"""
+    settings.EMAIL_BACKEND = 'anymail.backends.test.EmailBackend'
+    settings.NOTIFICATION_EMAIL_MERGE_BATCHES = True
+    batch = [Email("Unlocked", "Body", "noreply@example.com", f"user{i}@example.com") for i in range(3)]
+    batch.append(Email("Solved", "Body", "noreply@example.com", "user0@example.com"))
+
+    assert send_batch(batch)[0] == 4
+    unlocked, solved = mail.outbox
+    assert unlocked.to == ["user0@example.com", "user1@example.com", "user2@example.com"]
+    assert unlocked.merge_data == {recipient: {} for recipient in unlocked.to}
+    assert solved.to == ["user0@example.com"]
+
+
+def test_emails_gathered_across_events(settings, connections, basic_hunt):
+    """Test that emails for several events wait in the outbox and are sent together"""
+    settings.NOTIFICATION_EMAIL_BATCH_INTERVAL = 2
+    team = Team.objects.create(name='Team', hunt=basic_hunt)
+    platform = NotificationPlatform.objects.create(type=NotificationPlatform.PlatformType.EMAIL, name='Email',
+                                                   enabled=True, config={'from_email': 'noreply@example.com'})
+    for i in range(3):
+        user = User.objects.create_user(email=f'user{i}@example.com', password='testpass')
+        team.members.add(user)
+        NotificationSubscription.objects.create(user=user, platform=platform, hunt=basic_hunt,
+                                                destination=user.email, event_types=Event.EventType.PUZZLE_UNLOCK)
+    for number in range(1, 3):
+        puzzle = Puzzle.objects.create(id=f'TEST{number:02}', name=f'Puzzle {number}', hunt=basic_hunt,
+                                       order_number=number, answer='ANSWER')
+        PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+        send_event_notifications.call_local(Event.objects.get(type=Event.EventType.PUZZLE_UNLOCK, puzzle=puzzle).pk)
+    assert mail.outbox == []
+
+    send_queued_emails.call_local()
+    assert len(mail.outbox) == 6
+    assert len(connections) == 1
+    assert get_email_outbox().take() == []
+
+
+def test_stores_share_one_redis_client(settings, monkeypatch):
+    """Test that every store kept beside a Redis cache uses the same client, and so one connection pool"""
+    from puzzlehunt import shared_cache, rate_limiter, progress_matrix, notification_digest, email_delivery
+    from puzzlehunt.rate_limiter import get_limiter
+    from puzzlehunt.progress_matrix import get_progress_matrix
+    from puzzlehunt.notification_digest import get_digest_store
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                   'LOCATION': 'redis://localhost:6379/1'}}
+    for module, names in [(shared_cache, ['_redis', '_redis_checked']), (rate_limiter, ['_limiter']),
+                          (progress_matrix, ['_matrix', '_matrix_checked']),
+                          (notification_digest, ['_store', '_store_checked']),
+                          (email_delivery, ['_outbox', '_outbox_checked'])]:
+        for name in names:
+            monkeypatch.setattr(module, name, False if name.endswith('_checked') else None)
+
+    client = shared_cache.get_shared_redis()
+    assert client is not None
+    assert all(store.client is client
+               for store in [get_limiter(), get_progress_matrix(), get_digest_store(), get_email_outbox()])
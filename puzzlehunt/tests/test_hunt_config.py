@@ -1,8 +1,20 @@
+from types import SimpleNamespace
 from unittest.mock import patch
 import pytest
 from django.utils import timezone
-from puzzlehunt.models import Puzzle, Team, PuzzleStatus
+from django.contrib import admin
+from puzzlehunt.admin import TeamAdmin
+from puzzlehunt.models import Hunt, Puzzle, Team, PuzzleStatus, Event
+from puzzlehunt.config_parser import (
+    parse_config, compile_config, process_config_rules, process_compiled_rules, process_solve_rules,
+    next_trigger_time
+)
+from puzzlehunt.tasks import check_team_unlocks, process_unlock_shard, UNLOCK_SHARDS
+from huey.contrib.djhuey import HUEY
+from puzzlehunt.staff_views import MockPuzzleStatus
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 pytestmark = pytest.mark.django_db
 
@@ -1229,3 +1241,462 @@ def test_puzzle_order_ref_in_list(hunt_with_puzzles):
         status.mark_solved()
         team.process_unlocks()
         assert team.points == 5 * (i + 1)
+
+
+def test_compiled_rules_match_interpreted_rules():
+    """Test that the compiled rule engine gives the same results as interpreting the AST directly"""
+    config = """
+    P1 <= 0 POINTS
+    P2 <= (P1 AND (5 POINTS AND +0:30))
+    P3 <= 2 OF (P1, P2 SOLVE, ((+1:00)))
+    [P4, 5 POINTS, 5 POINTS] <= (P1 UNLOCK OR P2)
+    5 POINTS <= P1
+    1 HINT <= EVERY 20 MINUTES
+    2 HINTS <= EVERY 1 HOUR AFTER P1 SOLVE LIMIT 2
+    1 P3 HINT <= EVERY 15 MINUTES AFTER +0:30 IF 10 POINTS
+    "Speedy" BADGE <= 30 MINUTES AFTER P2 UNLOCK IF P1
+    P5 <= 1 HOUR AFTER +1:00
+    """
+    puzzle_ids = {"1", "2", "3", "4", "5"}
+    rules = parse_config(config, puzzle_ids, {})
+    compiled = compile_config(rules, puzzle_ids)
+
+    start = timezone.now()
+    scenarios = [
+        [],
+        [MockPuzzleStatus("1", start, None)],
+        [MockPuzzleStatus("1", start, start + timezone.timedelta(minutes=10))],
+        [MockPuzzleStatus("1", start, start + timezone.timedelta(minutes=10)),
+         MockPuzzleStatus("2", start + timezone.timedelta(minutes=30), start + timezone.timedelta(minutes=50))],
+    ]
+    for statuses in scenarios:
+        for minutes in [0, 15, 31, 59, 60, 90, 125, 240]:
+            now = start + timezone.timedelta(minutes=minutes)
+            expected = process_config_rules(rules, statuses, start, now)
+            assert process_compiled_rules(compiled, statuses, start, now) == expected
+
+
+def test_compiled_config_cache(hunt_with_puzzles):
+    """Test that compiled configs are reused until the config or puzzles change"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = "P1 <= 0 POINTS"
+    hunt.save()
+
+    compiled = hunt.get_compiled_config()
+    assert hunt.get_compiled_config() is compiled
+
+    hunt.config = "P1 <= 0 POINTS\nP2 <= P1"
+    hunt.save()
+    recompiled = hunt.get_compiled_config()
+    assert recompiled is not compiled
+    assert len(recompiled.rules) == 2
+
+    Puzzle.objects.create(hunt=hunt, name="Puzzle 4", answer="ANSWER", order_number=4, id="4")
+    assert hunt.get_compiled_config() is not recompiled
+
+
+def test_lowercase_puzzle_ids(basic_hunt):
+    """Test that puzzle IDs stored in lowercase are resolved when the config is compiled"""
+    first = Puzzle.objects.create(hunt=basic_hunt, name="Lower 1", answer="ANSWER", order_number=1, id="ab1")
+    Puzzle.objects.create(hunt=basic_hunt, name="Lower 2", answer="ANSWER", order_number=2, id="ab2")
+    basic_hunt.config = """
+    Pab1 <= 0 POINTS
+    Pab2 <= Pab1
+    """
+    basic_hunt.save()
+
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    team.process_unlocks()
+    assert [p.id for p in team.unlocked_puzzles()] == ["ab1"]
+
+    PuzzleStatus.objects.get(team=team, puzzle=first).mark_solved()
+    assert sorted(p.id for p in team.unlocked_puzzles()) == ["ab1", "ab2"]
+
+
+def _settle(compiled, statuses, start, now):
+    """Run full evaluations, unlocking puzzles as process_unlocks would, until nothing new unlocks"""
+    statuses = list(statuses)
+    while True:
+        result = process_compiled_rules(compiled, statuses, start, now)
+        known = {s.puzzle_id for s in statuses}
+        new_unlocks = result[0] - known
+        if not new_unlocks:
+            return statuses, result
+        statuses.extend(MockPuzzleStatus(pid, now, None) for pid in sorted(new_unlocks))
+
+
+def test_solve_rules_match_full_evaluation():
+    """Test that incrementally processing a solve ends up where repeated full evaluations would"""
+    config = """
+    P1 <= 0 POINTS
+    P2 <= 0 POINTS
+    P3 <= P1
+    [P4, 5 POINTS] <= P3 UNLOCK
+    P5 <= 2 OF (P1, P2, P4)
+    P6 <= (P2 AND 10 POINTS)
+    5 POINTS <= P1
+    2 HINTS <= P2 SOLVE
+    1 P6 HINT <= P1
+    1 P5 HINT <= EVERY 10 MINUTES IF P4 UNLOCK
+    1 HINT <= EVERY 20 MINUTES
+    "Fast" BADGE <= 10 POINTS
+    "Slow" BADGE <= +1:00
+    """
+    puzzle_ids = {str(i) for i in range(1, 7)}
+    compiled = compile_config(parse_config(config, puzzle_ids, {}), puzzle_ids)
+    start = timezone.now()
+
+    for minutes in [5, 45, 90]:
+        now = start + timezone.timedelta(minutes=minutes)
+        for solve_order in [["1", "2"], ["2", "1"]]:
+            statuses, before = _settle(compiled, [], start, now)
+            for solved in solve_order:
+                statuses = [MockPuzzleStatus(s.puzzle_id, s.unlock_time, now if s.puzzle_id == solved else s.solve_time)
+                            for s in statuses]
+                unlocked, points, hints, puzzle_hints, badges = process_solve_rules(
+                    compiled, statuses, solved, start, now, before[1], before[4])
+                known = {s.puzzle_id for s in statuses}
+                statuses, after = _settle(compiled, statuses, start, now)
+
+                assert unlocked == {s.puzzle_id for s in statuses} - known
+                assert before[1] + points == after[1]
+                assert before[2] + hints == after[2]
+                for puzzle_id in known:
+                    assert before[3].get(puzzle_id, 0) + puzzle_hints.get(puzzle_id, 0) == after[3].get(puzzle_id, 0)
+                for puzzle_id in unlocked:
+                    assert puzzle_hints.get(puzzle_id, 0) == after[3].get(puzzle_id, 0)
+                assert sorted(before[4] + badges) == sorted(after[4])
+                before = after
+
+
+def test_solve_rules_only_evaluate_affected_rules():
+    """Test that processing a solve skips rules that don't depend on the solved puzzle"""
+    config = """
+    P2 <= P1
+    P3 <= +1:00
+    1 HINT <= EVERY 10 MINUTES
+    5 POINTS <= P2 UNLOCK
+    """
+    puzzle_ids = {"1", "2", "3"}
+    compiled = compile_config(parse_config(config, puzzle_ids, {}), puzzle_ids)
+    calls = []
+    for rule in compiled.rules:
+        def counting(*args, rule=rule, count=rule.count):
+            calls.append(rule.index)
+            return count(*args)
+        rule.count = counting
+
+    assert compiled.rules_by_puzzle == {"1": [compiled.rules[0]], "2": [compiled.rules[3]]}
+    start = timezone.now()
+    now = start + timezone.timedelta(hours=2)
+    statuses = [MockPuzzleStatus("1", start, now)]
+    result = process_solve_rules(compiled, statuses, "1", start, now, 0, [])
+    assert result == ({"2"}, 5, 0, {}, [])
+    assert set(calls) == {0, 3}
+
+
+def test_mark_solved_processes_solve(hunt_with_puzzles):
+    """Test that solving a puzzle applies its cascade and agrees with a full process_unlocks"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= P1
+    [P3, 5 POINTS] <= P2 UNLOCK
+    1 P3 HINT <= P1
+    1 HINT <= P1
+    "Solver" BADGE <= 5 POINTS
+    """
+    hunt.save()
+
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+    team.process_unlocks()
+    PuzzleStatus.objects.get(team=team, puzzle=puzzles[0]).mark_solved()
+
+    team.refresh_from_db()
+    assert sorted(p.id for p in team.unlocked_puzzles()) == ["1", "2", "3"]
+    assert team.points == 5
+    assert team.num_available_hints == 1
+    assert team.badges == ["SOLVER"]
+    assert PuzzleStatus.objects.get(team=team, puzzle=puzzles[2]).num_available_hints == 1
+
+    # A full evaluation should find nothing left to do
+    team.process_unlocks()
+    team.refresh_from_db()
+    assert team.points == 5
+    assert team.num_total_hints_earned == 1
+    assert team.badges == ["SOLVER"]
+    assert PuzzleStatus.objects.get(team=team, puzzle=puzzles[2]).num_total_hints_earned == 1
+
+
+def test_process_solve_reads_team_after_locking(hunt_with_puzzles):
+    """Test that a solve works from the team's stored values, not a copy loaded before another solve"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= 0 POINTS
+    "FIRST" BADGE <= P1
+    "SECOND" BADGE <= P2
+    10 POINTS <= P2
+    """
+    hunt.save()
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+    team.process_unlocks()
+
+    stale_team = Team.objects.get(pk=team.pk)
+    PuzzleStatus.objects.get(team=team, puzzle=puzzles[0]).mark_solved()
+    status = PuzzleStatus.objects.get(team=team, puzzle=puzzles[1])
+    status.team = stale_team
+    status.mark_solved()
+
+    team.refresh_from_db()
+    assert team.badges == ["FIRST", "SECOND"]
+    assert team.points == 10
+
+
+def test_badges_keep_config_order(hunt_with_puzzles):
+    """Test that badges are stored in config order, however and whenever they were earned"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= 0 POINTS
+    "EARLY" BADGE <= P3
+    P3 <= P1
+    "LATE" BADGE <= P1
+    "SECOND" BADGE <= P2
+    """
+    hunt.save()
+    compiled = hunt.get_compiled_config()
+    assert compiled.order_badges(["GONE", "SECOND", "EARLY", "LATE"]) == ["EARLY", "LATE", "SECOND", "GONE"]
+
+    solved_team = Team.objects.create(name="Solve Team", hunt=hunt)
+    solved_team.process_unlocks()
+    for puzzle in [puzzles[1], puzzles[0], puzzles[2]]:
+        PuzzleStatus.objects.get(team=solved_team, puzzle=puzzle).mark_solved()
+
+    swept_team = Team.objects.create(name="Sweep Team", hunt=hunt)
+    for puzzle in puzzles[:3]:
+        PuzzleStatus.objects.create(team=swept_team, puzzle=puzzle, unlock_time=timezone.now(),
+                                    solve_time=timezone.now())
+    swept_team.process_unlocks()
+
+    solved_team.refresh_from_db()
+    swept_team.refresh_from_db()
+    assert solved_team.badges == ["EARLY", "LATE", "SECOND"]
+    assert swept_team.badges == ["EARLY", "LATE", "SECOND"]
+
+
+def test_next_trigger_time():
+    """Test finding the next time a time based rule could change"""
+    config = """
+    P1 <= 0 POINTS
+    P2 <= (P1 OR +1:00)
+    P3 <= 45 MINUTES AFTER P1 SOLVE
+    1 HINT <= EVERY 20 MINUTES LIMIT 3
+    1 P2 HINT <= EVERY 1 HOUR AFTER P2 UNLOCK IF 5 POINTS
+    P4 <= P3
+    """
+    puzzle_ids = {"1", "2", "3", "4"}
+    compiled = compile_config(parse_config(config, puzzle_ids, {}), puzzle_ids)
+    assert [rule.index for rule in compiled.time_rules] == [1, 2, 3, 4]
+    start = timezone.now()
+    minutes = lambda m: start + timezone.timedelta(minutes=m)
+
+    assert next_trigger_time(compiled, [], start, minutes(5), 0) == minutes(20)
+    assert next_trigger_time(compiled, [], start, minutes(20), 0) == minutes(40)
+    assert next_trigger_time(compiled, [], start, minutes(50), 0) == minutes(60)
+
+    # Solving P1 starts its timer, the hint interval has hit its limit
+    statuses = [MockPuzzleStatus("1", start, minutes(70))]
+    assert next_trigger_time(compiled, statuses, start, minutes(70), 0) == minutes(115)
+
+    # The P2 hint interval only counts once the team has 5 points
+    statuses = [MockPuzzleStatus("1", start, minutes(70)), MockPuzzleStatus("2", minutes(60), None)]
+    assert next_trigger_time(compiled, statuses, start, minutes(116), 0) is None
+    assert next_trigger_time(compiled, statuses, start, minutes(116), 5) == minutes(120)
+
+
+def test_process_unlocks_records_next_check(hunt_with_puzzles):
+    """Test that process_unlocks records when the team next needs checking"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= +1:00
+    """
+    hunt.save()
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+    assert team.next_unlock_check is None
+
+    team.process_unlocks()
+    assert team.next_unlock_check == hunt.start_date + timezone.timedelta(hours=1)
+
+    # Nothing left that changes with time, so nothing is due until the hunt ends
+    hunt.config = "P1 <= 0 POINTS"
+    hunt.save()
+    team.refresh_from_db()
+    assert team.next_unlock_check is None
+    team.process_unlocks()
+    assert team.next_unlock_check == hunt.end_date
+
+
+def test_only_timing_edits_reset_next_check(hunt_with_puzzles):
+    """Test that saving a team keeps its next check, unless an admin changes its unlock window"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= +1:00
+    """
+    hunt.save()
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+    team.process_unlocks()
+    next_check = hunt.start_date + timezone.timedelta(hours=1)
+
+    team.name = "Renamed Team"
+    team.save()
+    team.refresh_from_db()
+    assert team.next_unlock_check == next_check
+
+    team_admin = TeamAdmin(Team, admin.site)
+    team_admin.save_model(None, team, SimpleNamespace(changed_data=["name"]), True)
+    team.refresh_from_db()
+    assert team.next_unlock_check == next_check
+
+    team.playtester = True
+    team_admin.save_model(None, team, SimpleNamespace(changed_data=["playtester"]), True)
+    team.refresh_from_db()
+    assert team.next_unlock_check is None
+
+
+def test_check_team_unlocks_only_processes_due_teams(hunt_with_puzzles):
+    """Test that the periodic unlock check skips teams with nothing due"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= +1:00
+    """
+    hunt.save()
+    due_team = Team.objects.create(name="Due Team", hunt=hunt)
+    waiting_team = Team.objects.create(name="Waiting Team", hunt=hunt)
+    new_team = Team.objects.create(name="New Team", hunt=hunt)
+    for team in [due_team, waiting_team]:
+        team.process_unlocks()
+    Team.objects.filter(pk=due_team.pk).update(next_unlock_check=timezone.now() - timezone.timedelta(seconds=1))
+
+    processed = []
+    with patch.object(Team, "bulk_process_unlocks", lambda teams, configs: processed.extend(t.pk for t in teams)):
+        check_team_unlocks.call_local()
+    assert sorted(processed) == sorted([due_team.pk, new_team.pk])
+
+
+def test_bulk_process_unlocks(hunt_with_puzzles):
+    """Test that processing a batch of teams unlocks puzzles and creates events for all of them"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    P2 <= P1
+    1 P1 HINT <= 0 POINTS
+    """
+    hunt.save()
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(5)]
+    PuzzleStatus.objects.create(team=teams[0], puzzle=puzzles[0], unlock_time=timezone.now(), solve_time=timezone.now())
+
+    changed = Team.bulk_process_unlocks(Team.objects.filter(hunt=hunt), {hunt.pk: hunt.get_compiled_config()})
+
+    assert len(changed) == 5
+    assert sorted(p.id for p in teams[0].unlocked_puzzles()) == ["1", "2"]
+    for team in teams[1:]:
+        assert [p.id for p in team.unlocked_puzzles()] == ["1"]
+        assert PuzzleStatus.objects.get(team=team, puzzle=puzzles[0]).num_available_hints == 1
+    assert PuzzleStatus.objects.get(team=teams[0], puzzle=puzzles[0]).num_available_hints == 1
+    assert Event.objects.filter(type=Event.EventType.PUZZLE_UNLOCK).count() == 6
+
+
+def test_bulk_process_unlocks_query_count(hunt_with_puzzles):
+    """Test that the number of queries for a batch doesn't grow with the number of teams"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = """
+    P1 <= 0 POINTS
+    5 POINTS <= 0 POINTS
+    1 HINT <= 0 POINTS
+    1 P1 HINT <= 0 POINTS
+    "STARTED" BADGE <= 0 POINTS
+    """
+    hunt.save()
+    compiled_configs = {hunt.pk: hunt.get_compiled_config()}
+
+    query_counts = []
+    for num_teams in [2, 10]:
+        teams = [Team.objects.create(name=f"Team {num_teams} {i}", hunt=hunt) for i in range(num_teams)]
+        for team in teams:
+            PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            Team.bulk_process_unlocks(teams, compiled_configs)
+        query_counts.append(len(queries))
+
+        for team in Team.objects.filter(pk__in=[team.pk for team in teams]):
+            assert team.points == 5
+            assert team.num_available_hints == 1
+            assert team.badges == ["STARTED"]
+        assert all(team.num_available_hints == 1 for team in teams)
+        assert PuzzleStatus.objects.filter(team__in=teams, num_available_hints=1).count() == num_teams
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_unlock_sweep_isolates_broken_hunts(hunt_with_puzzles, caplog):
+    """Test that a hunt with a broken config doesn't stop other hunts' teams from being processed"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = "P1 <= 0 POINTS"
+    hunt.save()
+    broken_hunt = Hunt.objects.create(
+        name="Broken Hunt",
+        team_size_limit=4,
+        start_date=hunt.start_date,
+        end_date=hunt.end_date,
+    )
+    Puzzle.objects.create(hunt=broken_hunt, name="Broken 1", answer="ANSWER", order_number=1, id="B1")
+    # Bypass validation on save to get an unparseable config into the database
+    Hunt.objects.filter(pk=broken_hunt.pk).update(config="PB1 <= NOT VALID")
+
+    broken_team = Team.objects.create(name="Broken Team", hunt=broken_hunt)
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(6)]
+
+    check_team_unlocks.call_local()
+
+    for team in teams:
+        assert [p.id for p in team.unlocked_puzzles()] == ["1"]
+    assert not broken_team.unlocked_puzzles().exists()
+    assert f"failed_hunts=[{broken_hunt.pk}]" in caplog.text
+    assert "teams=7" in caplog.text
+
+
+def test_unlock_shard_timings(hunt_with_puzzles):
+    """Test that a shard reports its timings and the hunts it processed"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = "P1 <= 0 POINTS"
+    hunt.save()
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+
+    timings = process_unlock_shard.call_local([team.pk])
+
+    assert timings["teams"] == 1
+    assert timings["hunts"] == [hunt.pk]
+    assert timings["failed_hunts"] == []
+    assert timings["config"] >= 0 and timings["process"] >= 0
+    assert [p.id for p in team.unlocked_puzzles()] == ["1"]
+
+
+def test_unlock_shard_skips_while_running(hunt_with_puzzles):
+    """Test that a shard whose previous run hasn't finished is skipped rather than run alongside it"""
+    hunt, puzzles = hunt_with_puzzles
+    hunt.config = "P1 <= 0 POINTS"
+    hunt.save()
+    team = Team.objects.create(name="Test Team", hunt=hunt)
+
+    with HUEY.lock_task(f"unlock-shard-{team.pk % UNLOCK_SHARDS}"):
+        timings = process_unlock_shard.call_local([team.pk], team.pk % UNLOCK_SHARDS)
+    assert timings["skipped"]
+    assert not team.unlocked_puzzles().exists()
+
+    timings = process_unlock_shard.call_local([team.pk], team.pk % UNLOCK_SHARDS)
+    assert "skipped" not in timings
+    assert [p.id for p in team.unlocked_puzzles()] == ["1"]
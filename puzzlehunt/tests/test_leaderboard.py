@@ -0,0 +1,222 @@
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from constance import config
+from puzzlehunt.models import Puzzle, Team, PuzzleStatus, TeamRankingRule, LeaderboardEntry
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def ranked_hunt(basic_hunt):
+    """A hunt ranked by puzzles solved, then earliest last solve, with a meta and a final"""
+    puzzle_types = [Puzzle.PuzzleType.STANDARD_PUZZLE, Puzzle.PuzzleType.META_PUZZLE, Puzzle.PuzzleType.FINAL_PUZZLE]
+    puzzles = [Puzzle.objects.create(hunt=basic_hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i,
+                                     id=str(i), type=puzzle_type)
+               for i, puzzle_type in enumerate(puzzle_types, start=1)]
+    TeamRankingRule.objects.create(hunt=basic_hunt, rule_type=TeamRankingRule.RuleType.NUM_PUZZLES, rule_order=1)
+    TeamRankingRule.objects.create(hunt=basic_hunt, rule_type=TeamRankingRule.RuleType.LAST_SOLVE_TIME, rule_order=2)
+    return basic_hunt, puzzles
+
+
+def solve(team, puzzle, minutes):
+    time = timezone.now() - timezone.timedelta(minutes=minutes)
+    PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=time, solve_time=time)
+
+
+def test_entries_follow_progress(ranked_hunt, django_capture_on_commit_callbacks):
+    """Test that entries are kept up to date as teams unlock, solve, and earn points"""
+    hunt, puzzles = ranked_hunt
+    with django_capture_on_commit_callbacks(execute=True):
+        team = Team.objects.create(name="Team", hunt=hunt)
+    entry = LeaderboardEntry.objects.get(team=team)
+    assert (entry.num_unlocks, entry.num_solves, entry.last_solve_time) == (0, 0, None)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        status = PuzzleStatus.objects.create(team=team, puzzle=puzzles[1], unlock_time=timezone.now())
+        status.mark_solved()
+        PuzzleStatus.objects.create(team=team, puzzle=puzzles[2], unlock_time=timezone.now())
+        team.points = 7
+        team.save()
+    entry.refresh_from_db()
+    status.refresh_from_db()
+    assert (entry.num_unlocks, entry.num_solves, entry.num_metas) == (2, 1, 1)
+    assert entry.last_solve_time == entry.last_meta_time == status.solve_time
+    assert entry.final_solve_time is None
+    assert entry.points == 7
+
+    with django_capture_on_commit_callbacks(execute=True):
+        status.delete()
+    entry.refresh_from_db()
+    assert (entry.num_unlocks, entry.num_solves, entry.last_solve_time) == (1, 0, None)
+
+
+def test_ranked_teams_match_annotations(ranked_hunt):
+    """Test that the entries rank teams the same way as annotating the team query"""
+    hunt, puzzles = ranked_hunt
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(4)]
+    solve(teams[0], puzzles[0], 30)
+    solve(teams[1], puzzles[0], 20)
+    solve(teams[1], puzzles[1], 10)
+    solve(teams[2], puzzles[0], 40)
+    Team.objects.create(name="Playtesters", hunt=hunt, playtester=True)
+
+    ruleset = list(hunt.teamrankingrule_set.order_by("rule_order"))
+    annotated = hunt.team_set.exclude(playtester=True)
+    for rule in ruleset:
+        annotated = rule.annotate_query(annotated)
+    annotated = annotated.order_by(*[rule.ordering_parameter for rule in ruleset], 'pk')
+
+    # Entries are built on first use for teams that don't have one yet
+    ranked = list(LeaderboardEntry.objects.ranked(hunt, ruleset))
+    assert [entry.team_id for entry in ranked] == [team.pk for team in annotated]
+    assert [entry.num_solves for entry in ranked] == [2, 1, 1, 0]
+    assert ranked[1].last_solve_time == annotated[1].LAST
+    assert [entry.position for entry in ranked] == [1, 2, 3, 4]
+    assert [entry.position for entry in ranked] == [
+        LeaderboardEntry.objects.position_of(entry, ruleset) for entry in ranked]
+
+
+def test_ranks_and_ties(ranked_hunt):
+    """Test that tied teams share a rank and a tie for last place is marked"""
+    hunt, puzzles = ranked_hunt
+    ruleset = list(hunt.teamrankingrule_set.order_by("rule_order"))
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(5)]
+    solve(teams[0], puzzles[0], 10)
+    solve(teams[1], puzzles[0], 10)
+    PuzzleStatus.objects.filter(team=teams[1]).update(solve_time=PuzzleStatus.objects.get(team=teams[0]).solve_time)
+    solve(teams[2], puzzles[0], 5)
+    LeaderboardEntry.objects.refresh([team.pk for team in teams])
+
+    ranked = list(LeaderboardEntry.objects.ranked(hunt, ruleset))
+    assert [entry.rank for entry in ranked] == [1, 1, 3, 4, 4]
+    assert [entry.tied_last for entry in ranked] == [False, False, False, True, True]
+    assert [LeaderboardEntry.objects.team_for_display(entry, ruleset).computed_rank for entry in ranked] == \
+        [1, 1, 3, "-", "-"]
+    assert [LeaderboardEntry.objects.position_of(entry, ruleset) for entry in ranked] == [1, 2, 3, 4, 5]
+
+
+def test_split_leaderboard(client, ranked_hunt):
+    """Test that the split leaderboard ranks each custom data group on its own"""
+    hunt, puzzles = ranked_hunt
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt, custom_data=str(i % 2 == 0)) for i in range(4)]
+    for minutes, team in zip([40, 30, 20, 10], teams):
+        solve(team, puzzles[0], minutes)
+    solve(teams[3], puzzles[1], 5)
+    LeaderboardEntry.objects.refresh([team.pk for team in teams])
+
+    config.SPLIT_LEADERBOARD_BY_CUSTOM_DATA = True
+    config.TEAM_CUSTOM_DATA_TYPE = 'boolean'
+    response = client.get(reverse('puzzlehunt:hunt_leaderboard', args=[hunt.pk]))
+    assert response.context['split_leaderboard']
+    assert [(t.name, t.computed_rank) for t in response.context['team_data']] == \
+        [("Team 3", 1), ("Team 0", 2), ("Team 1", 3), ("Team 2", 4)]
+    assert [(t.name, t.computed_rank) for t in response.context['team_data_true']] == [("Team 0", 1), ("Team 2", 2)]
+    assert [(t.name, t.computed_rank) for t in response.context['team_data_false']] == [("Team 3", 1), ("Team 1", 2)]
+
+
+def test_leaderboard_data(client, ranked_hunt):
+    """Test paging through the leaderboard JSON and fetching a team's neighborhood"""
+    hunt, puzzles = ranked_hunt
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(10)]
+    for i, team in enumerate(teams):
+        solve(team, puzzles[0], 100 - i)
+    LeaderboardEntry.objects.refresh([team.pk for team in teams])
+    url = reverse('puzzlehunt:hunt_leaderboard_data', args=[hunt.pk])
+
+    data = client.get(url, {'limit': 4}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 0", "Team 1", "Team 2", "Team 3"]
+    assert [rule['type'] for rule in data['rules']] == ["PUZZ", "LAST"]
+    assert data['teams'][0]['values']['PUZZ'] == 1
+    assert data['next'] is not None and data['previous'] is None
+
+    data = client.get(url, {'limit': 4, 'after': data['next']}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 4", "Team 5", "Team 6", "Team 7"]
+    data = client.get(url, {'limit': 4, 'after': data['next']}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 8", "Team 9"]
+    assert [team['rank'] for team in data['teams']] == [9, 10]
+    assert [team['position'] for team in data['teams']] == [9, 10]
+    assert data['next'] is None and data['previous'] is not None
+
+    data = client.get(url, {'limit': 4, 'before': data['previous']}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 4", "Team 5", "Team 6", "Team 7"]
+    assert data['next'] is not None and data['previous'] is not None
+
+    data = client.get(url, {'limit': 3, 'around': teams[6].pk}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 5", "Team 6", "Team 7"]
+    data = client.get(url, {'limit': 3, 'after': data['next']}).json()
+    assert [team['name'] for team in data['teams']] == ["Team 8", "Team 9"]
+
+    assert client.get(url, {'around': 0}).status_code == 404
+    assert client.get(url, {'after': 'x'}).status_code == 400
+    assert client.get(url, {'after': 'WzFd'}).status_code == 400
+
+
+def test_leaderboard_data_cursor_matches_ranking(client, ranked_hunt):
+    """Test that pages found by cursor get the same ranks, positions and ties as ranking the whole hunt"""
+    hunt, puzzles = ranked_hunt
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt, custom_data=str(i % 2 == 0)) for i in range(9)]
+    start = timezone.now() - timezone.timedelta(hours=2)
+    for i, team in enumerate(teams[:5]):
+        # Pairs of teams solve at exactly the same time, so they tie
+        time = start + timezone.timedelta(minutes=i // 2)
+        PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=time, solve_time=time)
+    LeaderboardEntry.objects.refresh([team.pk for team in teams])
+    ruleset = list(hunt.teamrankingrule_set.order_by("rule_order"))
+    url = reverse('puzzlehunt:hunt_leaderboard_data', args=[hunt.pk])
+
+    for group, params in [(None, {}), (True, {'group': 'true'})]:
+        entries = LeaderboardEntry.objects.ranked(hunt, ruleset)
+        if group:
+            entries = entries.filter(team__custom_data="True")
+        expected = [(entry.team_id, "-" if entry.tied_last else entry.rank, entry.position) for entry in entries]
+        assert len({rank for _, rank, _ in expected}) < len(expected)
+
+        paged = []
+        data = client.get(url, {'limit': 2, **params}).json()
+        paged.extend(data['teams'])
+        while data['next']:
+            data = client.get(url, {'limit': 2, 'after': data['next'], **params}).json()
+            paged.extend(data['teams'])
+        assert [(team['id'], team['rank'], team['position']) for team in paged] == expected
+
+
+def test_leaderboard_view(client, ranked_hunt):
+    """Test that the leaderboard ranks teams, with ties at the bottom shown as "-", in a fixed number of queries"""
+    hunt, puzzles = ranked_hunt
+    teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(3)]
+    solve(teams[2], puzzles[0], 10)
+    LeaderboardEntry.objects.refresh([team.pk for team in teams])
+    url = reverse('puzzlehunt:hunt_leaderboard', args=[hunt.pk])
+    client.get(url)  # Warm up the site settings caches
+
+    with CaptureQueriesContext(connection) as few_teams:
+        response = client.get(url)
+    team_data = response.context['team_data']
+    assert team_data[0] == teams[2]
+    assert team_data[0].computed_rank == 1
+    assert all(team.computed_rank == "-" for team in team_data[1:])
+
+    for i in range(20):
+        Team.objects.create(name=f"Extra {i}", hunt=hunt)
+    LeaderboardEntry.objects.refresh(hunt.team_set.values_list('pk', flat=True))
+    with CaptureQueriesContext(connection) as many_teams:
+        response = client.get(url)
+    assert len(response.context['team_data']) == 23
+    assert len(many_teams) == len(few_teams)
+
+
+def test_rebuild_leaderboard(ranked_hunt):
+    """Test that the rebuild command fixes entries that have drifted"""
+    hunt, puzzles = ranked_hunt
+    team = Team.objects.create(name="Team", hunt=hunt)
+    solve(team, puzzles[0], 10)
+    LeaderboardEntry.objects.refresh([team.pk])
+    LeaderboardEntry.objects.filter(team=team).update(num_solves=5)
+
+    call_command("rebuild_leaderboard", hunt=hunt.pk, stdout=StringIO())
+    assert LeaderboardEntry.objects.get(team=team).num_solves == 1
@@ -1,5 +1,7 @@
 import pytest
 from unittest.mock import patch, MagicMock
+from django.core import mail
+from django.db import transaction
 from django.utils import timezone
 
 from puzzlehunt.models import (
@@ -45,6 +47,87 @@ class TestChannelManager:
         assert cm.can_read_channel(basic_user, 'user-invalid') is False
         assert cm.can_read_channel(basic_user, 'user-') is False
 
+    def test_team_channel_access(self, basic_user, staff_user, basic_hunt):
+        """Test that team channels can only be read by the team's members"""
+        team = Team.objects.create(name="Team", hunt=basic_hunt)
+        team.members.add(basic_user)
+        cm = PuzzlehuntChannelManager()
+        assert cm.can_read_channel(basic_user, f'team-{team.pk}') is True
+        assert cm.can_read_channel(staff_user, f'team-{team.pk}') is False
+        assert cm.can_read_channel(None, f'team-{team.pk}') is False
+        assert cm.can_read_channel(basic_user, 'team-invalid') is False
+
+    def test_user_stream_includes_team_channels(self, rf, basic_user, basic_hunt):
+        """Test that the user stream also carries the channels of the user's teams"""
+        team = Team.objects.create(name="Team", hunt=basic_hunt)
+        team.members.add(basic_user)
+        request = rf.get('/')
+        request.user = basic_user
+        cm = PuzzlehuntChannelManager()
+        channels = cm.get_channels_for_request(
+            request, {'pk': str(basic_user.pk), 'format-channels': ['user-{pk}'], 'team-channels': True})
+        assert channels == {f'user-{basic_user.pk}', f'team-{team.pk}'}
+
+    def test_team_channels_follow_membership_cache(self, rf, basic_user, basic_hunt, django_assert_num_queries):
+        """Test that team channels come from the cached memberships, which are dropped when a user leaves"""
+        team = Team.objects.create(name="Team", hunt=basic_hunt)
+        team.members.add(basic_user)
+        request = rf.get('/')
+        request.user = basic_user
+        cm = PuzzlehuntChannelManager()
+        view_kwargs = {'pk': str(basic_user.pk), 'format-channels': ['user-{pk}'], 'team-channels': True}
+        cm.get_channels_for_request(request, view_kwargs)
+        with django_assert_num_queries(0):
+            assert f'team-{team.pk}' in cm.get_channels_for_request(request, view_kwargs)
+        assert cm.can_read_channel(basic_user, f'team-{team.pk}') is True
+
+        team.members.remove(basic_user)
+        assert cm.get_channels_for_request(request, view_kwargs) == {f'user-{basic_user.pk}'}
+        assert cm.can_read_channel(basic_user, f'team-{team.pk}') is False
+
+
+class TestTeamEvents:
+    """Tests for team wide SSE events"""
+
+    @patch('puzzlehunt.models.send_event')
+    def test_hunt_updates_coalesced(self, mock_send_event, basic_hunt, basic_user, django_capture_on_commit_callbacks):
+        """Test that a team gets one huntUpdate per kind of update in a transaction, whatever its size"""
+        team = Team.objects.create(name="Team", hunt=basic_hunt)
+        team.members.add(basic_user, User.objects.create_user(email="other@example.com", password="testpass123"))
+        puzzles = [Puzzle.objects.create(hunt=basic_hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i,
+                                         id=str(i)) for i in range(1, 11)]
+        mock_send_event.reset_mock()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            statuses = [PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+                        for puzzle in puzzles]
+            statuses[0].mark_solved()
+
+        hunt_updates = [call.args[2] for call in mock_send_event.call_args_list
+                        if call.args[:2] == (f'team-{team.pk}', "huntUpdate")]
+        assert hunt_updates == ["unlock", "solve"]
+        assert not any(call.args[0].startswith('user-') for call in mock_send_event.call_args_list)
+
+    @patch('puzzlehunt.models.send_event')
+    def test_hunt_updates_rolled_back(self, mock_send_event, basic_hunt, django_capture_on_commit_callbacks):
+        """Test that updates scheduled in a transaction that rolls back are never sent, even by the next commit"""
+        team = Team.objects.create(name="Team", hunt=basic_hunt)
+        puzzles = [Puzzle.objects.create(hunt=basic_hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i,
+                                         id=str(i)) for i in range(1, 3)]
+        with django_capture_on_commit_callbacks(execute=True):
+            status = PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+        mock_send_event.reset_mock()
+
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                PuzzleStatus.objects.create(team=team, puzzle=puzzles[1], unlock_time=timezone.now())
+                raise RuntimeError
+        with django_capture_on_commit_callbacks(execute=True):
+            status.mark_solved()
+        hunt_updates = [call.args[2] for call in mock_send_event.call_args_list
+                        if call.args[:2] == (f'team-{team.pk}', "huntUpdate")]
+        assert hunt_updates == ["solve"]
+
 
 class TestBrowserHandler:
     """Tests for BrowserHandler notification handler"""
@@ -461,8 +544,7 @@ class TestEmailHandler:
         with pytest.raises(ValidationError):
             handler.validate_destination('missing@domain')
 
-    @patch('django.core.mail.send_mail')
-    def test_email_handler_sends_notification(self, mock_send_mail, basic_hunt, basic_user):
+    def test_email_handler_sends_notification(self, basic_hunt, basic_user):
         """Test that EmailHandler sends notifications correctly"""
         platform = NotificationPlatform.objects.create(
             type=NotificationPlatform.PlatformType.EMAIL,
@@ -487,14 +569,14 @@ class TestEmailHandler:
             event_types=Event.EventType.PUZZLE_UNLOCK
         )
 
+        mail.outbox = []
         result = handler.send_notification(subscription, event)
 
         assert result is True
-        mock_send_mail.assert_called_once()
-        call_kwargs = mock_send_mail.call_args[1]
-        assert call_kwargs['from_email'] == 'noreply@puzzlehunt.com'
-        assert call_kwargs['recipient_list'] == ['recipient@example.com']
-        assert '[PuzzleSpring]' in call_kwargs['subject']
+        message, = mail.outbox
+        assert message.from_email == 'noreply@puzzlehunt.com'
+        assert message.to == ['recipient@example.com']
+        assert '[PuzzleSpring]' in message.subject
 
 
 class TestWebhookHandler:
@@ -529,6 +611,15 @@ class TestWebhookHandler:
         with pytest.raises(ValidationError):
             WebhookHandler.validate_config({'format': 'invalid'})
 
+    def test_webhook_handler_validate_config_timeout(self):
+        """Test that a webhook timeout must be a positive number of seconds"""
+        from django.forms import ValidationError
+
+        WebhookHandler.validate_config({'format': 'discord', 'timeout': 2.5})
+        for timeout in [0, -1, '5', True]:
+            with pytest.raises(ValidationError):
+                WebhookHandler.validate_config({'format': 'discord', 'timeout': timeout})
+
     def test_webhook_handler_validate_config_telegram_requires_token(self):
         """Test that telegram format requires bot_token"""
         from django.forms import ValidationError
@@ -579,7 +670,7 @@ class TestWebhookHandlerSlackFormat:
         with pytest.raises(ValidationError):
             handler.validate_destination(None)
 
-    @patch('puzzlehunt.notifications.requests.post')
+    @patch('puzzlehunt.webhook_delivery.session.post')
     def test_slack_format_sends_notification(self, mock_post, basic_hunt, basic_user):
         """Test that Slack format sends notifications correctly"""
         mock_post.return_value.raise_for_status = MagicMock()
@@ -645,7 +736,7 @@ class TestWebhookHandlerDiscordFormat:
         with pytest.raises(ValidationError):
             handler.validate_destination('')
 
-    @patch('puzzlehunt.notifications.requests.post')
+    @patch('puzzlehunt.webhook_delivery.session.post')
     def test_discord_format_sends_notification(self, mock_post, basic_hunt, basic_user):
         """Test that Discord format sends notifications correctly"""
         mock_post.return_value.raise_for_status = MagicMock()
@@ -715,7 +806,7 @@ class TestWebhookHandlerTelegramFormat:
         with pytest.raises(ValidationError):
             handler.validate_destination('not-valid')
 
-    @patch('puzzlehunt.notifications.requests.post')
+    @patch('puzzlehunt.webhook_delivery.session.post')
     def test_telegram_format_sends_notification(self, mock_post, basic_hunt, basic_user):
         """Test that Telegram format sends notifications correctly"""
         mock_post.return_value.raise_for_status = MagicMock()
@@ -783,7 +874,7 @@ class TestWebhookHandlerGenericFormat:
         with pytest.raises(ValidationError):
             handler.validate_destination(None)
 
-    @patch('puzzlehunt.notifications.requests.post')
+    @patch('puzzlehunt.webhook_delivery.session.post')
     def test_generic_format_sends_notification(self, mock_post, basic_hunt, basic_user):
         """Test that generic format sends notifications correctly"""
         mock_post.return_value.raise_for_status = MagicMock()
@@ -846,7 +937,7 @@ class TestWebhookHandlerCustomOverrides:
         with pytest.raises(ValidationError):
             handler.validate_destination('https://example.com/webhook')
 
-    @patch('puzzlehunt.notifications.requests.post')
+    @patch('puzzlehunt.webhook_delivery.session.post')
     def test_custom_payload_key_override(self, mock_post, basic_hunt, basic_user):
         """Test that custom payload_key overrides default"""
         mock_post.return_value.raise_for_status = MagicMock()
@@ -900,3 +991,51 @@ class TestHandlerRegistryConsolidated:
         platform_types = set(NotificationPlatform.PlatformType.values)
         handler_types = set(NotificationHandler.handlers.keys())
         assert platform_types == handler_types
+
+
+class TestNotificationRoutes:
+    """Tests for the routing table that notifications are dispatched from"""
+
+    def test_routes_follow_subscriptions(self, basic_hunt, basic_user):
+        """Test that saving a subscription replaces its routes, and inactive subscriptions have none"""
+        platform = NotificationPlatform.objects.create(
+            type=NotificationPlatform.PlatformType.BROWSER, name='Browser', enabled=True)
+        subscription = NotificationSubscription.objects.create(
+            user=basic_user, platform=platform, hunt=basic_hunt,
+            event_types=f"{Event.EventType.PUZZLE_SOLVE},{Event.EventType.PUZZLE_UNLOCK}")
+        assert set(subscription.routes.values_list('event_type', 'hunt', 'user')) == {
+            (Event.EventType.PUZZLE_SOLVE, basic_hunt.pk, basic_user.pk),
+            (Event.EventType.PUZZLE_UNLOCK, basic_hunt.pk, basic_user.pk),
+        }
+
+        subscription.event_types = Event.EventType.HINT_RESPONSE
+        subscription.save()
+        assert list(subscription.routes.values_list('event_type', flat=True)) == [Event.EventType.HINT_RESPONSE]
+
+        subscription.active = False
+        subscription.save()
+        assert not subscription.routes.exists()
+
+    @patch('puzzlehunt.notifications.send_event')
+    def test_dispatch_query_count(self, mock_send_event, basic_hunt, django_assert_max_num_queries):
+        """Test that dispatching an event takes the same queries however many subscriptions match it"""
+        team = Team.objects.create(name='Team', hunt=basic_hunt)
+        other_team = Team.objects.create(name='Other Team', hunt=basic_hunt)
+        puzzle = Puzzle.objects.create(id='TEST01', name='Puzzle', hunt=basic_hunt, order_number=1, answer='ANSWER')
+        users = [User.objects.create_user(email=f'user{i}@example.com', password='testpass') for i in range(5)]
+        # Created after the users, so that they don't get default browser subscriptions
+        platform = NotificationPlatform.objects.create(
+            type=NotificationPlatform.PlatformType.BROWSER, name='Browser', enabled=True)
+        for i, user in enumerate(users):
+            (team if i < 3 else other_team).members.add(user)
+            for hunt in [basic_hunt, None]:
+                NotificationSubscription.objects.create(
+                    user=user, platform=platform, hunt=hunt, event_types=Event.EventType.PUZZLE_UNLOCK)
+        PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+        event = Event.objects.get(type=Event.EventType.PUZZLE_UNLOCK)
+        mock_send_event.reset_mock()
+
+        with django_assert_max_num_queries(2):
+            send_event_notifications.call_local(event.pk)
+        # Each of the team's three members has a hunt and an all hunts subscription
+        assert mock_send_event.call_count == 6
@@ -0,0 +1,132 @@
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import Hunt, Puzzle, Team, PuzzleStatus, Submission, Hint
+from puzzlehunt.progress_matrix import get_progress_matrix, read_progress_cells, load_progress_cells, compare_hunt
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def matrix_hunt(django_capture_on_commit_callbacks):
+    """A hunt created with the matrix running, so its matrix is ready from the start"""
+    with django_capture_on_commit_callbacks(execute=True):
+        hunt = Hunt.objects.create(name="Matrix Hunt", is_current_hunt=True, team_size_limit=4,
+                                   start_date=timezone.now() - timezone.timedelta(hours=1),
+                                   display_start_date=timezone.now() - timezone.timedelta(hours=1),
+                                   end_date=timezone.now() + timezone.timedelta(days=1),
+                                   display_end_date=timezone.now() + timezone.timedelta(days=1))
+        puzzles = [Puzzle.objects.create(hunt=hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i, id=str(i))
+                   for i in range(1, 3)]
+        teams = [Team.objects.create(name=f"Team {i}", hunt=hunt) for i in range(2)]
+    return hunt, puzzles, teams
+
+
+def play(team, puzzle):
+    """Unlock a puzzle, submit a wrong answer, ask for a hint, then solve it"""
+    status = PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+    Submission.objects.create(team=team, puzzle=puzzle, submission_text="WRONG", submission_time=timezone.now())
+    Hint.objects.create(team=team, puzzle=puzzle, request="Help", request_time=timezone.now(),
+                        last_modified_time=timezone.now())
+    status.mark_solved()
+    return status
+
+
+def as_dict(cells):
+    return {(cell.team_id, cell.puzzle_id): cell for cell in cells}
+
+
+def test_matrix_follows_events(matrix_hunt, django_capture_on_commit_callbacks):
+    """Test that the matrix is kept equal to the database as teams make progress"""
+    hunt, puzzles, teams = matrix_hunt
+    assert read_progress_cells(hunt) == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        play(teams[0], puzzles[0])
+        PuzzleStatus.objects.create(team=teams[1], puzzle=puzzles[1], unlock_time=timezone.now())
+
+    cells = as_dict(read_progress_cells(hunt))
+    assert set(cells) == {(teams[0].pk, "1"), (teams[1].pk, "2")}
+    assert cells[(teams[0].pk, "1")].num_submissions == 1
+    assert cells[(teams[0].pk, "1")].num_hints == 1
+    assert cells[(teams[1].pk, "2")].solve_time is None
+    assert compare_hunt(hunt) == []
+
+
+def test_matrix_deletions(matrix_hunt, django_capture_on_commit_callbacks):
+    """Test that deleted statuses and teams leave the matrix, and a reset empties it"""
+    hunt, puzzles, teams = matrix_hunt
+    with django_capture_on_commit_callbacks(execute=True):
+        status = play(teams[0], puzzles[0])
+        play(teams[1], puzzles[1])
+    with django_capture_on_commit_callbacks(execute=True):
+        status.delete()
+        teams[1].delete()
+    assert read_progress_cells(hunt) == []
+    assert compare_hunt(hunt) == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        play(teams[0], puzzles[1])
+        hunt.reset()
+    assert read_progress_cells(hunt) == []
+    assert compare_hunt(hunt) == []
+
+
+def test_unready_matrix_falls_back(client, staff_user, basic_hunt, django_capture_on_commit_callbacks):
+    """Test that a hunt without a rebuilt matrix is served from the database until it is rebuilt"""
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle", answer="ANSWER", order_number=1, id="1")
+    team = Team.objects.create(name="Team", hunt=basic_hunt)
+    get_progress_matrix().reset()
+    with django_capture_on_commit_callbacks(execute=True):
+        play(team, puzzle)
+    assert read_progress_cells(basic_hunt) is None
+
+    client.force_login(staff_user)
+    data = client.get(reverse('puzzlehunt:staff:progress_data', args=[basic_hunt.pk])).json()
+    assert data['data'][0]['puzzles']['1']['num_submissions'] == 1
+
+    call_command("rebuild_progress_matrix", hunt=basic_hunt.pk, stdout=StringIO())
+    assert as_dict(read_progress_cells(basic_hunt)).keys() == as_dict(load_progress_cells(basic_hunt)).keys()
+    assert compare_hunt(basic_hunt) == []
+
+
+def test_matrix_needs_tasks_in_process(settings, monkeypatch, matrix_hunt):
+    """Test that a process local matrix isn't used when unlocks happen in a separate task consumer"""
+    from puzzlehunt import progress_matrix
+    settings.HUEY = {**settings.HUEY, 'immediate': False}
+    monkeypatch.setattr(progress_matrix, '_matrix', None)
+    monkeypatch.setattr(progress_matrix, '_matrix_checked', False)
+    assert get_progress_matrix() is None
+    assert read_progress_cells(matrix_hunt[0]) is None
+
+
+def test_progress_data_reads_matrix(client, staff_user, matrix_hunt, django_capture_on_commit_callbacks):
+    """Test that progress data comes from the matrix when it is ready"""
+    hunt, puzzles, teams = matrix_hunt
+    with django_capture_on_commit_callbacks(execute=True):
+        play(teams[0], puzzles[0])
+    # Change the database behind the matrix's back, the response should still show the matrix
+    Submission.objects.all().delete()
+
+    client.force_login(staff_user)
+    data = client.get(reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])).json()
+    row = next(row for row in data['data'] if row['team']['id'] == teams[0].pk)
+    assert row['puzzles']['1']['num_submissions'] == 1
+
+
+def test_check_progress_matrix(matrix_hunt, django_capture_on_commit_callbacks):
+    """Test that the checker reports drift and repairs it"""
+    hunt, puzzles, teams = matrix_hunt
+    with django_capture_on_commit_callbacks(execute=True):
+        play(teams[0], puzzles[0])
+    Hint.objects.all().delete()
+
+    out = StringIO()
+    call_command("check_progress_matrix", hunt=hunt.pk, stdout=out)
+    assert "Found 1 inconsistent cells" in out.getvalue()
+
+    call_command("check_progress_matrix", hunt=hunt.pk, repair=True, stdout=StringIO())
+    assert compare_hunt(hunt) == []
+    assert as_dict(read_progress_cells(hunt))[(teams[0].pk, "1")].num_hints == 0
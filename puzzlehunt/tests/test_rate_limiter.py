@@ -0,0 +1,95 @@
+import pytest
+from unittest.mock import patch
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Team, PuzzleStatus, Submission
+from puzzlehunt.rate_limiter import parse_rate, check_rate_limit, get_limiter, MemoryTokenBucketLimiter
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def rate_limited(settings):
+    settings.RATELIMIT_ENABLE = True
+    get_limiter().reset()
+    yield
+    get_limiter().reset()
+
+
+def test_parse_rate():
+    """Test parsing rate strings into counts and periods"""
+    assert parse_rate("3/5m") == (3, 300)
+    assert parse_rate("10/m") == (10, 60)
+    assert parse_rate("1/2h") == (1, 7200)
+    assert parse_rate(" 5/d ") == (5, 86400)
+    for rate in ["", "3", "3/", "3/5x", "x/5m", "0/5m", "3/0m"]:
+        with pytest.raises(ValueError):
+            parse_rate(rate)
+
+
+def test_memory_token_bucket():
+    """Test that the token bucket allows a burst and then refills steadily"""
+    limiter = MemoryTokenBucketLimiter()
+    now = [1000.0]
+    with patch("puzzlehunt.rate_limiter.time.monotonic", lambda: now[0]):
+        assert all(limiter.consume("key", 3, 300).allowed for _ in range(3))
+        result = limiter.consume("key", 3, 300)
+        assert not result.allowed
+        assert result.time_left == pytest.approx(100)
+        assert result.seconds_left == 100
+
+        # A token comes back every 100 seconds, not all three at the end of a window
+        now[0] += 60
+        result = limiter.consume("key", 3, 300)
+        assert not result.allowed
+        assert result.time_left == pytest.approx(40)
+        now[0] += 40
+        assert limiter.consume("key", 3, 300).allowed
+        assert not limiter.consume("key", 3, 300).allowed
+
+        # Other keys have their own buckets
+        assert limiter.consume("other", 3, 300).allowed
+
+
+def test_rate_limit_disabled():
+    """Test that nothing is limited when rate limiting is turned off"""
+    assert check_rate_limit("key", (1, 60)) is None
+
+
+def test_submission_rate_overrides(basic_hunt):
+    """Test that the puzzle override beats the hunt override, which beats the default"""
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle 1", answer="ANSWER", order_number=1, id="1")
+    assert puzzle.submission_rate == (3, 300)
+
+    basic_hunt.ratelimit_override = "5/m"
+    basic_hunt.save()
+    puzzle = Puzzle.objects.select_related('hunt').get(pk="1")
+    assert puzzle.submission_rate == (5, 60)
+
+    puzzle.ratelimit_override = "not a rate"
+    puzzle.save()
+    puzzle = Puzzle.objects.select_related('hunt').get(pk="1")
+    assert puzzle.submission_rate == (5, 60)
+
+    puzzle.ratelimit_override = "2/h"
+    puzzle.save()
+    puzzle = Puzzle.objects.select_related('hunt').get(pk="1")
+    assert puzzle.submission_rate == (2, 3600)
+
+
+def test_puzzle_submit_rate_limited(client, basic_hunt, basic_user, rate_limited):
+    """Test that a team is stopped from submitting once its bucket is empty"""
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle 1", answer="ANSWER", order_number=1, id="1",
+                                   ratelimit_override="2/m")
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    team.members.add(basic_user)
+    PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+    client.force_login(basic_user)
+
+    url = reverse('puzzlehunt:puzzle_submit', args=[puzzle.id])
+    for _ in range(2):
+        response = client.post(url, {'answer': 'WRONG'})
+        assert "rate limited" not in response.content.decode()
+    response = client.post(url, {'answer': 'WRONG'})
+    assert "You can submit answers again in 30 seconds" in response.content.decode()
+    assert Submission.objects.filter(team=team).count() == 2
@@ -0,0 +1,107 @@
+import re
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Response, Submission, Team, PuzzleStatus
+from puzzlehunt.response_matcher import ResponseMatcher, get_response_matcher
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def puzzle(basic_hunt):
+    return Puzzle.objects.create(hunt=basic_hunt, name="Puzzle 1", answer="ANSWER", order_number=1, id="1")
+
+
+def sequential_match(responses, text):
+    for resp in responses:
+        if re.match(resp.regex, text, re.IGNORECASE):
+            return resp
+    return None
+
+
+@pytest.mark.parametrize("patterns", [
+    ["close", "clos(e|er)", "^c.*$", "(a(b)?)+c"],
+    ["(?i)inline", "other"],
+    [r"(ab)\1", "abab", "ab"],
+    ["(?P<word>\\w+) (?P=word)", "\\w+"],
+])
+def test_matcher_matches_like_re_match(puzzle, patterns):
+    """Test that the matcher picks the same response as trying each regex in turn"""
+    responses = [Response.objects.create(puzzle=puzzle, regex=p, text=f"Response {i}")
+                 for i, p in enumerate(patterns)]
+    matcher = ResponseMatcher(Response.objects.filter(puzzle=puzzle))
+    texts = ["close", "closer", "CLOSE CALL", "abababc", "abc", "abab", "ab", "inline", "other",
+             "word word", "nothing", ""]
+    for text in texts:
+        assert matcher.match(text) == sequential_match(responses, text)
+
+
+def test_matcher_combines_simple_patterns(puzzle):
+    """Test that ordinary patterns are combined into a single regex"""
+    Response.objects.create(puzzle=puzzle, regex="keep going", text="Almost")
+    Response.objects.create(puzzle=puzzle, regex="(half|part)way", text="Partial")
+    matcher = ResponseMatcher(puzzle.response_set.all())
+    assert matcher.combined is not None
+    assert matcher.match("partway there").text == "Partial"
+
+    Response.objects.create(puzzle=puzzle, regex=r"(ab)\1", text="Repeat")
+    assert ResponseMatcher(puzzle.response_set.all()).combined is None
+
+
+def test_matcher_skips_invalid_patterns(puzzle, caplog):
+    """Test that an invalid regex is logged and skipped rather than breaking every match"""
+    broken = Response.objects.create(puzzle=puzzle, regex="clos(e", text="Broken")
+    close = Response.objects.create(puzzle=puzzle, regex="close", text="Close")
+    matcher = ResponseMatcher(Response.objects.filter(puzzle=puzzle))
+    assert matcher.match("close") == close
+    assert matcher.match("nothing") is None
+    assert f"response {broken.pk}" in caplog.text
+
+
+def test_matcher_cache(puzzle, django_assert_num_queries):
+    """Test that matchers are reused until one of the puzzle's responses changes"""
+    response = Response.objects.create(puzzle=puzzle, regex="close", text="Close!")
+    matcher = get_response_matcher(puzzle)
+    with django_assert_num_queries(0):
+        assert get_response_matcher(puzzle) is matcher
+
+    response.regex = "near"
+    response.save()
+    updated = get_response_matcher(puzzle)
+    assert updated is not matcher
+    assert updated.match("close") is None
+    assert updated.match("near").text == "Close!"
+
+    response.delete()
+    assert get_response_matcher(puzzle).match("near") is None
+
+
+def test_submission_respond(puzzle, basic_hunt):
+    """Test that submissions get the first matching auto response"""
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+    Response.objects.create(puzzle=puzzle, regex="ANSW.*", text="So close")
+
+    submission = Submission(team=team, puzzle=puzzle, submission_text="ANSWE", submission_time=timezone.now())
+    submission.respond()
+    assert submission.response_text == "So close"
+    assert submission.matched_response.text == "So close"
+
+    submission = Submission(team=team, puzzle=puzzle, submission_text="WRONG", submission_time=timezone.now())
+    submission.respond()
+    assert submission.response_text == "Wrong Answer."
+    assert submission.matched_response is None
+
+
+def test_backfill_matched_responses(puzzle, basic_hunt):
+    """Test that the backfill command matches existing submissions with the same matcher"""
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    submission = Submission.objects.create(team=team, puzzle=puzzle, submission_text="ANSWE",
+                                           submission_time=timezone.now())
+    response = Response.objects.create(puzzle=puzzle, regex="ANSW.*", text="So close")
+
+    call_command("backfill_matched_responses", stdout=StringIO())
+    submission.refresh_from_db()
+    assert submission.matched_response == response
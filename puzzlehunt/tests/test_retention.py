@@ -0,0 +1,60 @@
+import gzip
+import json
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django_eventstream import send_event
+from django_eventstream.models import Event as StreamEvent
+from puzzlehunt.models import Puzzle, Team, Submission, Event, User, NotificationPlatform, NotificationSubscription, \
+    NotificationDelivery
+from puzzlehunt.tasks import trim_eventstream_storage
+
+pytestmark = pytest.mark.django_db
+
+
+def test_trim_eventstream_storage(settings):
+    """Test that stored eventstream messages are kept for the retention window and deleted after it"""
+    settings.EVENTSTREAM_RETENTION = 60
+    for i in range(3):
+        send_event("staff", "events", [i])
+    stored = StreamEvent.objects.filter(channel="staff").exclude(eid=0).order_by('eid')
+    StreamEvent.objects.filter(pk=stored[0].pk).update(created=timezone.now() - timedelta(minutes=61))
+
+    trim_eventstream_storage.call_local()
+    assert list(stored.values_list('eid', flat=True)) == [2, 3]
+
+
+def test_archive_events(tmp_path, basic_hunt):
+    """Test that a finished hunt's events are archived to JSONL and can then be deleted"""
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle", answer="ANSWER", order_number=1, id="1")
+    team = Team.objects.create(name="Team", hunt=basic_hunt)
+    for _ in range(3):
+        Submission.objects.create(team=team, puzzle=puzzle, submission_text="WRONG", submission_time=timezone.now())
+    user = User.objects.create_user(email='user@example.com', password='testpass')
+    platform = NotificationPlatform.objects.create(type=NotificationPlatform.PlatformType.WEBHOOK, name='Hook',
+                                                   config={'format': 'generic', 'destination_regex': r'^http://'})
+    subscription = NotificationSubscription.objects.create(user=user, platform=platform, hunt=basic_hunt,
+                                                           destination='http://example.com/hook',
+                                                           event_types=Event.EventType.PUZZLE_SUBMISSION)
+    NotificationDelivery.objects.create(event=Event.objects.filter(hunt=basic_hunt).first(), subscription=subscription,
+                                        status=NotificationDelivery.Status.DEAD)
+
+    with pytest.raises(CommandError):
+        call_command("archive_events", str(tmp_path), hunt=basic_hunt.pk, stdout=StringIO())
+
+    basic_hunt.end_date = timezone.now() - timedelta(minutes=1)
+    basic_hunt.save()
+    call_command("archive_events", str(tmp_path), hunt=basic_hunt.pk, delete=True, stdout=StringIO())
+
+    archive, = tmp_path.glob(f"hunt-{basic_hunt.pk}-events-*.jsonl.gz")
+    with gzip.open(archive, 'rt') as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['type'] for line in lines] == [Event.EventType.PUZZLE_SUBMISSION] * 3
+    assert lines[0]['team_name'] == "Team" and lines[0]['is_correct'] is False
+    assert not Event.objects.filter(hunt=basic_hunt).exists()
+    # Delivery history, such as dead letters, outlives the events it was for
+    delivery = NotificationDelivery.objects.get()
+    assert delivery.event is None and delivery.events == []
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from zoneinfo import ZoneInfo
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Team, PuzzleStatus, Hint, Response, Event, ActivityRollup
+from puzzlehunt.chart_data import compute_chart_data
+from puzzlehunt.tasks import refresh_chart_snapshots
+
+pytestmark = pytest.mark.django_db
+
+
+def add_puzzle(hunt, number):
+    return Puzzle.objects.create(hunt=hunt, name=f"Puzzle {number}", answer="ANSWER", order_number=number,
+                                 id=str(number))
+
+
+@pytest.fixture
+def add_activity(submit):
+    """Have the first team solve the puzzle after a few wrong guesses, and the second ask for a hint"""
+    def add_activity(hunt, puzzle, teams):
+        response = Response.objects.create(puzzle=puzzle, regex="CLOSE", text="Keep going")
+        status = PuzzleStatus.objects.create(team=teams[0], puzzle=puzzle, unlock_time=timezone.now())
+        submit(teams[0], puzzle, "WRONG", count=2)
+        submit(teams[0], puzzle, "OTHER")
+        submit(teams[0], puzzle, "CLOSE", matched_response=response)
+        submit(teams[0], puzzle, "answer")
+        status.mark_solved()
+        PuzzleStatus.objects.create(team=teams[1], puzzle=puzzle, unlock_time=timezone.now())
+        Hint.objects.create(team=teams[1], puzzle=puzzle, request="Help", request_time=timezone.now(),
+                            last_modified_time=timezone.now())
+    return add_activity
+
+
+def test_chart_data(basic_hunt, add_activity):
+    """Test the per puzzle statistics the charts are drawn from"""
+    puzzles = [add_puzzle(basic_hunt, i) for i in range(1, 3)]
+    teams = [Team.objects.create(name=f"Team {i}", hunt=basic_hunt) for i in range(3)]
+    add_activity(basic_hunt, puzzles[0], teams)
+
+    data = compute_chart_data(basic_hunt)
+    first, second = data['stats_puzzles']
+    assert (first['num_unlocks'], first['num_solves'], first['num_submissions'], first['num_hints']) == (2, 1, 5, 1)
+    assert (first['num_custom_response'], first['num_incorrect']) == (1, 3)
+    assert first['first_solve_team'] == "Team 0"
+    assert first['commonly_guessed_answers'] == [{"submission_text": "WRONG", "count": 2},
+                                                 {"submission_text": "OTHER", "count": 1}]
+    assert first['sub_table'] == [(5, 1)]
+    assert second['num_unlocks'] == 0 and second['first_solve_team'] is None and second['sub_table'] == []
+    assert data['chart_solves_data'][0] == {"name": "Puzzle 1", "locked": 1, "unlocked": 1, "solved": 1}
+    assert data['chart_submissions_data'][0] == {"name": "Puzzle 1", "incorrect": 3, "custom_response": 1,
+                                                 "correct": 1}
+
+
+def test_chart_data_query_count(basic_hunt, add_activity):
+    """Test that computing the charts takes the same number of queries however many puzzles there are"""
+    teams = [Team.objects.create(name=f"Team {i}", hunt=basic_hunt) for i in range(2)]
+    add_activity(basic_hunt, add_puzzle(basic_hunt, 1), teams)
+    with CaptureQueriesContext(connection) as few_puzzles:
+        compute_chart_data(basic_hunt)
+
+    for i in range(2, 12):
+        add_activity(basic_hunt, add_puzzle(basic_hunt, i), teams)
+    with CaptureQueriesContext(connection) as many_puzzles:
+        data = compute_chart_data(basic_hunt)
+    assert len(data['stats_puzzles']) == 11
+    assert len(many_puzzles) == len(few_puzzles)
+
+
+def test_charts_snapshot(client, staff_user, basic_hunt, submit):
+    """Test that the charts page is served from a snapshot that the periodic task and ?refresh=1 recompute"""
+    puzzle = add_puzzle(basic_hunt, 1)
+    team = Team.objects.create(name="Team", hunt=basic_hunt)
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:charts', args=[basic_hunt.pk])
+
+    response = client.get(url)
+    assert response.context['stats_puzzles'][0]['num_unlocks'] == 0
+    computed_at = response.context['computed_at']
+
+    PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+    response = client.get(url)
+    assert response.context['stats_puzzles'][0]['num_unlocks'] == 0
+    assert response.context['computed_at'] == computed_at
+
+    refresh_chart_snapshots.call_local()
+    assert client.get(url).context['stats_puzzles'][0]['num_unlocks'] == 1
+
+    submit(team, puzzle, "WRONG")
+    response = client.get(url, {'refresh': 1})
+    assert response.context['stats_puzzles'][0]['num_submissions'] == 1
+    assert response.context['computed_at'] > computed_at
+
+
+def rollup_counts(hunt):
+    return {(rollup.puzzle_id, rollup.type, rollup.bucket_start): rollup.count
+            for rollup in ActivityRollup.objects.filter(hunt=hunt)}
+
+
+def test_rollups_follow_events(basic_hunt, django_capture_on_commit_callbacks, add_activity):
+    """Test that rollups are counted as events are created and match a backfill from scratch"""
+    teams = [Team.objects.create(name=f"Team {i}", hunt=basic_hunt) for i in range(3)]
+    puzzle = add_puzzle(basic_hunt, 1)
+    with django_capture_on_commit_callbacks(execute=True):
+        add_activity(basic_hunt, puzzle, teams)
+
+    totals = {event_type: sum(count for (_, rollup_type, _), count in rollup_counts(basic_hunt).items()
+                              if rollup_type == event_type) for event_type in ActivityRollup.ROLLUP_TYPES}
+    assert totals == {Event.EventType.PUZZLE_SUBMISSION: 5, Event.EventType.PUZZLE_SOLVE: 1,
+                      Event.EventType.PUZZLE_UNLOCK: 2, Event.EventType.HINT_REQUEST: 1}
+
+    incremental = rollup_counts(basic_hunt)
+    call_command("backfill_activity_rollups", hunt=basic_hunt.pk, stdout=StringIO())
+    assert rollup_counts(basic_hunt) == incremental
+
+    basic_hunt.reset()
+    assert not ActivityRollup.objects.filter(hunt=basic_hunt).exists()
+
+
+def test_rollups_counted_after_commit(basic_hunt, django_capture_on_commit_callbacks, submit):
+    """Test that a rollup isn't touched until the event's transaction commits, so its row isn't held locked"""
+    puzzle = add_puzzle(basic_hunt, 1)
+    team = Team.objects.create(name="Team", hunt=basic_hunt)
+    with django_capture_on_commit_callbacks(execute=True):
+        with CaptureQueriesContext(connection) as queries:
+            submit(team, puzzle, "WRONG")
+        assert not any("puzzlehunt_activityrollup" in query['sql'] for query in queries.captured_queries)
+        assert not ActivityRollup.objects.exists()
+    assert ActivityRollup.objects.get().count == 1
+
+
+def test_rollup_series(basic_hunt):
+    """Test that series gather five minute buckets into wider ones on the local clock"""
+    puzzle = add_puzzle(basic_hunt, 1)
+    start = datetime(2030, 1, 1, 10, 0, tzinfo=ZoneInfo("UTC"))
+    basic_hunt.start_date = start - timedelta(hours=1)
+    basic_hunt.end_date = start + timedelta(days=1)
+    for minutes, count in [(0, 1), (10, 2), (20, 3), (45, 4), (60, 5)]:
+        ActivityRollup.objects.create(hunt=basic_hunt, puzzle=puzzle, type=Event.EventType.PUZZLE_SUBMISSION,
+                                      bucket_start=start + timedelta(minutes=minutes), count=count)
+
+    def series(minutes, tz):
+        return ActivityRollup.objects.series(basic_hunt, Event.EventType.PUZZLE_SUBMISSION,
+                                             timedelta(minutes=minutes), ZoneInfo(tz))
+
+    assert [count for _, count in series(5, "UTC")] == [1, 2, 3, 4, 5]
+    assert [count for _, count in series(15, "UTC")] == [3, 3, 4, 5]
+    assert series(60, "UTC") == [(datetime(2030, 1, 1, 10), 10), (datetime(2030, 1, 1, 11), 5)]
+    # Half past the UTC hour is on the hour in India
+    assert series(60, "Asia/Kolkata") == [(datetime(2030, 1, 1, 15), 6), (datetime(2030, 1, 1, 16), 9)]
+
+
+def test_charts_view_buckets(client, staff_user, basic_hunt, django_capture_on_commit_callbacks, submit):
+    """Test that the charts page takes a bucket width and time zone for the over time charts"""
+    puzzle = add_puzzle(basic_hunt, 1)
+    with django_capture_on_commit_callbacks(execute=True):
+        submit(Team.objects.create(name="Team", hunt=basic_hunt), puzzle, "WRONG")
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:charts', args=[basic_hunt.pk])
+
+    response = client.get(url, {'bucket': 15, 'tz': 'Asia/Kolkata'})
+    assert response.context['bucket'] == 15
+    assert [point['amount'] for point in response.context['chart_submissions_by_time_data']] == [1]
+    assert client.get(url, {'bucket': 7}).status_code == 400
+    assert client.get(url, {'tz': 'Not/AZone'}).status_code == 400
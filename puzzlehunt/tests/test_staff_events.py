@@ -0,0 +1,80 @@
+import threading
+import time
+from unittest.mock import patch
+import pytest
+from django.db import transaction
+from puzzlehunt.models import Puzzle, Team, Event
+from puzzlehunt.staff_events import staff_event_buffer
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def staff_events():
+    """Capture the messages published to the staff channel"""
+    with patch('puzzlehunt.staff_events.send_event') as mock_send_event:
+        yield mock_send_event
+        staff_event_buffer.flush()
+
+
+@pytest.fixture
+def team_and_puzzle(basic_hunt):
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle", answer="ANSWER", order_number=1, id="1")
+    return Team.objects.create(name="Team", hunt=basic_hunt), puzzle
+
+
+def test_staff_events_sent_on_commit(staff_events, team_and_puzzle, django_capture_on_commit_callbacks, submit):
+    """Test that staff events are only published once their transaction commits, and not on rollback"""
+    team, puzzle = team_and_puzzle
+    with django_capture_on_commit_callbacks(execute=True):
+        submit(team, puzzle, count=2)
+        try:
+            with transaction.atomic():
+                submit(team, puzzle)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert not staff_events.called
+
+    assert {call.args[:2] for call in staff_events.call_args_list} == {("staff", "events")}
+    published = [event for call in staff_events.call_args_list for event in call.args[2]]
+    assert published == [{"type": Event.EventType.PUZZLE_SUBMISSION, "team_id": team.pk, "puzzle_id": "1"}] * 2
+
+
+def test_staff_events_batched(staff_events, team_and_puzzle, settings, django_capture_on_commit_callbacks, submit):
+    """Test that a full batch wakes the flusher rather than waiting out the interval or holding up the request"""
+    settings.STAFF_EVENT_BATCH_SIZE = 3
+    settings.STAFF_EVENT_BATCH_INTERVAL = 60 * 1000
+    team, puzzle = team_and_puzzle
+    publishers = []
+    staff_events.side_effect = lambda *args: publishers.append(threading.current_thread())
+    with django_capture_on_commit_callbacks(execute=True):
+        submit(team, puzzle, count=2)
+    assert not staff_events.called
+
+    with django_capture_on_commit_callbacks(execute=True):
+        submit(team, puzzle)
+    deadline = time.monotonic() + 5
+    while not staff_events.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [len(call.args[2]) for call in staff_events.call_args_list] == [3]
+    assert publishers[0] is not threading.current_thread()
+
+
+def test_partial_batches_share_one_flusher(staff_events, team_and_puzzle, settings, django_capture_on_commit_callbacks,
+                                           submit):
+    """Test that partial batches are all published by one flusher thread, which recycles its connections"""
+    settings.STAFF_EVENT_BATCH_INTERVAL = 50
+    team, puzzle = team_and_puzzle
+    publishers = []
+    staff_events.side_effect = lambda *args: publishers.append(threading.current_thread())
+    with patch('puzzlehunt.staff_events.close_old_connections') as close_old_connections:
+        for published in range(1, 3):
+            with django_capture_on_commit_callbacks(execute=True):
+                submit(team, puzzle)
+            deadline = time.monotonic() + 5
+            while close_old_connections.call_count < published and time.monotonic() < deadline:
+                time.sleep(0.01)
+    assert staff_events.call_count == 2
+    assert len(set(publishers)) == 1 and publishers[0] is not threading.current_thread()
+    assert close_old_connections.called
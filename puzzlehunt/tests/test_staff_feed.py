@@ -0,0 +1,72 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Team, Submission, Event
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def feed_hunt(basic_hunt):
+    puzzle = Puzzle.objects.create(hunt=basic_hunt, name="Puzzle", answer="ANSWER", order_number=1, id="1")
+    team = Team.objects.create(name="Team", hunt=basic_hunt)
+    return basic_hunt, puzzle, team
+
+
+def test_events_store_display_fields(feed_hunt, submit):
+    """Test that submission events carry correctness and names, so they display without lookups"""
+    hunt, puzzle, team = feed_hunt
+    submit(team, puzzle, "answer")
+    submit(team, puzzle)
+    correct, wrong = Event.objects.filter(type=Event.EventType.PUZZLE_SUBMISSION).order_by('pk')
+    assert (correct.is_correct, wrong.is_correct) == (True, False)
+    assert (correct.team_name, correct.puzzle_name) == ("Team", "Puzzle")
+
+    Submission.objects.all().delete()
+    event = Event.objects.get(pk=correct.pk)
+    assert (event.icon, event.color) == ("fa-check", "#a3d7a3")
+    assert "<b>Team</b> submitted <b>answer</b> to <b>Puzzle</b>." == event.web_text
+
+
+def test_feed_query_count(client, staff_user, feed_hunt, submit):
+    """Test that a feed page takes the same number of queries however many events are on it"""
+    hunt, puzzle, team = feed_hunt
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:feed', args=[hunt.pk])
+    submit(team, puzzle, count=2)
+    client.get(url)  # Warm up the site settings caches
+
+    with CaptureQueriesContext(connection) as few_events:
+        client.get(url, {'numItems': 50})
+    submit(team, puzzle, count=30)
+    with CaptureQueriesContext(connection) as many_events:
+        response = client.get(url, {'numItems': 50})
+    assert len(response.context['feed_items']) == 32
+    assert len(many_events) == len(few_events)
+
+
+def test_feed_keyset_paging(client, staff_user, feed_hunt, submit):
+    """Test paging back and forth through the feed by cursor, including events with the same timestamp"""
+    hunt, puzzle, team = feed_hunt
+    submit(team, puzzle, count=24)
+    Event.objects.filter(pk__in=Event.objects.order_by('pk').values('pk')[5:15]).update(timestamp=timezone.now())
+    expected = list(Event.objects.filter(hunt=hunt).order_by('-timestamp', '-pk').values_list('pk', flat=True))
+    assert len(expected) == 24
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:feed', args=[hunt.pk])
+
+    pages = []
+    response = client.get(url, {'numItems': 10})
+    while True:
+        pages.append([event.pk for event in response.context['feed_items']])
+        if response.context['older_cursor'] is None:
+            break
+        response = client.get(url, {'numItems': 10, 'before': response.context['older_cursor']})
+    assert [len(page) for page in pages] == [10, 10, 4]
+    assert sum(pages, []) == expected
+
+    response = client.get(url, {'numItems': 10, 'after': response.context['newer_cursor']})
+    assert [event.pk for event in response.context['feed_items']] == pages[1]
+    assert client.get(url, {'before': 'nonsense'}).status_code == 400
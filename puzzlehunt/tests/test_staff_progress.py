@@ -0,0 +1,135 @@
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Team, PuzzleStatus, Submission, Event
+from puzzlehunt.progress_encoding import msgpack
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def progress_hunt(basic_hunt):
+    puzzles = [Puzzle.objects.create(hunt=basic_hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i, id=str(i))
+               for i in range(1, 4)]
+    teams = [Team.objects.create(name=f"Team {i}", hunt=basic_hunt) for i in range(3)]
+    for team in teams:
+        PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+    return basic_hunt, puzzles, teams
+
+
+def test_progress_data_full(client, staff_user, progress_hunt):
+    """Test that a full load has every team and every unlocked cell"""
+    hunt, puzzles, teams = progress_hunt
+    client.force_login(staff_user)
+    data = client.get(reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])).json()
+    assert {row['team']['id'] for row in data['data']} == {team.pk for team in teams}
+    assert all(set(row['puzzles']) == {"1"} for row in data['data'])
+    assert data['metadata']['cursor'] == Event.objects.order_by('-pk').first().pk
+    assert not data['metadata']['delta']
+
+
+def test_progress_data_delta(client, staff_user, progress_hunt):
+    """Test that a delta only has the cells changed since the cursor, plus the current team order"""
+    hunt, puzzles, teams = progress_hunt
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])
+    cursor = client.get(url).json()['metadata']['cursor']
+    # Only events after the cursor should count, so push the existing ones out of the overlap window
+    Event.objects.update(timestamp=timezone.now() - timezone.timedelta(hours=1))
+
+    data = client.get(url, {'since': cursor}).json()
+    assert data['data'] == []
+    assert data['metadata']['delta']
+    assert sorted(data['order']) == sorted(team.pk for team in teams)
+
+    status = PuzzleStatus.objects.create(team=teams[1], puzzle=puzzles[1], unlock_time=timezone.now())
+    Submission.objects.create(team=teams[1], puzzle=puzzles[1], submission_text="WRONG",
+                              submission_time=timezone.now())
+    Event.objects.create_event(Event.EventType.PUZZLE_SUBMISSION, Submission.objects.get(team=teams[1]), user=None)
+    status.mark_solved()
+
+    data = client.get(url, {'since': cursor}).json()
+    assert len(data['data']) == 1
+    row = data['data'][0]
+    assert row['team']['id'] == teams[1].pk
+    assert set(row['puzzles']) == {"2"}
+    assert row['puzzles']["2"]['num_submissions'] == 1
+    assert row['puzzles']["2"]['solve_time'] is not None
+    assert data['metadata']['cursor'] > cursor
+
+
+def test_progress_data_invalid_cursor(client, staff_user, progress_hunt):
+    """Test that a malformed cursor is rejected"""
+    hunt, puzzles, teams = progress_hunt
+    client.force_login(staff_user)
+    response = client.get(reverse('puzzlehunt:staff:progress_data', args=[hunt.pk]), {'since': 'x'})
+    assert response.status_code == 400
+
+
+def decode_columnar(data):
+    """Turn a columnar response back into {team ID: {puzzle ID: cell}} with times as offsets"""
+    teams = data['teams']['id']
+    cells = data['cells']
+    decoded = {team_id: {} for team_id in teams}
+    for i, (team, puzzle) in enumerate(zip(cells['team'], cells['puzzle'])):
+        decoded[teams[team]][data['puzzles'][puzzle]] = {
+            field: cells[field][i]
+            for field in ['unlock_time', 'solve_time', 'last_submission', 'num_submissions', 'num_hints']}
+    return decoded
+
+
+def test_progress_data_columnar(client, staff_user, progress_hunt):
+    """Test that the columnar format holds the same cells as the row format"""
+    hunt, puzzles, teams = progress_hunt
+    PuzzleStatus.objects.get(team=teams[0], puzzle=puzzles[0]).mark_solved()
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])
+
+    rows = client.get(url).json()
+    response = client.get(url, {'format': 'columnar'})
+    assert response['Content-Type'] == 'application/json'
+    columnar = decode_columnar(response.json())
+
+    start = hunt.start_date
+    for row in rows['data']:
+        for puzzle_id, cell in row['puzzles'].items():
+            compact = columnar[row['team']['id']][puzzle_id]
+            for field in ['unlock_time', 'solve_time', 'last_submission']:
+                if cell[field] is None:
+                    assert compact[field] is None
+                else:
+                    expected = int((timezone.datetime.fromisoformat(cell[field]) - start).total_seconds())
+                    assert compact[field] == expected
+            assert compact['num_submissions'] == cell['num_submissions']
+            assert compact['num_hints'] == cell['num_hints']
+    assert sum(len(cells) for cells in columnar.values()) == sum(len(row['puzzles']) for row in rows['data'])
+
+
+def test_progress_data_etag(client, staff_user, progress_hunt):
+    """Test that unchanged compact responses are answered with a 304"""
+    hunt, puzzles, teams = progress_hunt
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])
+
+    response = client.get(url, {'format': 'columnar'})
+    etag = response['ETag']
+    assert client.get(url, {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    PuzzleStatus.objects.get(team=teams[0], puzzle=puzzles[0]).mark_solved()
+    response = client.get(url, {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+def test_progress_data_msgpack(client, staff_user, progress_hunt):
+    """Test that msgpack is served when available and refused otherwise"""
+    hunt, puzzles, teams = progress_hunt
+    client.force_login(staff_user)
+    url = reverse('puzzlehunt:staff:progress_data', args=[hunt.pk])
+    response = client.get(url, {'format': 'msgpack'})
+    if msgpack is None:
+        assert response.status_code == 406
+    else:
+        assert response['Content-Type'] == 'application/msgpack'
+        assert decode_columnar(msgpack.unpackb(response.content)) == \
+            decode_columnar(client.get(url, {'format': 'columnar'}).json())
@@ -0,0 +1,89 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.template import Template, Context
+from django.test import RequestFactory
+from puzzlehunt.models import Team, User
+from puzzlehunt.team_membership import get_user_team, get_current_hunt, TeamMembershipMiddleware
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def team(basic_hunt, basic_user):
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    team.members.add(basic_user)
+    return team
+
+
+def in_request(func):
+    """Run func inside the team membership middleware, as if it were a view"""
+    return TeamMembershipMiddleware(lambda request: func())(RequestFactory().get("/"))
+
+
+def test_team_from_user(basic_hunt, basic_user, team):
+    """Test that team lookups find the user's team, or None without one"""
+    assert basic_hunt.team_from_user(basic_user) == team
+    assert basic_hunt.team_from_user(AnonymousUser()) is None
+    other = User.objects.create_user(email="other@example.com", password="password")
+    assert basic_hunt.team_from_user(other) is None
+
+
+def test_membership_shared_cache(basic_hunt, basic_user, team, django_assert_num_queries):
+    """Test that cached memberships skip the membership join"""
+    get_user_team(basic_hunt, basic_user)
+    with django_assert_num_queries(1):
+        assert get_user_team(basic_hunt, basic_user) == team
+
+    other = User.objects.create_user(email="other@example.com", password="password")
+    get_user_team(basic_hunt, other)
+    with django_assert_num_queries(0):
+        assert get_user_team(basic_hunt, other) is None
+
+
+def test_membership_request_memo(basic_hunt, basic_user, team, django_assert_num_queries):
+    """Test that repeated lookups within a request only hit the database once"""
+    def view():
+        with django_assert_num_queries(2):
+            for _ in range(3):
+                assert basic_hunt.team_from_user(basic_user) == team
+                assert basic_hunt.check_access(basic_user)
+                assert get_current_hunt() == basic_hunt
+    in_request(view)
+
+
+def test_membership_invalidation(basic_hunt, basic_user, team):
+    """Test that joining, leaving and deleting teams update cached memberships"""
+    other = User.objects.create_user(email="other@example.com", password="password")
+    assert get_user_team(basic_hunt, other) is None
+    team.members.add(other)
+    assert get_user_team(basic_hunt, other) == team
+
+    team.members.remove(basic_user)
+    assert get_user_team(basic_hunt, basic_user) is None
+
+    new_team = Team.objects.create(name="New Team", hunt=basic_hunt)
+    new_team.members.add(basic_user)
+    assert get_user_team(basic_hunt, basic_user) == new_team
+    basic_user.team_set.clear()
+    assert get_user_team(basic_hunt, basic_user) is None
+
+    team.delete()
+    assert get_user_team(basic_hunt, other) is None
+
+
+def test_membership_invalidation_within_request(basic_hunt, basic_user, team):
+    """Test that membership changes made during a request are seen by the rest of the request"""
+    def view():
+        assert basic_hunt.team_from_user(basic_user) == team
+        team.members.remove(basic_user)
+        assert basic_hunt.team_from_user(basic_user) is None
+    in_request(view)
+
+
+def test_current_team_tag(basic_hunt, basic_user, team):
+    """Test that the current team template tag uses the shared lookup"""
+    request = RequestFactory().get("/")
+    request.user = basic_user
+    context = Context({'request': request})
+    Template("{% load hunt_tags %}{% set_curr_team %}").render(context)
+    assert context['current_hunt_team'] == team
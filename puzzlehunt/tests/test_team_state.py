@@ -0,0 +1,88 @@
+import pytest
+from django.db import transaction
+from django.utils import timezone
+from puzzlehunt.models import Puzzle, Team, PuzzleStatus
+from puzzlehunt.team_state import get_team_state
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def team(basic_hunt, basic_user):
+    team = Team.objects.create(name="Test Team", hunt=basic_hunt)
+    team.members.add(basic_user)
+    return team
+
+
+@pytest.fixture
+def puzzles(basic_hunt):
+    return [Puzzle.objects.create(hunt=basic_hunt, name=f"Puzzle {i}", answer="ANSWER", order_number=i, id=str(i))
+            for i in range(1, 4)]
+
+
+def test_team_state(team, puzzles, django_assert_num_queries, django_capture_on_commit_callbacks):
+    """Test that the snapshot tracks unlocks and solves and is reused until one happens"""
+    state = get_team_state(team)
+    assert state.unlocked == frozenset() and state.solved == frozenset()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        status = PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+    state = get_team_state(team)
+    assert state.is_unlocked("1") and not state.is_solved("1")
+    with django_assert_num_queries(0):
+        assert get_team_state(team) == state
+
+    status.mark_solved()
+    updated = get_team_state(team)
+    assert updated.version > state.version
+    assert updated.is_solved("1")
+
+    status.delete()
+    assert not get_team_state(team).is_unlocked("1")
+
+
+def test_team_state_bulk_unlocks(basic_hunt, team, puzzles):
+    """Test that statuses created by the bulk unlock path also bump the version"""
+    basic_hunt.config = "P1 <= 0 POINTS\nP2 <= P1"
+    basic_hunt.save()
+    assert get_team_state(team).unlocked == frozenset()
+    team.process_unlocks()
+    assert get_team_state(team).unlocked == {"1"}
+
+
+def test_puzzle_check_access(team, puzzles, basic_user, django_assert_num_queries,
+                             django_capture_on_commit_callbacks):
+    """Test that puzzle access checks come from the snapshot"""
+    status = PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+    puzzle = Puzzle.objects.select_related('hunt').get(pk="1")
+    assert puzzle.check_access(basic_user)
+    assert not puzzle.check_access(basic_user, solution=True)
+    assert not puzzles[1].check_access(basic_user)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        status.mark_solved()
+    assert puzzle.check_access(basic_user, solution=True)
+    # Only the team itself is loaded, from its cached ID
+    with django_assert_num_queries(1):
+        assert puzzle.check_access(basic_user, solution=True)
+
+
+def test_team_state_rollback(team, puzzles):
+    """Test that a snapshot built inside a transaction that is rolled back is never served"""
+    assert get_team_state(team).unlocked == frozenset()
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            PuzzleStatus.objects.create(team=team, puzzle=puzzles[0], unlock_time=timezone.now())
+            assert get_team_state(team).is_unlocked("1")
+            raise RuntimeError
+    assert get_team_state(team).unlocked == frozenset()
+
+
+def test_team_state_separate_consumer(settings, team, puzzles, django_assert_num_queries):
+    """Test that a process local cache isn't trusted when tasks run in another process"""
+    settings.HUEY = {**settings.HUEY, 'immediate': False}
+    get_team_state(team)
+    # Unlocked by a task consumer, whose cache this process can't see
+    PuzzleStatus.objects.bulk_create([PuzzleStatus(team=team, puzzle=puzzles[0], unlock_time=timezone.now())])
+    with django_assert_num_queries(1):
+        assert get_team_state(team).is_unlocked("1")
@@ -0,0 +1,227 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from puzzlehunt.models import NotificationPlatform, NotificationSubscription, NotificationDelivery, Event, Team, \
+    Puzzle, PuzzleStatus, User
+from django.core.exceptions import ValidationError
+from puzzlehunt.notifications import send_event_notifications, retry_notification_delivery, \
+    flush_notification_digest, DEAD_LETTER_THRESHOLD
+from puzzlehunt import webhook_delivery
+
+pytestmark = pytest.mark.django_db
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    A stand-in webhook host that records what it receives. Paths starting /slow are slow to answer, and
+    statuses queued in responses for a path are returned before it goes back to answering 204.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), WebhookRequestHandler)
+        self.received = []
+        self.client_ports = []
+        self.responses = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path.startswith('/slow'):
+            time.sleep(1)
+        self.server.client_ports.append(self.client_address[1])
+        queued = self.server.responses.get(self.path)
+        status = queued.pop(0) if queued else 204
+        if status == 204:
+            self.server.received.append((self.path, body))
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '120')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook_server():
+    server = WebhookServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def hunt_team(basic_hunt):
+    team = Team.objects.create(name='Team', hunt=basic_hunt)
+    return basic_hunt, team
+
+
+def subscribe(hunt, team, urls, **config):
+    """Subscribe a new team member to the team's unlocks at each URL"""
+    platform = NotificationPlatform.objects.create(
+        type=NotificationPlatform.PlatformType.WEBHOOK, name='Local', enabled=True,
+        config={'format': 'generic', 'destination_regex': r'^http://', **config})
+    subscriptions = []
+    for i, url in enumerate(urls):
+        user = User.objects.create_user(email=f'user{i}@example.com', password='testpass')
+        team.members.add(user)
+        subscriptions.append(NotificationSubscription.objects.create(
+            user=user, platform=platform, hunt=hunt, destination=url, event_types=Event.EventType.PUZZLE_UNLOCK))
+    return subscriptions
+
+
+def unlock(hunt, team, number=1):
+    """Unlock a new puzzle for the team, returning the unlock event"""
+    puzzle = Puzzle.objects.create(id=f'TEST{number:02}', name=f'Puzzle {number}', hunt=hunt,
+                                   order_number=number, answer='ANSWER')
+    PuzzleStatus.objects.create(team=team, puzzle=puzzle, unlock_time=timezone.now())
+    return Event.objects.get(type=Event.EventType.PUZZLE_UNLOCK, puzzle=puzzle)
+
+
+def test_connections_reused(webhook_server):
+    """Test that webhooks sent to the same host reuse one connection"""
+    for i in range(3):
+        webhook_delivery.post(f"{webhook_server.url}/hook", {"n": i})
+    assert [body["n"] for _, body in webhook_server.received] == [0, 1, 2]
+    assert len(set(webhook_server.client_ports)) == 1
+
+
+def test_slow_destination_doesnt_hold_up_others(webhook_server, hunt_team):
+    """Test that webhooks for an event are sent concurrently, and a destination that times out only fails itself"""
+    hunt, team = hunt_team
+    paths = ['/slow', '/fast/1', '/fast/2', '/fast/3']
+    subscribe(hunt, team, [webhook_server.url + path for path in paths], timeout=0.3)
+    event = unlock(hunt, team)
+
+    start = time.perf_counter()
+    send_event_notifications.call_local(event.pk)
+    elapsed = time.perf_counter() - start
+
+    assert sorted(path for path, _ in webhook_server.received) == ['/fast/1', '/fast/2', '/fast/3']
+    assert all(body["notification_text"] == "Your team has unlocked Puzzle 1." for _, body in webhook_server.received)
+    # The slow destination is given up on after its timeout rather than waited for
+    assert elapsed < 0.9
+    assert NotificationDelivery.objects.filter(status=NotificationDelivery.Status.SENT).count() == 3
+    assert NotificationDelivery.objects.get(status=NotificationDelivery.Status.PENDING).attempts == 1
+
+
+def test_retry_honors_retry_after(webhook_server, hunt_team):
+    """Test that a rate limited webhook is retried no sooner than the destination asked, and then delivered"""
+    hunt, team = hunt_team
+    webhook_server.responses['/hook'] = [429]
+    subscribe(hunt, team, [webhook_server.url + '/hook'])
+    send_event_notifications.call_local(unlock(hunt, team).pk)
+
+    delivery = NotificationDelivery.objects.get()
+    assert (delivery.status, delivery.attempts, delivery.last_error) == (NotificationDelivery.Status.PENDING, 1,
+                                                                         "HTTP 429")
+    assert delivery.next_attempt_time >= timezone.now() + timedelta(seconds=115)
+
+    retry_notification_delivery.call_local(delivery.pk)
+    delivery.refresh_from_db()
+    assert (delivery.status, delivery.attempts) == (NotificationDelivery.Status.SENT, 2)
+    assert len(webhook_server.received) == 1
+
+
+def test_destination_rate_limit(webhook_server, hunt_team):
+    """Test that webhooks over a destination's rate are put off without counting as an attempt"""
+    hunt, team = hunt_team
+    subscribe(hunt, team, [webhook_server.url + '/hook'], rate="1/1m")
+    for number in range(1, 3):
+        send_event_notifications.call_local(unlock(hunt, team, number).pk)
+
+    sent, deferred = NotificationDelivery.objects.order_by('pk')
+    assert sent.status == NotificationDelivery.Status.SENT
+    assert (deferred.status, deferred.attempts) == (NotificationDelivery.Status.PENDING, 0)
+    assert deferred.next_attempt_time > timezone.now() + timedelta(seconds=55)
+    assert len(webhook_server.received) == 1
+
+
+def test_dead_letters(webhook_server, hunt_team):
+    """Test that permanently failing webhooks become dead letters and their subscription is parked"""
+    hunt, team = hunt_team
+    webhook_server.responses['/gone'] = [404] * DEAD_LETTER_THRESHOLD
+    subscription, = subscribe(hunt, team, [webhook_server.url + '/gone'])
+    for number in range(1, DEAD_LETTER_THRESHOLD + 1):
+        send_event_notifications.call_local(unlock(hunt, team, number).pk)
+
+    assert list(NotificationDelivery.objects.values_list('status', 'attempts').distinct()) == [
+        (NotificationDelivery.Status.DEAD, 1)]
+    subscription.refresh_from_db()
+    assert not subscription.active and not subscription.routes.exists()
+
+
+def test_dead_letters_park_invalid_destinations(webhook_server, hunt_team):
+    """Test that a failing subscription is parked even if its destination no longer passes validation"""
+    hunt, team = hunt_team
+    webhook_server.responses['/gone'] = [404] * DEAD_LETTER_THRESHOLD
+    subscription, = subscribe(hunt, team, [webhook_server.url + '/gone'])
+    subscription.platform.config['destination_regex'] = r'^https://'
+    subscription.platform.save()
+    for number in range(1, DEAD_LETTER_THRESHOLD + 1):
+        send_event_notifications.call_local(unlock(hunt, team, number).pk)
+
+    subscription.refresh_from_db()
+    assert not subscription.active and not subscription.routes.exists()
+
+
+def test_delivery_admin_stats(client, webhook_server, hunt_team):
+    """Test that the delivery admin shows counts by platform and status"""
+    hunt, team = hunt_team
+    webhook_server.responses['/gone'] = [404]
+    subscribe(hunt, team, [webhook_server.url + '/hook', webhook_server.url + '/gone'])
+    send_event_notifications.call_local(unlock(hunt, team).pk)
+
+    client.force_login(User.objects.create_superuser(email='admin@example.com', password='testpass'))
+    response = client.get(reverse('admin:puzzlehunt_notificationdelivery_changelist'))
+    assert response.status_code == 200
+    assert response.context['delivery_stats'] == [('Local', [0, 1, 1])]
+
+
+def test_digest_window(webhook_server, hunt_team):
+    """Test that events in a subscription's digest window are sent together as one webhook once it closes"""
+    hunt, team = hunt_team
+    subscription, = subscribe(hunt, team, [webhook_server.url + '/hook'])
+    subscription.digest_window = 10
+    subscription.save()
+    events = [unlock(hunt, team, number) for number in range(1, 4)]
+    for event in events:
+        send_event_notifications.call_local(event.pk)
+    assert webhook_server.received == []
+
+    flush_notification_digest.call_local(subscription.pk)
+    (_, body), = webhook_server.received
+    assert [entry["notification_text"] for entry in body["events"]] == [
+        f"Your team has unlocked Puzzle {number}." for number in range(1, 4)]
+    delivery = NotificationDelivery.objects.get()
+    assert delivery.status == NotificationDelivery.Status.SENT
+    assert delivery.digest_event_ids == [event.pk for event in events]
+
+    # The digest was emptied when it was sent
+    flush_notification_digest.call_local(subscription.pk)
+    assert len(webhook_server.received) == 1
+
+
+def test_digest_window_range(hunt_team):
+    """Test that digest windows outside the allowed range are rejected"""
+    hunt, team = hunt_team
+    subscription, = subscribe(hunt, team, ['http://example.com/hook'])
+    subscription.digest_window = 3
+    with pytest.raises(ValidationError):
+        subscription.clean()
@@ -47,6 +47,7 @@ urlpatterns = [
     path('hunt/<str:pk>/view/<path:file_path>', hunt_views.protected_static,
          {"base": "hunt", "add_prefix": True}, name='protected_static_hunt'),
     path('hunt/<hunt:hunt>/leaderboard/', hunt_views.hunt_leaderboard, name='hunt_leaderboard'),
+    path('hunt/<hunt:hunt>/leaderboard/data/', hunt_views.hunt_leaderboard_data, name='hunt_leaderboard_data'),
     path('hunt/<hunt:hunt>/updates/', hunt_views.hunt_updates, name='hunt_updates'),
     path('hunt/<hunt:hunt>/prepuzzle/', hunt_views.hunt_prepuzzle, name='hunt_prepuzzle'),
     path('hunt/<hunt:hunt>/info/', hunt_views.hunt_info, name='hunt_info'),
@@ -59,7 +60,9 @@ urlpatterns = [
     path('prepuzzle/<int:pk>/check/', hunt_views.prepuzzle_check, name='prepuzzle_check'),
 
     # SSE Endpoints
-    path('sse/user/<str:pk>/', events, {'format-channels': ['user-{pk}']}, name='user_events'),
+    path('sse/user/<str:pk>/', events, {'format-channels': ['user-{pk}'], 'team-channels': True},
+         name='user_events'),
+    path('sse/team/<str:pk>/', events, {'format-channels': ['team-{pk}']}, name='team_events'),
     path('sse/staff/', events, {'channels': ['staff']}, name='staff_events'),
 
 
@@ -17,9 +17,23 @@ from django_eventstream.channelmanager import DefaultChannelManager
 from .models import PuzzleFile, SolutionFile, HuntFile, PrepuzzleFile, Puzzle, Hunt, Prepuzzle, Team, TeamRankingRule, \
     CannedHint, Response, Hint, Update, PuzzleStatus, Submission, User
 from django.core.files.storage import default_storage
+from .team_membership import get_current_hunt, get_user_team, get_user_team_ids
 
 
 class PuzzlehuntChannelManager(DefaultChannelManager):
+    # django_eventstream refuses connections to more than 10 channels, leave room for the user channel
+    MAX_TEAM_CHANNELS = 9
+
+    def get_channels_for_request(self, request, view_kwargs):
+        channels = super().get_channels_for_request(request, view_kwargs)
+        # Streams marked with team-channels also carry the channels of the requesting user's teams,
+        # so that pages get team wide updates without opening a second connection
+        user = getattr(request, 'user', None)
+        if view_kwargs.get('team-channels') and user is not None and user.is_authenticated:
+            team_ids = get_user_team_ids(user)[:self.MAX_TEAM_CHANNELS]
+            channels.update(f"team-{team_id}" for team_id in team_ids)
+        return channels
+
     def can_read_channel(self, user, channel):
         # require auth for all channels
         if user is None:
@@ -35,6 +49,14 @@ class PuzzlehuntChannelManager(DefaultChannelManager):
             except (ValueError, IndexError):
                 return False
 
+        if channel.startswith('team-'):
+            try:
+                team_id = int(channel.split("-", 1)[1])
+            except (ValueError, IndexError):
+                return False
+            team = Team.objects.select_related('hunt').filter(pk=team_id).first()
+            return team is not None and get_user_team(team.hunt, user) == team
+
         # Default access is false
         return False
 
@@ -113,7 +135,7 @@ class HuntConverter:
 
     def to_python(self, value):
         if value == "current":
-            return Hunt.objects.get(is_current_hunt=True)
+            return get_current_hunt()
         else:
             return get_object_or_404(Hunt, id=int(value))
 
@@ -131,7 +153,7 @@ class FallbackHuntConverter(HuntConverter):
         try:
             return super().to_python(value)
         except Http404:
-            return Hunt.objects.get(is_current_hunt=True)
+            return get_current_hunt()
 
 def create_hunt_export_zip(hunt, zip_path, include_activity=False):
     """
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .rate_limiter import parse_rate
+
+logger = logging.getLogger(__name__)
+
+# Number of webhooks sent at once, which is also the number of connections kept open to each host
+MAX_CONCURRENT_DELIVERIES = 8
+# Number of hosts whose connections are kept open
+POOLED_HOSTS = 32
+# Seconds to wait for a connection to a webhook host, separate from the platform's overall timeout
+CONNECT_TIMEOUT = 3
+# Seconds to wait for a webhook host to respond, unless its platform config sets a timeout
+DEFAULT_TIMEOUT = 10
+# Webhooks sent to each destination, unless its platform config sets a rate. Discord allows 5 every 2 seconds.
+DEFAULT_RATE = "5/2s"
+# Error statuses that are worth retrying, any other 4xx means the destination is gone or refuses the webhook
+RETRY_STATUSES = {408, 425, 429}
+
+
+class DeliveryError(Exception):
+    """ A webhook that wasn't delivered, saying whether it is worth retrying and how long the host asked us to wait """
+
+    def __init__(self, message, retry_after=None, permanent=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOLED_HOSTS, pool_maxsize=MAX_CONCURRENT_DELIVERIES)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared by every webhook sent from this process, so connections and TLS sessions to each host are reused
+session = _make_session()
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DELIVERIES, thread_name_prefix='webhook')
+
+
+def _retry_after(response):
+    """ The seconds a host asked us to wait before retrying, from Retry-After or Discord and Telegram's JSON bodies """
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - timezone.now()).total_seconds())
+            except (TypeError, ValueError):
+                return None
+    try:
+        body = response.json()
+        retry_after = body.get('retry_after') or body.get('parameters', {}).get('retry_after')
+        return float(retry_after) if retry_after is not None else None
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def post(url, payload, timeout=DEFAULT_TIMEOUT):
+    """
+    POST a JSON payload to a webhook over the shared session.
+
+    Raises:
+        DeliveryError: If the webhook wasn't delivered
+    """
+    try:
+        response = session.post(url, json=payload, timeout=(min(CONNECT_TIMEOUT, timeout), timeout))
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        if status >= 500 or status in RETRY_STATUSES:
+            raise DeliveryError(f"HTTP {status}", retry_after=_retry_after(e.response)) from e
+        raise DeliveryError(f"HTTP {status}", permanent=True) from e
+    except requests.RequestException as e:
+        raise DeliveryError(str(e)) from e
+    return response
+
+
+@dataclass
+class Webhook:
+    """ A webhook ready to send, holding all it needs so that it can be sent from a thread without the database """
+    url: str
+    payload: dict
+    timeout: float = DEFAULT_TIMEOUT
+    rate: str = DEFAULT_RATE
+
+    @property
+    def rate_limit_key(self):
+        # Webhook URLs hold secrets, so they aren't used as keys directly
+        return "webhook:" + hashlib.sha256(self.url.encode()).hexdigest()[:32]
+
+    @property
+    def parsed_rate(self):
+        return parse_rate(self.rate)
+
+    def send(self):
+        post(self.url, self.payload, timeout=self.timeout)
+
+
+def deliver_concurrently(webhooks):
+    """
+    Send webhooks, at most MAX_CONCURRENT_DELIVERIES at a time, so that one slow destination only delays itself.
+
+    Returns:
+        list: For each webhook in order, the exception it failed with, or None if it was delivered
+    """
+    futures = [_executor.submit(webhook.send) for webhook in webhooks]
+    errors = []
+    for future in futures:
+        try:
+            future.result()
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
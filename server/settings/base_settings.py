@@ -165,6 +165,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'puzzlehunt.team_membership.TeamMembershipMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware",
@@ -281,8 +282,13 @@ IMPERSONATE = {
 
 # Eventstream
 GRIP_URL = 'http://pushpin:5561'
-EVENTSTREAM_STORAGE_CLASS = 'django_eventstream.storage.DjangoModelStorage'
+EVENTSTREAM_STORAGE_CLASS = 'puzzlehunt.retention.PuzzlehuntEventStorage'
+# Minutes that eventstream messages are kept for reconnecting clients before trim_eventstream_storage deletes them
+EVENTSTREAM_RETENTION = 24 * 60
 EVENTSTREAM_CHANNELMANAGER_CLASS = 'puzzlehunt.utils.PuzzlehuntChannelManager'
+# Staff channel messages are published in batches of up to this many events, waiting at most this many ms
+STAFF_EVENT_BATCH_SIZE = 50
+STAFF_EVENT_BATCH_INTERVAL = 250
 EVENTSTREAM_REDIS = {
     'host': 'redis',
     'port': 6379,
@@ -295,7 +301,14 @@ HUEY = {
     'immediate': False,
     'connection': {
         'host': 'redis',
-    }
+    },
+    'consumer': {
+        # Several workers let the unlock sweep's shards run in parallel
+        'workers': int(os.getenv("HUEY_WORKERS", default="4")),
+        'worker_type': 'thread',
+        # Clear task locks, such as the unlock shards', left behind by a consumer that was killed mid task
+        'flush_locks': True,
+    },
 }
 
 # ====================
@@ -352,6 +365,15 @@ ANYMAIL = {
         'track_opens': False,
     }
 }
+# Notification emails are gathered for this many seconds, then sent over one connection in batches of up to
+# NOTIFICATION_EMAIL_BATCH_SIZE. All workers together send no faster than NOTIFICATION_EMAIL_MAX_PER_SECOND
+# (Amazon SES's default quota), emails over it wait in the outbox until it allows them.
+NOTIFICATION_EMAIL_BATCH_INTERVAL = 2
+NOTIFICATION_EMAIL_BATCH_SIZE = 50
+NOTIFICATION_EMAIL_MAX_PER_SECOND = 14
+# Send emails with the same content as one anymail batch send. Only for providers that batch send without a
+# stored template, which Amazon SES does not.
+NOTIFICATION_EMAIL_MERGE_BATCHES = False
 
 # ====================
 # DEBUG SETTINGS
@@ -65,6 +65,8 @@ MIGRATION_MODULES = DisableMigrations()
 # Email settings for tests
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 EMAIL_CONFIGURED = True
+# Send notification emails as soon as they are queued, rather than from a scheduled task
+NOTIFICATION_EMAIL_BATCH_INTERVAL = 0
 
 # Disable CSRF checks in tests
 MIDDLEWARE = [m for m in MIDDLEWARE if 'csrf' not in m.lower()] 
@@ -75,6 +77,8 @@ RATELIMIT_ENABLE = False
 # Simplify eventstream settings for tests
 GRIP_URL = ''
 del EVENTSTREAM_REDIS
+# Publish staff channel messages as soon as their transaction commits, rather than from a timer thread
+STAFF_EVENT_BATCH_INTERVAL = 0
 
 STATIC_ROOT = "/tmp/test_static"
 MEDIA_ROOT = "/tmp/test_media"